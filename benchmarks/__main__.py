@@ -0,0 +1,27 @@
+"""
+Run the benchmark suite and write every result as one JSON document.
+
+Compare two runs with benchmarks.report to find regressions between commits.
+
+Usage:
+    python -m benchmarks [--sizes 1000 10000 50000] [--startup-sizes 1000 10000]
+                         [--replay-size 10000] [--replay-count 20000] [--output results.json]
+"""
+
+import argparse
+
+from . import micro, replay, report, startup
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000], help="Registry sizes for the microbenchmarks.")
+    parser.add_argument("--startup-sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--replay-size", type=int, default=10000)
+    parser.add_argument("--replay-count", type=int, default=20000)
+    parser.add_argument("--output", help="Write the JSON results here rather than to stdout.")
+    args = parser.parse_args()
+
+    results = micro.run(args.sizes)
+    results += startup.run(args.startup_sizes)
+    results += replay.run(args.replay_size, args.replay_count)
+    report.write(results, args.output)
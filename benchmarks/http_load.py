@@ -0,0 +1,78 @@
+"""
+Load test for a running Usagi12 server.
+
+Sends /bunny requests from a number of client threads over keep-alive connections
+for a fixed duration, and reports throughput and latency. Redirects are not followed,
+so only the time spent in Usagi12 is measured.
+
+Usage:
+    gunicorn -c gunicorn.conf.py usagi12:app
+    python -m benchmarks.http_load [--url http://127.0.0.1:8080] [--clients 16] [--duration 10]
+"""
+
+import argparse
+import json
+
+from http.client import HTTPConnection
+from itertools import cycle
+from threading import Thread
+from time import perf_counter
+from urllib.parse import quote, urlsplit
+
+# A mix of trigger, slash, language override and fallback queries.
+QUERIES = (
+    "g usagi", "g bunny rabbit -ja", "yt", "tw", "g/slash query",
+    "unknown command with several words", "g " + " ".join("word{}".format(i) for i in range(40)),
+)
+
+def _client(host: str, port: int, duration: float, offset: int, latencies: list, errors: list):
+    connection = HTTPConnection(host, port, timeout=10)
+    queries = cycle(QUERIES[offset % len(QUERIES):] + QUERIES[:offset % len(QUERIES)])
+    headers = {'Accept-Language': "en-US,en;q=0.9,ja;q=0.8"}
+    deadline = perf_counter() + duration
+    while perf_counter() < deadline:
+        start = perf_counter()
+        try:
+            connection.request("GET", "/bunny?query=" + quote(next(queries)), headers=headers)
+            response = connection.getresponse()
+            response.read()
+            if response.status not in (301, 302, 304):
+                errors.append(response.status)
+        except OSError as e:
+            errors.append(str(e))
+            connection.close()
+            connection = HTTPConnection(host, port, timeout=10)
+            continue
+        latencies.append(perf_counter() - start)
+    connection.close()
+
+def _percentile(values: list, fraction: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def run(url: str, clients: int, duration: float) -> dict:
+    parts = urlsplit(url)
+    latencies, errors = list(), list()
+    threads = [Thread(target=_client, args=(parts.hostname, parts.port or 80, duration, i, latencies, errors))
+               for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    return {
+        'clients': clients,
+        'requests': len(latencies),
+        'errors': len(errors),
+        'requests_per_second': round(len(latencies) / duration, 1),
+        'p50_ms': round(_percentile(latencies, 0.5) * 1e3, 2) if latencies else None,
+        'p99_ms': round(_percentile(latencies, 0.99) * 1e3, 2) if latencies else None,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+    print(json.dumps(run(args.url, args.clients, args.duration)))
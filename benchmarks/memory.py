@@ -0,0 +1,75 @@
+"""
+Memory benchmark for the command registry.
+
+Builds a registry of synthetic template commands and reports the memory held by
+the registry per registered binding, excluding the command objects themselves.
+With --compiled, the commands are compiled to a temporary file and mapped (see
+compiled), so only what stays on the Python heap is counted.
+
+Usage:
+    python -m benchmarks.memory [--bindings 50000] [--per-command 2] [--compiled]
+"""
+
+import argparse
+import gc
+import json
+import tracemalloc
+
+from os.path import join
+from tempfile import TemporaryDirectory
+
+from src.athenaeum.compiled import RegistryCompiler
+from src.athenaeum.loader import DEFAULT_LOOKUP
+from src.athenaeum.registry import Registry
+from src.commands.template_command import TemplateCommand
+
+def synthetic_commands(bindings: int, per_command: int):
+    """
+    Generate template commands with `per_command` triggers each, `bindings` triggers in total.
+    """
+    commands = list()
+    for i in range(bindings // per_command):
+        commands.append(TemplateCommand("synthetic:{}".format(i), {
+            'args': True,
+            'description': "Synthetic command {}".format(i),
+            'default': "https://example.com/{}".format(i),
+            'triggers': ["c{}x{}".format(i, j) for j in range(per_command)],
+            'urls': {'*': "https://example.com/{}/search?q={{query}}".format(i)},
+        }))
+    return commands
+
+def measure(bindings: int, per_command: int, compiled: bool = False) -> dict:
+    with TemporaryDirectory() as root:
+        return _measure(bindings, per_command, join(root, "registry.compiled") if compiled else None)
+
+def _measure(bindings: int, per_command: int, path) -> dict:
+    commands = synthetic_commands(bindings, per_command)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+
+    registry = Registry(compiler=RegistryCompiler(path) if path else None)
+    for command in commands:
+        registry.add_command(command)
+    registry.finalise(DEFAULT_LOOKUP)
+
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    total = sum(s.size_diff for s in after.compare_to(before, 'filename'))
+    return {
+        'bindings': len(registry.triggers),
+        'commands': len(commands),
+        'compiled': path is not None,
+        'registry_bytes': total,
+        'bytes_per_binding': round(total / max(len(registry.triggers), 1), 1),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bindings", type=int, default=50000)
+    parser.add_argument("--per-command", type=int, default=2)
+    parser.add_argument("--compiled", action="store_true", help="Compile the commands to a mapped file.")
+    args = parser.parse_args()
+    print(json.dumps(measure(args.bindings, args.per_command, args.compiled)))
@@ -0,0 +1,123 @@
+"""
+Microbenchmarks for the /bunny hot path, on synthetic registries of several sizes.
+
+Covers primoroot.search for each way a query can be matched (with the result cache
+disabled, and for a cache hit), language.get_languages, and LookupItem.redirect
+for template, Python and guarded commands.
+
+Usage:
+    python -m benchmarks.micro [--sizes 1000 10000 50000] [--output micro.json]
+"""
+
+import argparse
+
+from contextlib import contextmanager
+from timeit import Timer
+from typing import Any, Callable, Dict, List
+
+from langcodes import Language
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+
+from commands.google import Google
+from src.athenaeum import loader, primoroot
+from src.athenaeum.cache import LRUCache
+from src.athenaeum.guard import COMMAND_TIME_BUDGET, CommandGuard
+from src.athenaeum.lookup_item import LookupItem
+from src.athenaeum.query import parse_query
+from src.http import language
+
+from . import report
+from .synthetic import SyntheticRegexCommand, build_registry, split, template_command
+
+ACCEPT_LANGUAGE = "ja,en-US;q=0.9,en;q=0.8"
+
+def time_us(fn: Callable[[], Any], repeat: int = 5) -> float:
+    """
+    Return the best time of one call of fn, in microseconds, over `repeat` runs long enough to time.
+    """
+    timer = Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number * 1e6
+
+@contextmanager
+def _without_cache(cache: LRUCache):
+    """
+    Empty and disable a cache while timing, then restore its entries and size.
+    """
+    entries, maxsize = cache.entries(), cache.maxsize
+    cache.maxsize = 0
+    cache.clear()
+    try:
+        yield
+    finally:
+        cache.maxsize = maxsize
+        for key, value in entries:
+            cache.put(key, value)
+
+def bench_search(size: int) -> List[Dict[str, Any]]:
+    loader._swap(build_registry(size))
+    triggers, slashes, regexes = split(size)
+    accept = language.resolve_languages(parse_query("x"), language.parse_accept_languages(_request()))
+    queries = {
+        'trigger': "t{} cats".format(triggers // 2),
+        'slash': "s{}/cats".format(slashes // 2),
+        'regex': "r{}-42".format(regexes - 1),
+        'fallback': "no command matches this query",
+    }
+
+    results = list()
+    for mode, text in queries.items():
+        query = parse_query(text)
+        # Every iteration dispatches and redirects, as a first request for the query would.
+        with _without_cache(primoroot.RESULT_CACHE):
+            miss = time_us(lambda: primoroot.search(query, accept))
+        results.append({'benchmark': "search", 'size': size, 'mode': mode, 'time_us': round(miss, 3)})
+    query = parse_query(queries['trigger'])
+    primoroot.search(query, accept)
+    results.append({'benchmark': "search", 'size': size, 'mode': "cached",
+                    'time_us': round(time_us(lambda: primoroot.search(query, accept)), 3)})
+    return results
+
+def _request(query: str = "t1 cats") -> Request:
+    return Request(EnvironBuilder(path="/bunny", query_string={'query': query},
+                                  headers={'Accept-Language': ACCEPT_LANGUAGE}).get_environ())
+
+def bench_languages() -> List[Dict[str, Any]]:
+    req, query = _request(), parse_query("t1 cats -fr")
+    cached = time_us(lambda: language.get_languages(req, query))
+    with _without_cache(language.ACCEPT_LANGUAGE_CACHE):
+        parsed = time_us(lambda: language.get_languages(_request(), query))
+    # The request is built in both, so its cost is measured on its own and left out.
+    build = time_us(_request)
+    return [
+        {'benchmark': "get_languages", 'mode': "cached", 'time_us': round(cached, 3)},
+        {'benchmark': "get_languages", 'mode': "parsed", 'time_us': round(max(parsed - build, 0), 3)},
+    ]
+
+def bench_redirect() -> List[Dict[str, Any]]:
+    args, ja = ("t1", "cats"), Language.get("ja")
+    # Google formats urls inline by default, so it is guarded here to measure the guard.
+    google = Google()
+    items = {
+        'template': LookupItem.from_command(template_command(1)),
+        'python': LookupItem.from_command(SyntheticRegexCommand(0), guarded=False),
+        'guarded': LookupItem(google.redirect, google.languages, guard=CommandGuard(google.qualified_name, COMMAND_TIME_BUDGET)),
+    }
+    return [{'benchmark': "redirect", 'command': kind, 'time_us': round(time_us(lambda: item.redirect(ja, args)), 3)}
+            for kind, item in items.items()]
+
+def run(sizes: List[int]) -> List[Dict[str, Any]]:
+    previous = loader.REGISTRY
+    try:
+        results = [r for size in sizes for r in bench_search(size)]
+    finally:
+        loader._swap(previous)
+    return results + bench_languages() + bench_redirect()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--output", help="Write the JSON results here rather than to stdout.")
+    args = parser.parse_args()
+    report.write(run(args.sizes), args.output)
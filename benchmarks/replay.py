@@ -0,0 +1,111 @@
+"""
+Query replay harness for /bunny.
+
+Sends a query log through the Flask test client, one request at a time, and reports
+latency percentiles and requests per second. The log is either a recorded file, or
+generated against a synthetic registry of the given size, which then replaces the
+commands of this checkout for the run.
+
+A recorded log has one query per line, or one JSON object per line with a "query"
+and an optional "accept_language". Record one only from your own usage: Usagi12
+never logs queries unless access logging is turned on.
+
+Usage:
+    python -m benchmarks.replay --size 10000 [--count 20000] [--output replay.json]
+    python -m benchmarks.replay --log queries.jsonl --output replay.json
+
+Requests go through the whole app, access logging included, so pass --output
+to keep the results apart from the access log on stdout.
+"""
+
+import argparse
+import json
+
+from collections import Counter
+from time import perf_counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from src.athenaeum import loader
+
+from . import report
+from .synthetic import build_registry, query_log
+
+DEFAULT_ACCEPT_LANGUAGE = "en-US,en;q=0.9,ja;q=0.8"
+
+def read_log(path: str) -> List[Tuple[str, str]]:
+    """
+    Return the (query, Accept-Language) pairs of a recorded log.
+    """
+    entries = list()
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                entry = json.loads(line)
+                entries.append((entry['query'], entry.get('accept_language') or DEFAULT_ACCEPT_LANGUAGE))
+            else:
+                entries.append((line, DEFAULT_ACCEPT_LANGUAGE))
+    return entries
+
+def _percentile(values: List[float], fraction: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def replay(entries: Iterable[Tuple[str, str]], warmup: int = 500) -> Dict[str, Any]:
+    """
+    Send every (query, Accept-Language) pair to /bunny and measure each request.
+    The first `warmup` requests are sent again beforehand and not measured.
+    """
+    # Imported here, as importing the app loads the commands of the checkout.
+    from usagi12 import app
+    client = app.test_client()
+    entries = list(entries)
+
+    for query, accept in entries[:warmup]:
+        client.get("/bunny", query_string={'query': query}, headers={'Accept-Language': accept})
+
+    latencies, statuses = list(), Counter()
+    start = perf_counter()
+    for query, accept in entries:
+        sent = perf_counter()
+        response = client.get("/bunny", query_string={'query': query}, headers={'Accept-Language': accept})
+        latencies.append(perf_counter() - sent)
+        statuses[str(response.status_code)] += 1
+    elapsed = perf_counter() - start
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'mean_us': round(sum(latencies) / len(latencies) * 1e6, 1),
+        'p50_us': round(_percentile(latencies, 0.50) * 1e6, 1),
+        'p95_us': round(_percentile(latencies, 0.95) * 1e6, 1),
+        'p99_us': round(_percentile(latencies, 0.99) * 1e6, 1),
+        'statuses': dict(statuses),
+    }
+
+def run(size: Optional[int] = None, count: int = 20000, log: Optional[str] = None) -> List[Dict[str, Any]]:
+    if log:
+        result = replay(read_log(log))
+        return [dict({'benchmark': "replay", 'log': log}, **result)]
+
+    # Load the app first, so the synthetic registry replaces the checkout's commands.
+    import usagi12
+    previous = loader.REGISTRY
+    loader._swap(build_registry(size))
+    try:
+        result = replay((query, DEFAULT_ACCEPT_LANGUAGE) for query in query_log(size, count))
+    finally:
+        loader._swap(previous)
+    return [dict({'benchmark': "replay", 'size': size}, **result)]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--size", type=int, help="Replay a synthetic log against a synthetic registry of this size.")
+    source.add_argument("--log", help="Replay a recorded query log against the checkout's commands.")
+    parser.add_argument("--count", type=int, default=20000, help="Number of synthetic queries.")
+    parser.add_argument("--output", help="Write the JSON results here rather than to stdout.")
+    args = parser.parse_args()
+    report.write(run(args.size, args.count, args.log), args.output)
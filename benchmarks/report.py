@@ -0,0 +1,114 @@
+"""
+Machine-readable benchmark results, and comparison between two runs.
+
+Every suite returns a list of results, each a dict with a "benchmark" name, the
+parameters it ran with, and its measurements. Measurements are named with their
+unit as a suffix, and the suffix decides which direction is a regression:
+"_us", "_ms" and "_s" are better lower, "_per_second" is better higher.
+
+Usage:
+    python -m benchmarks --output before.json   (on the old commit)
+    python -m benchmarks --output after.json    (on the new commit)
+    python -m benchmarks.report before.json after.json [--threshold 0.1]
+
+Exits with status 1 if any measurement regressed by more than the threshold.
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+# Fields of a result that are measurements, keyed by suffix, with whether higher is better.
+MEASUREMENT_SUFFIXES = (("_per_second", True), ("_us", False), ("_ms", False), ("_s", False))
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def metadata() -> Dict[str, Any]:
+    """
+    Describe the run, so results from different commits and machines can be told apart.
+    """
+    return {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+    }
+
+def document(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {'meta': metadata(), 'results': results}
+
+def write(results: List[Dict[str, Any]], path: Optional[str] = None):
+    """
+    Write results as a JSON document to the path, or to stdout. Prefer a path for suites
+    that load the app, as its access log also writes to stdout.
+    """
+    text = json.dumps(document(results), indent=2)
+    if path:
+        with open(path, 'w') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+def _direction(field: str) -> Optional[bool]:
+    for suffix, higher_is_better in MEASUREMENT_SUFFIXES:
+        if field.endswith(suffix):
+            return higher_is_better
+    return None
+
+def _key(result: Dict[str, Any]) -> Tuple:
+    return tuple(sorted((k, v) for k, v in result.items() if _direction(k) is None and not isinstance(v, (dict, list))))
+
+def compare(before: Dict[str, Any], after: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    """
+    Pair up the results of two runs by benchmark and parameters, and return the relative
+    change of every measurement. A change is a regression if it is worse by more than threshold.
+    """
+    previous = {_key(r): r for r in before['results']}
+    changes = list()
+    for result in after['results']:
+        old = previous.get(_key(result))
+        if old is None:
+            continue
+        for field, value in result.items():
+            higher_is_better = _direction(field)
+            if higher_is_better is None or not old.get(field) or value is None:
+                continue
+            change = (value - old[field]) / old[field]
+            worse = -change if higher_is_better else change
+            changes.append({
+                'benchmark': result['benchmark'],
+                'params': {k: v for k, v in _key(result) if k != 'benchmark'},
+                'field': field,
+                'before': old[field],
+                'after': value,
+                'change': round(change, 4),
+                'regression': worse > threshold,
+            })
+    return changes
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change counted as a regression.")
+    args = parser.parse_args()
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    changes = compare(before, after, args.threshold)
+    for change in changes:
+        print(json.dumps(change))
+    regressions = sum(1 for c in changes if c['regression'])
+    print("{} measurement(s) compared, {} regression(s) over {:.0%}.".format(len(changes), regressions, args.threshold), file=sys.stderr)
+    sys.exit(1 if regressions else 0)
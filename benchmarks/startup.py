@@ -0,0 +1,74 @@
+"""
+Loader startup benchmark.
+
+Writes a synthetic commands directory of each size to a temporary directory, and
+times importing the loader there in a fresh interpreter: once without a registry
+manifest (every command file imported), and once starting from the manifest and,
+for sizes over COMPILED_REGISTRY_MIN_COMMANDS, the compiled registry.
+
+Usage:
+    python -m benchmarks.startup [--sizes 1000 10000] [--output startup.json]
+"""
+
+import argparse
+import subprocess
+import sys
+
+from os import environ
+from os.path import abspath, dirname, join
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Any, Dict, List
+
+from . import report
+from .synthetic import split, write_commands_dir
+
+ROOT = dirname(dirname(abspath(__file__)))
+
+# Imports the loader and reports how long it took, from inside the child interpreter.
+IMPORT_LOADER = """
+from time import perf_counter
+start = perf_counter()
+from src.athenaeum import loader
+print(perf_counter() - start, len(loader.REGISTRY.triggers), len(loader.REGISTRY.slashes), len(loader.REGISTRY.regexes))
+"""
+
+def _python(cwd: str, code: str) -> str:
+    env = dict(environ)
+    env['PYTHONPATH'] = ROOT + (":" + env['PYTHONPATH'] if env.get('PYTHONPATH') else "")
+    return subprocess.run([sys.executable, "-c", code], cwd=cwd, env=env,
+                          capture_output=True, text=True, check=True).stdout
+
+def measure(size: int) -> List[Dict[str, Any]]:
+    results = list()
+    with TemporaryDirectory() as root:
+        write_commands_dir(root, size, google=join(ROOT, "commands", "google.py"))
+        expected = split(size)
+
+        for manifest in (False, True):
+            if manifest:
+                _python(root, "from src.athenaeum import manifest, loader; loader.save_manifest()")
+            start = perf_counter()
+            seconds, triggers, slashes, regexes = _python(root, IMPORT_LOADER).split("\n")[-2].split()
+            total = perf_counter() - start
+            # The Google command file and the catch-all default add a regex binding each.
+            if (int(triggers), int(slashes), int(regexes) - 2) != expected:
+                raise RuntimeError("Loaded {} bindings, expected {}".format((triggers, slashes, regexes), expected))
+            results.append({
+                'benchmark': "startup",
+                'size': size,
+                'manifest': manifest,
+                'loader_s': round(float(seconds), 3),
+                'process_s': round(total, 3),
+            })
+    return results
+
+def run(sizes: List[int]) -> List[Dict[str, Any]]:
+    return [r for size in sizes for r in measure(size)]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--output", help="Write the JSON results here rather than to stdout.")
+    args = parser.parse_args()
+    report.write(run(args.sizes), args.output)
@@ -0,0 +1,185 @@
+"""
+Synthetic registries and query logs for the benchmarks.
+
+A registry of a given size is split between triggers, slashes and regex bindings
+(by default 70/20/10), and can be built in process, or written out as a commands
+directory for the loader to start from. Query logs draw commands from the same
+registry with a Zipf-like skew, as real usage concentrates on a few triggers.
+"""
+
+import random
+import re
+
+from os import makedirs
+from os.path import join
+from shutil import copy
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import yaml
+
+from langcodes import Language
+from src.athenaeum.loader import DEFAULT_LOOKUP
+from src.athenaeum.registry import Registry
+from src.commands.arguments_command import Usagi12WithArgumentsCommand
+from src.commands.template_command import TemplateCommand
+
+# Share of the bindings given to triggers, slashes and regexes.
+DEFAULT_MIX = (0.7, 0.2, 0.1)
+
+# Template commands per generated definition file, and regex commands per generated class file.
+DEFINITIONS_PER_FILE = 1000
+CLASSES_PER_FILE = 500
+
+def _trigger(i: int) -> str:
+    return "t{}".format(i)
+
+def _slash(i: int) -> str:
+    return "s{}".format(i)
+
+def _regex(i: int) -> str:
+    return r'^r{}-\d+$'.format(i)
+
+def split(size: int, mix: Tuple[float, float, float] = DEFAULT_MIX) -> Tuple[int, int, int]:
+    """
+    Return the number of (triggers, slashes, regexes) in a registry of `size` bindings.
+    """
+    triggers, slashes = int(size * mix[0]), int(size * mix[1])
+    return triggers, slashes, size - triggers - slashes
+
+def _definition(i: int, trigger: Optional[str], slash: Optional[str]) -> Dict:
+    return {
+        'args': True,
+        'description': "Synthetic command {}".format(i),
+        'default': "https://example.com/{}".format(i),
+        'triggers': trigger,
+        'slashes': slash,
+        'urls': {
+            'en': "https://en.example.com/{}/search?q={{query}}".format(i),
+            '*': "https://example.com/{}/search?q={{query}}".format(i),
+        },
+    }
+
+def template_command(i: int) -> TemplateCommand:
+    """
+    Return the synthetic template command bound to trigger i.
+    """
+    return TemplateCommand("synthetic:{}".format(i), _definition(i, _trigger(i), None))
+
+class SyntheticRegexCommand(Usagi12WithArgumentsCommand):
+    """
+    A Python command bound to one synthetic regex, as regex bindings cannot be declared in YAML.
+    """
+
+    def __init__(self, index: int):
+        self._index: int = index
+        self._bindings: Tuple[re.Pattern] = (re.compile(_regex(index)),)
+
+    def redirect(self, args: Tuple[str], language: Optional[Language]) -> str:
+        return "https://example.com/r/{}/{}".format(self._index, args[0])
+
+    @property
+    def bindings(self) -> Optional[Tuple[re.Pattern]]:
+        return self._bindings
+
+    @property
+    def triggers(self) -> Optional[Tuple[str]]:
+        return None
+
+    @property
+    def slashes(self) -> Optional[Tuple[str]]:
+        return None
+
+    @property
+    def languages(self) -> Optional[Tuple[str]]:
+        return None
+
+    @property
+    def description(self) -> str:
+        return "Synthetic regex command {}".format(self._index)
+
+def synthetic_commands(size: int, mix: Tuple[float, float, float] = DEFAULT_MIX) -> List:
+    """
+    Generate the commands of a registry with `size` bindings in total, one binding per command.
+    """
+    triggers, slashes, regexes = split(size, mix)
+    commands = [template_command(i) for i in range(triggers)]
+    commands.extend(TemplateCommand("synthetic:s{}".format(i), _definition(i, None, _slash(i))) for i in range(slashes))
+    commands.extend(SyntheticRegexCommand(i) for i in range(regexes))
+    return commands
+
+def build_registry(size: int, mix: Tuple[float, float, float] = DEFAULT_MIX) -> Registry:
+    """
+    Build and finalise a registry of `size` synthetic bindings, with the usual Google default.
+    """
+    registry = Registry()
+    for command in synthetic_commands(size, mix):
+        registry.add_command(command)
+    registry.finalise(DEFAULT_LOOKUP)
+    return registry
+
+def _regex_class_source(start: int, end: int) -> str:
+    lines = ["import re", "", "from src.commands.arguments_command import Usagi12WithArgumentsCommand", ""]
+    for i in range(start, end):
+        lines.extend([
+            "class Regex{}(Usagi12WithArgumentsCommand):".format(i),
+            "    bindings = (re.compile(r'{}'),)".format(_regex(i)),
+            "    triggers = None",
+            "    slashes = None",
+            "    languages = None",
+            "    description = \"Synthetic regex command {}\"".format(i),
+            "    def redirect(self, args, language):",
+            "        return \"https://example.com/r/{}/\" + args[0]".format(i),
+            "",
+        ])
+    return "\n".join(lines)
+
+def write_commands_dir(root: str, size: int, mix: Tuple[float, float, float] = DEFAULT_MIX, google: Optional[str] = None):
+    """
+    Write a commands directory holding a registry of `size` synthetic bindings under root,
+    as YAML definition files for triggers and slashes and Python class files for regexes.
+
+    Params:
+    - root: Directory to run the loader from. The commands are written to root/commands.
+    - google: Path of the default Google command module, which the loader always imports.
+    """
+    commands = join(root, "commands")
+    makedirs(commands, exist_ok=True)
+    open(join(commands, "__init__.py"), 'w').close()
+    if google:
+        copy(google, join(commands, "google.py"))
+
+    triggers, slashes, regexes = split(size, mix)
+    definitions = [_definition(i, _trigger(i), None) for i in range(triggers)] + \
+                  [_definition(i, None, _slash(i)) for i in range(slashes)]
+    for n, start in enumerate(range(0, len(definitions), DEFINITIONS_PER_FILE)):
+        with open(join(commands, "synthetic{}.yaml".format(n)), 'w') as f:
+            yaml.safe_dump([{k: v for k, v in d.items() if v is not None} for d in definitions[start:start + DEFINITIONS_PER_FILE]], f)
+    for n, start in enumerate(range(0, regexes, CLASSES_PER_FILE)):
+        with open(join(commands, "regex{}.py".format(n)), 'w') as f:
+            f.write(_regex_class_source(start, min(start + CLASSES_PER_FILE, regexes)))
+
+def query_log(size: int, count: int, mix: Tuple[float, float, float] = DEFAULT_MIX, seed: int = 12) -> Iterator[str]:
+    """
+    Generate `count` queries against a synthetic registry of `size` bindings. Commands are
+    drawn with a Zipf-like skew, and one query in ten matches nothing and falls back to Google.
+    """
+    rng = random.Random(seed)
+    triggers, slashes, regexes = split(size, mix)
+    words = ("cats", "weather tokyo", "python re", "usagi", "how to cook rice", "news -ja")
+
+    def pick(n: int) -> int:
+        return min(int(rng.paretovariate(1.2)) - 1, n - 1)
+
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.1:
+            yield "{} {}".format(rng.choice(words), rng.randrange(1000))
+        elif roll < 0.1 + 0.9 * mix[0] and triggers:
+            i = pick(triggers)
+            yield _trigger(i) if rng.random() < 0.2 else "{} {}".format(_trigger(i), rng.choice(words))
+        elif roll < 0.1 + 0.9 * (mix[0] + mix[1]) and slashes:
+            yield "{}/{}".format(_slash(pick(slashes)), rng.choice(words))
+        elif regexes:
+            yield "r{}-{}".format(pick(regexes), rng.randrange(100000))
+        else:
+            yield rng.choice(words)
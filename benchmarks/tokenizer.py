@@ -0,0 +1,63 @@
+"""
+Latency benchmark for query parsing as queries grow long.
+
+Times query.parse_query against the language override regex it replaced, from a
+few words up to several KB, on plain queries and on queries made of many " -"
+search operators (e.g. "g foo -site:a -site:b ... -ja").
+
+Usage:
+    python -m benchmarks.tokenizer [--max-length 8192] [--repeat 50]
+"""
+
+import argparse
+import json
+import re
+
+from timeit import timeit
+
+from src.athenaeum.query import parse_query
+
+# The language override regex used before the tokenizer, kept here as the baseline.
+LANGUAGE_FINDER = re.compile(r'.*(( -.+ )|( -.+$))', re.IGNORECASE)
+
+def plain_query(length: int) -> str:
+    """
+    Build a query of about `length` characters without a language override.
+    """
+    return "g " + " ".join("word{}".format(i) for i in range(max(length // 7, 1)))
+
+def operator_query(length: int) -> str:
+    """
+    Build a query of about `length` characters of " -" search operators, ending in a language override.
+    """
+    return "g foo " + " ".join("-site:example{}.com".format(i) for i in range(max(length // 20, 1))) + " -ja"
+
+def _time(fn, repeat: int) -> float:
+    return min(timeit(fn, number=1) for _ in range(repeat))
+
+def measure(max_length: int, repeat: int) -> list:
+    results = list()
+    for shape, build in (('plain', plain_query), ('operators', operator_query)):
+        length = 32
+        while length <= max_length:
+            query = build(length)
+            # The regex is quadratic on queries without an override, so it is timed fewer times.
+            regex = _time(lambda: LANGUAGE_FINDER.search(query), max(1, min(repeat, 65536 // len(query))))
+            tokenizer = _time(lambda: parse_query(query), repeat)
+            results.append({
+                'shape': shape,
+                'length': len(query),
+                'regex_us': round(regex * 1e6, 1),
+                'tokenizer_us': round(tokenizer * 1e6, 1),
+                'tokenizer_ns_per_char': round(tokenizer * 1e9 / len(query), 1),
+            })
+            length *= 2
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-length", type=int, default=8192)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+    for result in measure(args.max_length, args.repeat):
+        print(json.dumps(result))
@@ -0,0 +1,52 @@
+import re
+
+from langcodes import Language
+from src.athenaeum.backends import BackendError, http_backend
+from src.commands.arguments_command import Usagi12AsyncCommand
+from src.config import settings
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+# A go-links style service, answering GET /<name> with a redirect to the link's target.
+SHORTLINKS = http_backend(settings.get("SHORTLINKS_URL", "http://127.0.0.1:8081"))
+SHORTLINKS_HOME = settings.get("SHORTLINKS_HOME", "http://127.0.0.1:8081/")
+
+class ShortLinks(Usagi12AsyncCommand):
+
+    async def redirect(self, args: Tuple[str], language: Optional[Language]) -> str:
+        if len(args) < 2:
+            return SHORTLINKS_HOME
+        try:
+            response = await SHORTLINKS.get(quote(args[1], safe=""))
+        except BackendError:
+            return SHORTLINKS_HOME
+        return response.headers.get('location', SHORTLINKS_HOME) if 300 <= response.status < 400 else SHORTLINKS_HOME
+
+    @property
+    def description(self) -> str:
+        return """For opening short links, e.g. go/wiki"""
+
+    @property
+    def cacheable(self) -> bool:
+        # Links can be repointed at any time.
+        return False
+
+    @property
+    def default(self) -> Optional[str]:
+        return SHORTLINKS_HOME
+
+    @property
+    def bindings(self) -> Optional[Tuple[re.Pattern]]:
+        return None
+
+    @property
+    def slashes(self) -> Optional[Tuple[str]]:
+        return ("go",)
+
+    @property
+    def triggers(self) -> Optional[Tuple[str]]:
+        return ("go",)
+
+    @property
+    def languages(self) -> Optional[Tuple[Language]]:
+        return None
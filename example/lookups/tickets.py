@@ -0,0 +1,60 @@
+import re
+
+from langcodes import Language
+from src.athenaeum.backends import BackendError, sqlite_backend
+from src.commands.arguments_command import Usagi12AsyncCommand
+from src.config import settings
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+# A local copy of the issue tracker's tickets, with a (key TEXT PRIMARY KEY, url TEXT) table.
+TICKETS = sqlite_backend(settings.get("TICKETS_DB", "tickets.sqlite3"))
+TICKETS_SEARCH = "https://tracker.example.com/search?q={}"
+# Keys of the tracker's projects, e.g. ["USG", "OPS"] or "USG,OPS". Only their tickets
+# are matched, so searches that look like keys (covid-19, mp-40) are left alone.
+# Bindings are kept in the registry manifest, so rebuild it after changing this.
+TICKETS_PROJECTS = settings.get("TICKETS_PROJECTS", ["USG"])
+if isinstance(TICKETS_PROJECTS, str):
+    TICKETS_PROJECTS = TICKETS_PROJECTS.split(",")
+TICKETS_PROJECTS = [p.strip() for p in TICKETS_PROJECTS if p.strip()]
+
+class Tickets(Usagi12AsyncCommand):
+
+    async def redirect(self, args: Tuple[str], language: Optional[Language]) -> str:
+        key = args[0].upper()
+        try:
+            row = await TICKETS.fetch_one("SELECT url FROM tickets WHERE key = ?", (key,))
+        except BackendError:
+            row = None
+        return row[0] if row else TICKETS_SEARCH.format(quote(key))
+
+    @property
+    def description(self) -> str:
+        return """For opening tickets by their key, e.g. USG-123"""
+
+    @property
+    def cacheable(self) -> bool:
+        # Tickets are added to the local copy over time, and backend errors fall back to a search.
+        return False
+
+    @property
+    def default(self) -> Optional[str]:
+        return "https://tracker.example.com/"
+
+    @property
+    def bindings(self) -> Optional[Tuple[re.Pattern]]:
+        if not TICKETS_PROJECTS:
+            return None
+        return (re.compile(r'^(?:{})-\d+$'.format("|".join(re.escape(p) for p in TICKETS_PROJECTS)), re.IGNORECASE),)
+
+    @property
+    def slashes(self) -> Optional[Tuple[str]]:
+        return None
+
+    @property
+    def triggers(self) -> Optional[Tuple[str]]:
+        return None
+
+    @property
+    def languages(self) -> Optional[Tuple[Language]]:
+        return None
@@ -37,4 +37,9 @@ class Youtube(Usagi12WithArgumentsCommand):
     
     @property
     def languages(self) -> Optional[Tuple[Language]]:
-        return None
\ No newline at end of file
+        return None
+
+    @property
+    def deterministic(self) -> Optional[bool]:
+        # Without arguments, the redirect is always the home page.
+        return True
@@ -0,0 +1,44 @@
+"""
+Production gunicorn profile for Usagi12.
+
+The app is preloaded, so commands are imported and the registry is built once in the
+master, then shared copy-on-write with every worker instead of being rebuilt per worker.
+Workers serve requests on a thread pool, as /bunny is short and mostly bound by the
+interpreter, and slow clients or commands should not hold a whole process.
+
+Every value can be overridden with USAGI12_ prefixed environment variables,
+e.g. USAGI12_WORKERS=4 or USAGI12_WORKER_CLASS=sync.
+"""
+
+import gc
+
+from multiprocessing import cpu_count
+
+from src.config import settings
+
+bind = settings.get("BIND", "0.0.0.0:8080")
+preload_app = True
+worker_class = settings.get("WORKER_CLASS", "gthread")
+workers = settings.get("WORKERS", cpu_count())
+threads = settings.get("THREADS", 8)
+# Browsers reuse connections for the suggestions they fetch while the user types.
+keepalive = settings.get("KEEPALIVE", 5)
+timeout = settings.get("WORKER_TIMEOUT", 30)
+
+def when_ready(server):
+    # Move everything built at import, the registry included, out of the collector's reach,
+    # so collections in the workers do not touch, and copy, the shared pages.
+    gc.freeze()
+
+def on_reload(server):
+    # SIGHUP on the master re-forks the workers from the preloaded app, so update
+    # the registry here first, and every new worker starts from the new commands.
+    from src.athenaeum import loader
+    loader.reload()
+    gc.freeze()
+
+def post_worker_init(worker):
+    # Gunicorn resets the signal handlers of its workers, so SIGHUP on a single
+    # worker would stop it instead of reloading its commands.
+    from src.athenaeum import loader
+    loader.install_reload_signal()
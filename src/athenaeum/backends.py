@@ -0,0 +1,403 @@
+"""
+Pooled clients for the backends asynchronous commands look urls up in.
+
+Backends are shared: http_backend() and sqlite_backend() return the same client for
+the same base url or database in a process, so every command using a backend (and
+every reload of those commands) shares its connections and its concurrency limit.
+Identical lookups made while one is already in flight wait on that one instead of
+calling the backend again, so a burst of the same query costs a single call.
+
+Clients only run on the shared event loop (see event_loop), from the redirect of a
+Usagi12AsyncCommand. Their state is rebuilt if the loop changes, e.g. after a fork.
+"""
+
+import asyncio
+import json
+import sqlite3
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, local
+from time import monotonic
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Mapping, Optional, Tuple, TypeVar
+from urllib.parse import urlencode, urlsplit
+
+from src import log
+from src.config import settings
+
+from .event_loop import inherit
+from .metrics import BACKEND_CALLS
+
+# Most requests a backend serves at once. Further lookups wait for one to finish.
+BACKEND_MAX_CONNECTIONS: int = settings.get("BACKEND_MAX_CONNECTIONS", 8)
+# Seconds a single backend call may take, including waiting for a connection.
+BACKEND_TIMEOUT: float = settings.get("BACKEND_TIMEOUT", 2.0)
+# Seconds an idle HTTP connection is kept open for reuse.
+BACKEND_KEEPALIVE: float = settings.get("BACKEND_KEEPALIVE", 30)
+# Largest HTTP response body read, in bytes. Larger responses raise BackendError.
+BACKEND_MAX_BODY_SIZE: int = settings.get("BACKEND_MAX_BODY_SIZE", 1 << 20)
+
+T = TypeVar('T')
+
+class BackendError(Exception):
+    """
+    Raised when a backend cannot be reached, or sends a malformed response.
+    """
+
+class _InFlight:
+
+    __slots__ = ('task', 'waiters')
+
+    def __init__(self, task: asyncio.Future):
+        self.task: asyncio.Future = task
+        self.waiters: int = 0
+
+class Coalescer:
+    """
+    Shares the result of an in-flight call with every identical call made while it runs.
+    """
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._in_flight: Dict[Hashable, _InFlight] = dict()
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
+
+    def _forget(self, key: Hashable, entry: _InFlight):
+        if self._in_flight.get(key) is entry:
+            del self._in_flight[key]
+
+    async def run(self, key: Hashable, call: Callable[[], Awaitable[T]], backend: str = "") -> T:
+        """
+        Return the result of call(), or of the identical call already in flight under key.
+        A caller that gives up, e.g. on running out of its time budget, leaves the call
+        running for the others, and the call is cancelled once every caller has given up.
+        """
+        loop = asyncio.get_event_loop()
+        if loop is not self._loop:
+            self._loop, self._in_flight = loop, dict()
+
+        entry = self._in_flight.get(key)
+        if entry is None:
+            BACKEND_CALLS.inc(backend, "called")
+            entry = self._in_flight[key] = _InFlight(asyncio.ensure_future(call()))
+            entry.task.add_done_callback(lambda _: self._forget(key, entry))
+        else:
+            BACKEND_CALLS.inc(backend, "coalesced")
+
+        entry.waiters += 1
+        try:
+            return await asyncio.shield(entry.task)
+        finally:
+            entry.waiters -= 1
+            if not entry.waiters and not entry.task.done():
+                # Nobody is left waiting, so free its connection and concurrency slot.
+                self._forget(key, entry)
+                entry.task.cancel()
+                BACKEND_CALLS.inc(backend, "cancelled")
+
+class Backend:
+    """
+    A backend with a concurrency limit, whose identical calls are coalesced.
+    """
+
+    def __init__(self, name: str, max_connections: int, timeout: float):
+        self.name: str = name
+        self.max_connections: int = max_connections
+        self.timeout: float = timeout
+        self.coalescer: Coalescer = Coalescer()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._limit: Optional[asyncio.Semaphore] = None
+
+    def _bind(self) -> asyncio.Semaphore:
+        """
+        Return the concurrency limit of the current loop, resetting any state of a previous loop.
+        """
+        loop = asyncio.get_event_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._limit = asyncio.Semaphore(self.max_connections)
+            self._reset()
+        return self._limit
+
+    def _reset(self):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {'in_flight': len(self.coalescer)}
+
+    async def _call(self, key: Hashable, call: Callable[[], Awaitable[T]]) -> T:
+        limit = self._bind()
+
+        async def limited() -> T:
+            async with limit:
+                return await call()
+
+        try:
+            return await self.coalescer.run(key, lambda: asyncio.wait_for(limited(), self.timeout), self.name)
+        except asyncio.TimeoutError:
+            BACKEND_CALLS.inc(self.name, "timeout")
+            raise BackendError("{} did not answer within {}s".format(self.name, self.timeout))
+
+class HttpResponse:
+    """
+    A response from an HTTP backend. Header names are lowercase.
+    """
+
+    __slots__ = ('status', 'headers', 'body')
+
+    def __init__(self, status: int, headers: Dict[str, str], body: bytes):
+        self.status: int = status
+        self.headers: Dict[str, str] = headers
+        self.body: bytes = body
+
+    @property
+    def text(self) -> str:
+        return self.body.decode('utf-8', 'replace')
+
+    def json(self) -> Any:
+        return json.loads(self.body)
+
+class _Connection:
+
+    __slots__ = ('reader', 'writer', 'idle_since')
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader: asyncio.StreamReader = reader
+        self.writer: asyncio.StreamWriter = writer
+        self.idle_since: float = monotonic()
+
+    def close(self):
+        self.writer.close()
+
+class HttpBackend(Backend):
+    """
+    HTTP/1.1 client of a single origin, keeping up to max_connections keep-alive
+    connections open. Only GET is supported, and redirects are returned rather than
+    followed, as looking up where a short link points is a common use.
+    """
+
+    def __init__(self, base_url: str, max_connections: int = BACKEND_MAX_CONNECTIONS,
+                 timeout: float = BACKEND_TIMEOUT, keepalive: float = BACKEND_KEEPALIVE,
+                 max_body_size: int = BACKEND_MAX_BODY_SIZE):
+        parts = urlsplit(base_url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError("Not an http(s) url: {}".format(base_url))
+        super().__init__(base_url, max_connections, timeout)
+        self.host: str = parts.hostname
+        self.port: int = parts.port or (443 if parts.scheme == "https" else 80)
+        self.tls: bool = parts.scheme == "https"
+        self.prefix: str = parts.path.rstrip("/")
+        self.keepalive: float = keepalive
+        self.max_body_size: int = max_body_size
+        self._host_header: str = parts.netloc.rsplit("@", 1)[-1]
+        self._idle: Deque[_Connection] = deque()
+
+    def _reset(self):
+        # Connections of a previous loop cannot be used from this one, nor closed from it.
+        if self._idle:
+            inherit(self._idle)
+        self._idle = deque()
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(super().stats(), idle=len(self._idle))
+
+    async def get(self, path: str, params: Optional[Mapping[str, Any]] = None, headers: Optional[Mapping[str, str]] = None) -> HttpResponse:
+        """
+        GET a path below the base url, with optional query parameters and headers.
+        The path must already be url-quoted. Raises BackendError if the backend cannot be reached or does not answer in time.
+        """
+        target = self.prefix + "/" + path.lstrip("/")
+        if params:
+            target += ("&" if "?" in target else "?") + urlencode(params)
+        extra = tuple(sorted((headers or dict()).items()))
+        return await self._call((target, extra), lambda: self._request(target, extra))
+
+    async def get_json(self, path: str, params: Optional[Mapping[str, Any]] = None) -> Any:
+        """
+        GET a path and decode its JSON body. Raises BackendError unless the status is 200.
+        """
+        response = await self.get(path, params, {'Accept': "application/json"})
+        if response.status != 200:
+            raise BackendError("{} answered {} for {}".format(self.name, response.status, path))
+        return response.json()
+
+    async def _request(self, target: str, headers: Tuple[Tuple[str, str]]) -> HttpResponse:
+        request = "GET {} HTTP/1.1\r\nHost: {}\r\nUser-Agent: Usagi12\r\nAccept-Encoding: identity\r\n{}\r\n".format(
+            target, self._host_header, "".join("{}: {}\r\n".format(k, v) for k, v in headers)).encode('latin-1')
+
+        connection = self._checkout()
+        reused = connection is not None
+        while True:
+            if connection is None:
+                connection = await self._connect()
+            try:
+                connection.writer.write(request)
+                await connection.writer.drain()
+                response, reusable = await self._read_response(connection.reader, self.max_body_size)
+            except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, BackendError) as e:
+                connection.close()
+                # The server may have closed an idle connection just as it was reused, so retry once on a new one.
+                if reused:
+                    connection, reused = None, False
+                    continue
+                raise e if isinstance(e, BackendError) else BackendError("{}: {}".format(self.name, e))
+            except BaseException:
+                connection.close()
+                raise
+            if reusable:
+                connection.idle_since = monotonic()
+                self._idle.append(connection)
+            else:
+                connection.close()
+            return response
+
+    def _checkout(self) -> Optional[_Connection]:
+        now = monotonic()
+        while self._idle:
+            connection = self._idle.pop()
+            if now - connection.idle_since < self.keepalive and not connection.reader.at_eof():
+                return connection
+            connection.close()
+        return None
+
+    async def _connect(self) -> _Connection:
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port, ssl=self.tls or None)
+        except OSError as e:
+            raise BackendError("Could not connect to {}: {}".format(self.name, e))
+        return _Connection(reader, writer)
+
+    @staticmethod
+    async def _read_response(reader: asyncio.StreamReader, max_body_size: int) -> Tuple[HttpResponse, bool]:
+        """
+        Read a response, and return it with whether the connection can be reused.
+        Raises BackendError if its body is larger than max_body_size.
+        """
+        status_line = await reader.readuntil(b"\r\n")
+        try:
+            version, status = status_line.split(None, 2)[:2]
+            status = int(status)
+        except ValueError:
+            raise BackendError("Malformed status line: {!r}".format(status_line[:100]))
+
+        headers: Dict[str, str] = dict()
+        while True:
+            line = await reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode('latin-1').partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        reusable = version == b"HTTP/1.1" and headers.get('connection', "").lower() != "close"
+        if status < 200 or status in (204, 304):
+            body = b""
+        elif headers.get('transfer-encoding', "").lower() == "chunked":
+            chunks, total = list(), 0
+            while True:
+                size = int((await reader.readuntil(b"\r\n")).split(b";", 1)[0], 16)
+                total += size
+                if total > max_body_size:
+                    raise BackendError("Response body larger than {} bytes".format(max_body_size))
+                if not size:
+                    # Skip any trailers, up to the blank line ending the response.
+                    while await reader.readuntil(b"\r\n") != b"\r\n":
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b"".join(chunks)
+        elif 'content-length' in headers:
+            length = int(headers['content-length'])
+            if length > max_body_size:
+                raise BackendError("Response body larger than {} bytes".format(max_body_size))
+            body = await reader.readexactly(length)
+        else:
+            # Delimited by the server closing the connection.
+            body, reusable = await reader.read(max_body_size + 1), False
+            while len(body) <= max_body_size:
+                more = await reader.read(max_body_size + 1 - len(body))
+                if not more:
+                    break
+                body += more
+            if len(body) > max_body_size:
+                raise BackendError("Response body larger than {} bytes".format(max_body_size))
+        return HttpResponse(status, headers, body), reusable
+
+class SQLiteBackend(Backend):
+    """
+    Read-only client of a SQLite database. SQLite has no asynchronous interface, so
+    queries run on a pool of max_connections threads, each with its own connection.
+    """
+
+    def __init__(self, path: str, max_connections: int = 4, timeout: float = BACKEND_TIMEOUT):
+        super().__init__("sqlite:{}".format(path), max_connections, timeout)
+        self.path: str = path
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._connections = local()
+
+    def _reset(self):
+        # Threads do not survive a fork, so the pool of a previous loop may be gone.
+        self._executor = ThreadPoolExecutor(self.max_connections, thread_name_prefix="usagi12-sqlite")
+        self._connections = local()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._connections, 'connection', None)
+        if connection is None:
+            connection = self._connections.connection = sqlite3.connect("file:{}?mode=ro".format(self.path), uri=True)
+        return connection
+
+    def _execute(self, sql: str, params: Tuple, one: bool):
+        try:
+            cursor = self._connection().execute(sql, params)
+            return cursor.fetchone() if one else cursor.fetchall()
+        except sqlite3.Error as e:
+            raise BackendError("{}: {}".format(self.name, e))
+
+    async def _run(self, sql: str, params: Tuple, one: bool):
+        self._bind()
+        loop = asyncio.get_event_loop()
+        return await self._call((sql, params, one), lambda: loop.run_in_executor(self._executor, self._execute, sql, params, one))
+
+    async def fetch_one(self, sql: str, params: Tuple = tuple()) -> Optional[Tuple]:
+        """
+        Return the first row of a query, or None.
+        """
+        return await self._run(sql, tuple(params), True)
+
+    async def fetch_all(self, sql: str, params: Tuple = tuple()) -> List[Tuple]:
+        """
+        Return every row of a query.
+        """
+        return await self._run(sql, tuple(params), False)
+
+# Shared backends by kind and address.
+BACKENDS: Dict[Tuple[str, str], Backend] = dict()
+_BACKENDS_LOCK = Lock()
+
+def _shared(key: Tuple[str, str], create: Callable[[], Backend]) -> Backend:
+    with _BACKENDS_LOCK:
+        backend = BACKENDS.get(key)
+        if backend is None:
+            backend = BACKENDS[key] = create()
+            log.debug("Created {} backend {}.", key[0], backend.name)
+        return backend
+
+def http_backend(base_url: str, **options) -> HttpBackend:
+    """
+    Return the shared HttpBackend of a base url. Options only apply when it is first created.
+    """
+    return _shared(("http", base_url.rstrip("/")), lambda: HttpBackend(base_url, **options))
+
+def sqlite_backend(path: str, **options) -> SQLiteBackend:
+    """
+    Return the shared SQLiteBackend of a database file. Options only apply when it is first created.
+    """
+    return _shared(("sqlite", path), lambda: SQLiteBackend(path, **options))
+
+def backend_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Return the in-flight calls of every backend, and the idle connections of HTTP backends.
+    """
+    return {b.name: b.stats() for b in list(BACKENDS.values())}
@@ -0,0 +1,184 @@
+"""
+Offline resolution of large query logs on a pool of processes.
+
+Queries are read from a file or stdin and sent in chunks to worker processes,
+each of which loads the registry once, so resolution is not bound by a single
+interpreter. Urls are written to stdout as JSONL in input order, and only a fixed
+number of chunks is ever in flight, so memory use does not grow with the input.
+
+Each input line is a query, or a JSON object with a "query", an optional
+"language" hint and an optional "accept_language" header. Each output line is
+{"line": n, "query": ..., "url": ...}, with a null url for blank queries and for
+queries whose command raised an error.
+
+Usage:
+    python -m src.athenaeum.batch [queries.txt|-] [--workers N] [--chunk-size 1000]
+                                  [--accept-language "en-US,en;q=0.9"] > urls.jsonl
+"""
+
+import argparse
+import json
+import sys
+
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool, cpu_count
+from resource import RUSAGE_CHILDREN, RUSAGE_SELF, getrusage
+from time import perf_counter
+from typing import Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from src import log
+from src.config import settings
+
+# Lines sent to a worker at a time.
+BATCH_CHUNK_SIZE: int = settings.get("BATCH_CHUNK_SIZE", 1000)
+
+# Accept-Language used for lines that do not give their own, set in each worker.
+_accept_language: str = ""
+
+def _init_worker(accept_language: str):
+    """
+    Load the registry in a new worker, before it is handed any work.
+    """
+    global _accept_language
+    _accept_language = accept_language
+    from src.athenaeum import loader
+    loader.REGISTRY
+
+def _text(value) -> Optional[str]:
+    return value if isinstance(value, str) else None
+
+def _read(line: str) -> Tuple[str, Optional[str], Optional[str]]:
+    """
+    Return the (query, language hint, Accept-Language) of an input line.
+    Hints and headers that are not strings are ignored.
+    """
+    if line.startswith("{"):
+        try:
+            entry = json.loads(line)
+            return str(entry.get('query') or ""), _text(entry.get('language')), _text(entry.get('accept_language'))
+        except (ValueError, AttributeError):
+            pass
+    return line.rstrip("\r\n"), None, None
+
+def resolve_chunk(chunk: Tuple[int, List[str]]) -> str:
+    """
+    Resolve the lines of a chunk, and return their JSONL output as a single string.
+
+    Params:
+    - chunk: The line number of the first line, and the lines.
+    """
+    from src.athenaeum import primoroot
+    from src.athenaeum.query import parse_query
+    from src.http.language import parse_accept_header, resolve_languages
+
+    first, lines = chunk
+    entries = [_read(line) for line in lines]
+    resolvable = list()
+    for index, (query, hint, accept) in enumerate(entries):
+        if not query.strip():
+            continue
+        try:
+            parsed = parse_query(query)
+            resolvable.append((index, (parsed, resolve_languages(parsed, parse_accept_header(accept or _accept_language), hint))))
+        except Exception as e:
+            log.warning("Caught error reading batch line {}: {}", first + index, e)
+
+    urls: List[Optional[str]] = [None] * len(entries)
+    try:
+        results = primoroot.search_many(q for _, q in resolvable)
+    except Exception as e:
+        # Find the lines at fault by resolving them one at a time, so only their urls are lost.
+        log.warning("Caught error resolving batch from line {}, retrying line by line: {}", first, e)
+        results = [_resolve_one(primoroot.search_many, q) for _, q in resolvable]
+    for (index, _), url in zip(resolvable, results):
+        urls[index] = url
+
+    return "".join(json.dumps({'line': first + i, 'query': query, 'url': url}, ensure_ascii=False) + "\n"
+                   for i, ((query, _, _), url) in enumerate(zip(entries, urls)))
+
+def _resolve_one(search_many, query) -> Optional[str]:
+    try:
+        return search_many((query,))[0]
+    except Exception as e:
+        log.warning("Caught error resolving batch query {!r}: {}", query[0].command, e)
+        return None
+
+def chunks(lines: Iterable[str], size: int) -> Iterator[Tuple[int, List[str]]]:
+    """
+    Split lines into (first line number, lines) chunks of up to `size` lines, lazily.
+    """
+    lines = iter(lines)
+    first = 1
+    while True:
+        chunk = list(islice(lines, size))
+        if not chunk:
+            return
+        yield first, chunk
+        first += len(chunk)
+
+def run(source: TextIO, out: TextIO, workers: int, chunk_size: int = BATCH_CHUNK_SIZE,
+        in_flight: Optional[int] = None, accept_language: str = "") -> int:
+    """
+    Resolve every line of source and write the results to out, in input order.
+    Returns the number of lines resolved.
+
+    Params:
+    - workers: Number of worker processes. With 1 or fewer, lines are resolved in this process.
+    - chunk_size: Lines sent to a worker at a time.
+    - in_flight: Most chunks submitted but not yet written out. Defaults to twice the workers.
+                 Bounds memory use, along with chunk_size.
+    - accept_language: Accept-Language header for lines that do not give one.
+    """
+    count = 0
+    if workers <= 1:
+        _init_worker(accept_language)
+        for chunk in chunks(source, chunk_size):
+            out.write(resolve_chunk(chunk))
+            count += len(chunk[1])
+        return count
+
+    in_flight = in_flight or 2 * workers
+    with Pool(workers, initializer=_init_worker, initargs=(accept_language,)) as pool:
+        # Pool.imap would read the whole input ahead of the workers, so chunks are
+        # submitted one at a time and the oldest is written out before going further.
+        pending = deque()
+        for chunk in chunks(source, chunk_size):
+            pending.append(pool.apply_async(resolve_chunk, (chunk,)))
+            count += len(chunk[1])
+            if len(pending) >= in_flight:
+                out.write(pending.popleft().get())
+        while pending:
+            out.write(pending.popleft().get())
+        pool.close()
+        pool.join()
+    return count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", nargs="?", default="-", help="File of queries, or - for stdin.")
+    parser.add_argument("--workers", type=int, default=cpu_count())
+    parser.add_argument("--chunk-size", type=int, default=BATCH_CHUNK_SIZE)
+    parser.add_argument("--in-flight", type=int, help="Most chunks in flight at once. Defaults to twice the workers.")
+    parser.add_argument("--accept-language", default="", help="Accept-Language for lines that do not give one.")
+    args = parser.parse_args()
+
+    start = perf_counter()
+    source = sys.stdin if args.input == "-" else open(args.input, 'r', encoding='utf-8')
+    try:
+        count = run(source, sys.stdout, args.workers, args.chunk_size, args.in_flight, args.accept_language)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    sys.stdout.flush()
+    elapsed = perf_counter() - start
+
+    # ru_maxrss is in KiB on Linux. The children figure is the largest worker, once they have exited.
+    print(json.dumps({
+        'queries': count,
+        'seconds': round(elapsed, 2),
+        'queries_per_second': round(count / elapsed, 1) if elapsed else None,
+        'workers': max(args.workers, 1),
+        'max_rss_kib': getrusage(RUSAGE_SELF).ru_maxrss,
+        'max_worker_rss_kib': getrusage(RUSAGE_CHILDREN).ru_maxrss,
+    }), file=sys.stderr)
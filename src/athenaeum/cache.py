@@ -0,0 +1,93 @@
+"""
+Bounded caches used on the request path, and a shared stats surface for them.
+"""
+
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Hashable, List, Tuple
+
+# Sentinel for cache misses, as None can be a legitimate cached value.
+MISSING = object()
+
+# All caches created in this process, by name, so their counters can be reported together.
+CACHES: Dict[str, "LRUCache"] = dict()
+
+class LRUCache:
+    """
+    A thread-safe, size-bounded least-recently-used cache with hit/miss/eviction counters.
+    """
+
+    def __init__(self, name: str, maxsize: int):
+        self.name: str = name
+        self.maxsize: int = maxsize
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock: Lock = Lock()
+        CACHES[name] = self
+
+    def get(self, key: Hashable) -> Any:
+        """
+        Return the cached value for the key, or MISSING if there is none.
+        """
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return MISSING
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        """
+        Store a value, evicting the least recently used entry if the cache is full.
+        """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key: Hashable):
+        """
+        Remove the entry for the key, if there is one.
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def entries(self) -> List[Tuple[Hashable, Any]]:
+        """
+        Return a copy of the cached (key, value) pairs, least recently used first.
+        """
+        with self._lock:
+            return list(self._data.items())
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0,
+            }
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+def cache_stats() -> Dict[str, Dict[str, float]]:
+    """
+    Return the counters of every cache in this process, keyed by cache name.
+    """
+    return {name: cache.stats() for name, cache in CACHES.items()}
@@ -0,0 +1,357 @@
+"""
+Compiled registry of template commands, shared between processes by memory-mapping it.
+
+Large definition files and bang sets make up most of a registry, and each process
+would otherwise hold its own trie nodes, LookupItems and TemplateCommands for every
+one of them. The loader instead writes their triggers and slashes once, as tables
+in a read-only file, which every process maps. Lookups go through the hash index of
+the mapped tables directly, and an entry is only turned into a LookupItem the first
+time it is hit. Commands written in Python stay in the in-memory trie.
+
+File layout, all integers little-endian:
+- magic (8 bytes), header length (uint32), header (JSON)
+- entries: (offset, length) of each command's JSON definition in the blob
+- for triggers, then slashes:
+  - bindings: (key offset, key length, display offset, display length, entry),
+    sorted by the UTF-8 bytes of the case-folded key, for prefix completion
+  - slots: open addressing hash index of the bindings by CRC-32 of the folded key,
+    holding binding index + 1, or 0 for an empty slot, for exact lookups
+- blob: keys and definitions
+"""
+
+import json
+import mmap
+
+from ayumi import Ayumi
+
+from heapq import nsmallest
+from os import getpid, replace
+from os.path import exists
+from struct import Struct
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+from zlib import crc32
+
+from src.commands.template_command import TemplateCommand
+from src.config import settings
+
+from .lookup_item import LookupItem
+from .trie import Trie
+
+# Where the loader writes the compiled registry. Empty to keep every command in memory.
+COMPILED_REGISTRY_PATH: Optional[str] = settings.get("COMPILED_REGISTRY_PATH", "registry.compiled")
+
+# Template commands needed before the registry is compiled. Smaller sets gain nothing from it.
+COMPILED_REGISTRY_MIN_COMMANDS: int = settings.get("COMPILED_REGISTRY_MIN_COMMANDS", 1000)
+
+COMPILED_VERSION = 1
+
+_MAGIC = b"USAGI12R"
+_LENGTH = Struct("<I")
+_ENTRY = Struct("<II")
+_BINDING = Struct("<IIIII")
+_SLOT = Struct("<I")
+
+# Completions of prefixes up to this length are memoized, as they cover the most keys.
+_MEMOIZED_PREFIX = 2
+
+Buffer = Union[bytes, mmap.mmap]
+
+class MappedTable:
+    """
+    Read-only table of triggers or slashes in a compiled registry. Supports the lookups
+    of Trie, and is used as the backing table of one (see Trie.backing).
+    """
+
+    __slots__ = ('_buffer', '_start', '_count', '_slots', '_mask', '_blob', '_item', '_completions')
+
+    def __init__(self, buffer: Buffer, start: int, count: int, slots: int, slot_count: int, blob: int, item):
+        self._buffer: Buffer = buffer
+        self._start: int = start
+        self._count: int = count
+        self._slots: int = slots
+        # The number of slots is a power of two.
+        self._mask: int = slot_count - 1
+        self._blob: int = blob
+        self._item = item
+        self._completions: Dict[str, List[Tuple[str, LookupItem]]] = dict()
+
+    def _key(self, index: int) -> bytes:
+        offset, length = _BINDING.unpack_from(self._buffer, self._start + index * _BINDING.size)[:2]
+        offset += self._blob
+        return self._buffer[offset:offset + length]
+
+    def _find(self, key: bytes) -> int:
+        """
+        Return the index of the first binding whose folded key is not less than key.
+        """
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _index(self, key: str) -> int:
+        """
+        Return the index of the binding of the key, ignoring case, or -1.
+        """
+        buffer, slots, mask, start, blob = self._buffer, self._slots, self._mask, self._start, self._blob
+        folded = key.casefold().encode()
+        slot = crc32(folded) & mask
+        while True:
+            index = _SLOT.unpack_from(buffer, slots + slot * _SLOT.size)[0] - 1
+            if index < 0:
+                return -1
+            offset, length = _BINDING.unpack_from(buffer, start + index * _BINDING.size)[:2]
+            if length == len(folded) and buffer[blob + offset:blob + offset + length] == folded:
+                return index
+            slot = (slot + 1) & mask
+
+    def _binding(self, index: int) -> Tuple[str, str, int]:
+        offset, length, display, display_length, entry = _BINDING.unpack_from(self._buffer, self._start + index * _BINDING.size)
+        offset, display = offset + self._blob, display + self._blob
+        return (self._buffer[offset:offset + length].decode(),
+                self._buffer[display:display + display_length].decode(), entry)
+
+    def __contains__(self, key: str) -> bool:
+        return self._index(key) >= 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def get(self, key: Optional[str], default: Optional[LookupItem] = None) -> Optional[LookupItem]:
+        if key is None:
+            return default
+        index = self._index(key)
+        if index < 0:
+            return default
+        return self._item(_BINDING.unpack_from(self._buffer, self._start + index * _BINDING.size)[4])
+
+    def items(self) -> Iterator[Tuple[str, LookupItem]]:
+        for index in range(self._count):
+            _, display, entry = self._binding(index)
+            yield display, self._item(entry)
+
+    def complete(self, prefix: str, limit: int) -> List[Tuple[str, LookupItem]]:
+        """
+        Return up to `limit` (key, LookupItem) pairs whose key starts with the prefix,
+        ignoring case, in the same order as Trie.complete.
+        """
+        folded = prefix.casefold()
+        completions = self._completions.get(folded)
+        if completions is not None:
+            return completions
+
+        # UTF-8 never contains 0xff, so every key starting with the prefix sorts before prefix + 0xff.
+        key = folded.encode()
+        found = nsmallest(limit, (self._binding(i) for i in range(self._find(key), self._find(key + b"\xff"))),
+                          key=lambda b: (len(b[0]), b[0]))
+        completions = [(display, self._item(entry)) for _, display, entry in found]
+        if len(folded) <= _MEMOIZED_PREFIX:
+            self._completions[folded] = completions
+        return completions
+
+class CompiledRegistry:
+    """
+    A compiled registry file, mapped read-only, or its contents in memory.
+    """
+
+    def __init__(self, buffer: Buffer, path: Optional[str] = None):
+        if buffer[:len(_MAGIC)] != _MAGIC:
+            raise ValueError("Not a compiled registry")
+        length = _LENGTH.unpack_from(buffer, len(_MAGIC))[0]
+        data = len(_MAGIC) + _LENGTH.size
+        header = json.loads(buffer[data:data + length])
+        if header.get('version') != COMPILED_VERSION:
+            raise ValueError("Unknown compiled registry version")
+        data += length
+
+        self.path: Optional[str] = path
+        self.files: List[Dict[str, Any]] = header['files']
+        self._buffer: Buffer = buffer
+        self._entries: int = data + header['entries'][0]
+        self._entry_count: int = header['entries'][1]
+        self._blob: int = data + header['blob']
+        # LookupItems of the entries hit so far, by entry index.
+        self._items: Dict[int, LookupItem] = dict()
+        self.triggers: MappedTable = self._table(data, header['triggers'])
+        self.slashes: MappedTable = self._table(data, header['slashes'])
+
+    def __len__(self) -> int:
+        return self._entry_count
+
+    def _table(self, data: int, layout: List[int]) -> MappedTable:
+        bindings, count, slots, slot_count = layout
+        return MappedTable(self._buffer, data + bindings, count, data + slots, slot_count, self._blob, self.item)
+
+    def _command(self, entry: int) -> TemplateCommand:
+        offset, length = _ENTRY.unpack_from(self._buffer, self._entries + entry * _ENTRY.size)
+        offset += self._blob
+        name, definition = json.loads(self._buffer[offset:offset + length])
+        return TemplateCommand(name, definition)
+
+    def item(self, entry: int) -> LookupItem:
+        """
+        Return the LookupItem of an entry, building it on first use.
+        """
+        item = self._items.get(entry)
+        if item is None:
+            item = self._items.setdefault(entry, LookupItem.from_command(self._command(entry)))
+        return item
+
+    def matches(self, sources: List[Tuple[str, str]]) -> bool:
+        """
+        Whether the registry was compiled from exactly these (path, digest) command files, in order.
+        """
+        return [(f['path'], f['digest']) for f in self.files] == sources
+
+    def commands(self, path: str) -> List[TemplateCommand]:
+        """
+        Decode the template commands of a command file, to compile them again.
+        """
+        for f in self.files:
+            if f['path'] == path and f['entries']:
+                return [self._command(entry) for entry in range(*f['entries'])]
+        return list()
+
+class _PendingTable:
+    """
+    Bindings claimed by template commands while a registry is being compiled.
+    Backs the registry's tries until then, so that the first command to claim a key keeps it.
+    """
+
+    def __init__(self):
+        self.bindings: Dict[str, Tuple[str, int]] = dict()
+
+    def __contains__(self, key: str) -> bool:
+        return key.casefold() in self.bindings
+
+    def __len__(self) -> int:
+        return len(self.bindings)
+
+    def claim(self, key: str, entry: int):
+        self.bindings[key.casefold()] = (key, entry)
+
+class RegistryCompiler:
+    """
+    Collects the template commands of a registry being built, and writes them out as a
+    compiled registry. See Registry.add_command and Registry.finalise.
+    """
+
+    def __init__(self, path: Optional[str] = COMPILED_REGISTRY_PATH):
+        self.path: Optional[str] = path
+        self.files: List[Dict[str, Any]] = list()
+        self.triggers: _PendingTable = _PendingTable()
+        self.slashes: _PendingTable = _PendingTable()
+        self._entries: List[bytes] = list()
+
+    def begin(self, path: str, fingerprint: Tuple[int, int], digest: str, definitions: bool):
+        """
+        Record a command file. Its commands, if any are template commands, must be added next.
+        """
+        if self.files and self.files[-1]['entries']:
+            self.files[-1]['entries'][1] = len(self._entries)
+        self.files.append({
+            'path': path,
+            'fingerprint': list(fingerprint),
+            'digest': digest,
+            'entries': [len(self._entries), len(self._entries)] if definitions else None,
+        })
+
+    def add(self, command: TemplateCommand, triggers: Trie, slashes: Trie):
+        """
+        Add a template command, claiming its triggers and slashes unless already taken.
+
+        Params:
+        - triggers, slashes: The registry's tries, backed by this compiler's pending tables.
+        """
+        entry = len(self._entries)
+        self._entries.append(json.dumps([command.name, command.definition()], separators=(",", ":"), ensure_ascii=False).encode())
+        for binding in command.triggers or list():
+            if binding not in triggers:
+                self.triggers.claim(binding, entry)
+        for binding in command.slashes or list():
+            if binding.endswith("/"): binding = binding[:-1]
+            if binding not in slashes:
+                self.slashes.claim(binding, entry)
+
+    def _serialise(self) -> bytes:
+        if self.files and self.files[-1]['entries']:
+            self.files[-1]['entries'][1] = len(self._entries)
+
+        blob = bytearray()
+        entries = bytearray()
+        for definition in self._entries:
+            entries += _ENTRY.pack(len(blob), len(definition))
+            blob += definition
+
+        sections = [entries]
+        layouts = list()
+        for pending in (self.triggers, self.slashes):
+            bindings = sorted(((k.encode(), v) for k, v in pending.bindings.items()), key=lambda kv: kv[0])
+            records = bytearray()
+            # At most half full, so a lookup takes one or two probes.
+            slot_count = 1 << (2 * len(bindings)).bit_length()
+            slots = [0] * slot_count
+            for index, (folded, (key, entry)) in enumerate(bindings):
+                offset = len(blob)
+                blob.extend(folded)
+                display = offset
+                encoded = key.encode()
+                if encoded != folded:
+                    display = len(blob)
+                    blob.extend(encoded)
+                records += _BINDING.pack(offset, len(folded), display, len(encoded), entry)
+                slot = crc32(folded) & (slot_count - 1)
+                while slots[slot]:
+                    slot = (slot + 1) & (slot_count - 1)
+                slots[slot] = index + 1
+            start = sum(len(s) for s in sections)
+            layouts.append([start, len(bindings), start + len(records), slot_count])
+            sections.extend((bytes(records), Struct("<{}I".format(slot_count)).pack(*slots)))
+
+        header = json.dumps({
+            'version': COMPILED_VERSION,
+            'files': self.files,
+            'entries': [0, len(self._entries)],
+            'triggers': layouts[0],
+            'slashes': layouts[1],
+            'blob': sum(len(s) for s in sections),
+        }).encode()
+        return b"".join([_MAGIC, _LENGTH.pack(len(header)), header] + sections + [blob])
+
+    def build(self) -> CompiledRegistry:
+        """
+        Write the compiled registry atomically and map it. If it cannot be written, the
+        registry is kept in memory in this process instead, still without per-binding objects.
+        """
+        data = self._serialise()
+        if self.path:
+            temp = "{}.{}.tmp".format(self.path, getpid())
+            try:
+                with open(temp, 'wb') as f:
+                    f.write(data)
+                replace(temp, self.path)
+                compiled = open_compiled(self.path)
+                if compiled is not None:
+                    Ayumi.debug("Wrote compiled registry with {} command(s) to {}.".format(len(self._entries), self.path))
+                    return compiled
+            except OSError as e:
+                Ayumi.warning("Could not write the compiled registry, keeping it in memory: {}".format(e), color=Ayumi.LYELLOW)
+        return CompiledRegistry(data)
+
+def open_compiled(path: str = COMPILED_REGISTRY_PATH) -> Optional[CompiledRegistry]:
+    """
+    Map a compiled registry file read-only, or return None if there is no usable one.
+    """
+    if not path or not exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            # The mapping stays valid after the file is closed, or replaced by a newer registry.
+            return CompiledRegistry(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), path)
+    except (OSError, ValueError, KeyError) as e:
+        Ayumi.warning("Ignoring unreadable compiled registry: {}".format(e), color=Ayumi.LYELLOW)
+        return None
@@ -0,0 +1,279 @@
+"""
+Single-pass dispatcher for regex bindings.
+
+Bindings are folded into as few compiled patterns as possible, preserving the
+order they were registered in so that the first binding to match still wins.
+
+With ADAPTIVE_REGEX_ORDER, the dispatcher counts matches per binding and every
+REGEX_REORDER_INTERVAL matches moves the most matched bindings to the front,
+except past a binding declared before it that could match the same input.
+Counts are saved to REGEX_ORDER_PATH, so a restarted worker starts in the learned order.
+Finding which bindings could match the same input compares every pair, so with more
+than REGEX_REORDER_MAX_BINDINGS bindings they are kept in declared order instead.
+"""
+
+import heapq
+import json
+import re
+
+from ayumi import Ayumi
+
+from os import getpid, replace
+from os.path import exists
+from threading import Lock, Thread, get_ident
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from src.config import settings
+
+from .lookup_item import LookupItem
+from .regex_audit import can_overlap
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+ADAPTIVE_ORDER: bool = settings.get("ADAPTIVE_REGEX_ORDER", False)
+REORDER_INTERVAL: int = settings.get("REGEX_REORDER_INTERVAL", 10000)
+ORDER_PATH: str = settings.get("REGEX_ORDER_PATH", "regex.order.json")
+# About 0.6s of overlap checks on every reload, growing with the square of the bindings.
+REORDER_MAX_BINDINGS: int = settings.get("REGEX_REORDER_MAX_BINDINGS", 1000)
+# Counts are halved after every reorder, so the order follows changes in traffic.
+HIT_DECAY = 0.5
+
+# Flags that can be expressed as a scoped inline group, e.g. (?i:...)
+INLINE_FLAGS = (
+    (re.IGNORECASE, 'i'),
+    (re.MULTILINE, 'm'),
+    (re.DOTALL, 's'),
+    (re.ASCII, 'a'),
+)
+INLINE_FLAG_MASK = re.IGNORECASE | re.MULTILINE | re.DOTALL | re.ASCII | re.UNICODE
+
+# Numbered backreferences and conditionals would point at the wrong group once
+# the pattern is renumbered inside a combined matcher.
+GROUP_REFERENCE = re.compile(r'\\[1-9]|\(\?\(')
+
+GROUP_PREFIX = "_b"
+
+def _global_inline_flags(source: str) -> int:
+    """
+    Return the flags a pattern sets with global inline groups, e.g. (?i)abc. Embedded in
+    an alternation, they would apply to every other binding combined with it (or fail to
+    compile on Python 3.11+), wherever they stand in the pattern.
+    """
+    try:
+        parsed = sre_parse.parse(source)
+    except re.error:
+        return -1
+    state = getattr(parsed, 'state', None) or parsed.pattern
+    return state.flags & ~re.UNICODE
+
+def _can_combine(pattern: re.Pattern) -> bool:
+    """
+    Whether a pattern can be safely embedded inside a combined alternation.
+    Patterns that use named groups, group references, global inline flags or flags
+    that cannot be scoped inline, and sandboxed bindings, are kept as standalone
+    matchers instead.
+    """
+    if not isinstance(pattern, re.Pattern) or not isinstance(pattern.pattern, str):
+        return False
+    if pattern.flags & ~INLINE_FLAG_MASK:
+        return False
+    if _global_inline_flags(pattern.pattern):
+        return False
+    if pattern.groupindex:
+        return False
+    if GROUP_REFERENCE.search(pattern.pattern):
+        return False
+    return True
+
+def _inline(pattern: re.Pattern) -> str:
+    """
+    Return the source of a pattern wrapped in a group carrying its own flags.
+    """
+    flags = "".join(c for f, c in INLINE_FLAGS if pattern.flags & f)
+    if flags:
+        return "(?{}:{})".format(flags, pattern.pattern)
+    return "(?:{})".format(pattern.pattern)
+
+def _binding_key(pattern: re.Pattern) -> str:
+    return "{}:{}".format(pattern.flags, pattern.pattern)
+
+def _read_counts(path: str) -> Dict[str, float]:
+    if not exists(path):
+        return dict()
+    try:
+        with open(path, 'r') as f:
+            counts = json.load(f)
+        return counts if isinstance(counts, dict) else dict()
+    except (OSError, ValueError) as e:
+        Ayumi.warning("Ignoring unreadable regex order file: {}".format(e), color=Ayumi.LYELLOW)
+        return dict()
+
+def _write_counts(counts: Dict[str, float], path: str):
+    """
+    Write the match counts atomically, as every worker saves its own.
+    """
+    temp = "{}.{}.{}.tmp".format(path, getpid(), get_ident())
+    try:
+        with open(temp, 'w') as f:
+            json.dump(counts, f)
+        replace(temp, path)
+    except OSError as e:
+        Ayumi.warning("Could not save regex order: {}".format(e), color=Ayumi.LYELLOW)
+
+class RegexDispatcher:
+    """
+    Ordered set of (re.Pattern, LookupItem) bindings matched in a single pass.
+
+    Runs of combinable patterns are joined into one alternation, with each
+    alternative wrapped in a named group so the matching binding can be read
+    back from Match.lastgroup. Because alternation is tried left to right at
+    the same anchor, this keeps the first-match-wins semantics of calling
+    .match() on every binding in turn.
+
+    In adaptive mode, bindings are tried in order of their match counts instead,
+    as long as every pair that can_overlap keeps its declared order. Any input
+    matched by more than one binding is therefore still resolved by the first
+    one declared.
+    """
+
+    def __init__(self, bindings: Sequence[Tuple[re.Pattern, LookupItem]], adaptive: bool = ADAPTIVE_ORDER):
+        self._bindings: Tuple[Tuple[re.Pattern, LookupItem]] = tuple(bindings)
+        self._order: List[int] = list(range(len(self._bindings)))
+        self._hits: Optional[List[float]] = None
+
+        if adaptive and len(self._bindings) > REORDER_MAX_BINDINGS:
+            Ayumi.warning("Not reordering {} regex bindings, more than REGEX_REORDER_MAX_BINDINGS ({}).".format(
+                len(self._bindings), REORDER_MAX_BINDINGS), color=Ayumi.LYELLOW)
+            adaptive = False
+        if adaptive:
+            counts = _read_counts(ORDER_PATH)
+            self._hits = [float(counts.get(_binding_key(p), 0)) for p, _ in self._bindings]
+            # Bindings declared later that could match the same input as each binding.
+            self._successors: List[List[int]] = [list() for _ in self._bindings]
+            self._predecessors: List[int] = [0] * len(self._bindings)
+            for later in range(len(self._bindings)):
+                for earlier in range(later):
+                    if can_overlap(self._bindings[earlier][0], self._bindings[later][0]):
+                        self._successors[earlier].append(later)
+                        self._predecessors[later] += 1
+            self._dispatched: int = 0
+            self._reorder_lock: Lock = Lock()
+            self._order = self._tuned_order()
+
+        self._matchers: List[Tuple[re.Pattern, Optional[int]]] = self._compile(self._order)
+        Ayumi.debug("Compiled {} binding(s) into {} matcher(s).".format(
+            len(self._bindings), len(self._matchers)), color=Ayumi.MAGENTA)
+
+    def _compile(self, order: Sequence[int]) -> List[Tuple[re.Pattern, Optional[int]]]:
+        """
+        Fold the bindings, in the given order, into matchers.
+        """
+        matchers: List[Tuple[re.Pattern, Optional[int]]] = list()
+        run: List[int] = list()
+        for index in order:
+            pattern = self._bindings[index][0]
+            if _can_combine(pattern):
+                run.append(index)
+            else:
+                self._flush(run, matchers)
+                run = list()
+                Ayumi.debug("Binding {} cannot be combined, keeping standalone.".format(pattern.pattern))
+                matchers.append((pattern, index))
+        self._flush(run, matchers)
+        return matchers
+
+    def _flush(self, run: List[int], matchers: List[Tuple[re.Pattern, Optional[int]]]):
+        """
+        Compile a run of combinable binding indices into one matcher.
+        """
+        if not run:
+            return
+        if len(run) == 1:
+            matchers.append((self._bindings[run[0]][0], run[0]))
+            return
+        source = "|".join("(?P<{}{}>{})".format(GROUP_PREFIX, i, _inline(self._bindings[i][0])) for i in run)
+        try:
+            matchers.append((re.compile(source), None))
+        except re.error as e:
+            Ayumi.warning("Failed to combine bindings ({}), keeping them standalone.".format(e), color=Ayumi.LYELLOW)
+            matchers.extend((self._bindings[i][0], i) for i in run)
+
+    def _tuned_order(self) -> List[int]:
+        """
+        Order the bindings by match count, most matched first, without moving any
+        binding ahead of an earlier declared binding it overlaps with.
+        """
+        remaining = list(self._predecessors)
+        ready = [(-self._hits[i], i) for i in range(len(self._bindings)) if not remaining[i]]
+        heapq.heapify(ready)
+        order = list()
+        while ready:
+            _, index = heapq.heappop(ready)
+            order.append(index)
+            for later in self._successors[index]:
+                remaining[later] -= 1
+                if not remaining[later]:
+                    heapq.heappush(ready, (-self._hits[later], later))
+        return order
+
+    def reorder(self):
+        """
+        Recompile the matchers in the order of the current match counts, save the
+        counts, and decay them.
+        """
+        self._dispatched = 0
+        order = self._tuned_order()
+        if order != self._order:
+            self._order = order
+            self._matchers = self._compile(order)
+            Ayumi.debug("Reordered regex bindings by match count.", color=Ayumi.MAGENTA)
+        counts = {_binding_key(p): hits for (p, _), hits in zip(self._bindings, self._hits)}
+        Thread(target=_write_counts, args=(counts, ORDER_PATH), daemon=True).start()
+        self._hits = [hits * HIT_DECAY for hits in self._hits]
+
+    def _record(self, index: int):
+        # Counts are approximate under concurrency, which is fine for ordering.
+        self._hits[index] += 1
+        self._dispatched += 1
+        if self._dispatched >= REORDER_INTERVAL and self._reorder_lock.acquire(blocking=False):
+            try:
+                self.reorder()
+            finally:
+                self._reorder_lock.release()
+
+    def match(self, command: str) -> Optional[LookupItem]:
+        """
+        Return the LookupItem of the first binding that matches the command, if any.
+        """
+        index = self.match_index(command)
+        return self._bindings[index][1] if index is not None else None
+
+    def match_index(self, command: str) -> Optional[int]:
+        """
+        Return the position (as declared) of the first binding that matches the command, if any.
+        """
+        for matcher, index in self._matchers:
+            m = matcher.match(command)
+            if m:
+                index = index if index is not None else int(m.lastgroup[len(GROUP_PREFIX):])
+                if self._hits is not None:
+                    self._record(index)
+                return index
+        return None
+
+    @property
+    def bindings(self) -> Tuple[Tuple[re.Pattern, LookupItem]]:
+        return self._bindings
+
+    @property
+    def order(self) -> Tuple[int]:
+        """
+        Positions of the bindings, as declared, in the order they are tried.
+        """
+        return tuple(self._order)
+
+    def __len__(self) -> int:
+        return len(self._bindings)
@@ -0,0 +1,73 @@
+"""
+Shared event loop for asynchronous commands.
+
+Each process runs one asyncio event loop on a daemon thread, started the first time
+an asynchronous command is called. Request threads hand redirects to it and wait on
+the result, so any number of lookups can be in flight without holding a thread each,
+and the pooled backends (see backends) keep their connections on a single loop.
+"""
+
+import asyncio
+
+from concurrent.futures import Future
+from os import register_at_fork
+from threading import Lock, Thread
+from typing import Any, Callable, Coroutine, List, Optional
+
+# The loop is created on first use in each process, as its thread does not survive a fork.
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = Lock()
+# Objects of the parent's loop, kept alive in a forked child: closing them would remove
+# the parent's sockets from the epoll instance both processes share.
+_inherited: List[Any] = list()
+
+def inherit(obj: Any):
+    """
+    Keep an object bound to the parent's event loop alive for the life of this process.
+    """
+    _inherited.append(obj)
+
+def _reset_after_fork():
+    global _loop, _loop_lock
+    if _loop is not None:
+        inherit(_loop)
+    _loop, _loop_lock = None, Lock()
+
+register_at_fork(after_in_child=_reset_after_fork)
+
+def _run(loop: asyncio.AbstractEventLoop):
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+def event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Return the event loop of this process, starting it if needed.
+    """
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                Thread(target=_run, args=(loop,), name="usagi12-event-loop", daemon=True).start()
+                _loop = loop
+    return _loop
+
+def submit(coroutine: Coroutine) -> Future:
+    """
+    Schedule a coroutine on the event loop from any other thread. Cancelling the
+    returned future cancels the coroutine.
+    """
+    try:
+        return asyncio.run_coroutine_threadsafe(coroutine, event_loop())
+    except BaseException:
+        coroutine.close()
+        raise
+
+def blocking(function: Callable[..., Coroutine]) -> Callable[..., Any]:
+    """
+    Wrap a coroutine function into a function that runs it on the event loop and
+    waits for its result, for callers that are not themselves asynchronous.
+    """
+    def call(*args):
+        return submit(function(*args)).result()
+    return call
@@ -0,0 +1,260 @@
+"""
+Execution guard for command redirects.
+
+Commands are plugin code, so a slow or hanging redirect must not hold the request
+thread. Guarded redirects run on a bounded thread pool within a time budget, and
+each command has a circuit breaker: after BREAKER_FAILURES timeouts or errors in a
+row, the command is skipped for BREAKER_COOLDOWN seconds and users are sent to its
+default, or to Google, straight away. Once the cooldown has passed, a single call is
+let through to probe whether the command has recovered.
+
+Asynchronous redirects (see Usagi12AsyncCommand) run on the shared event loop instead
+of the pool, within the same budget and breaker, and are cancelled once out of time.
+
+Synchronous redirects are expected to only format urls, leaving lookups to asynchronous
+commands, so by default they run inline unless they declare a time_budget: handing a
+redirect to the pool costs around 24 µs, against under 1 µs to format a url inline.
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from os import register_at_fork
+from threading import BoundedSemaphore, Lock
+from time import monotonic
+from typing import Any, Callable, Dict, Optional
+
+from src import log
+from src.config import settings
+
+from .event_loop import submit
+from .metrics import COMMAND_SKIPPED, COMMAND_TIMEOUTS, Gauge
+
+# Seconds a command's redirect may run before users are sent to its fallback. 0 runs commands inline.
+COMMAND_TIME_BUDGET: float = settings.get("COMMAND_TIME_BUDGET", 0.5)
+# Whether synchronous redirects run behind a guard even without a time_budget of their own.
+GUARD_SYNC_COMMANDS: bool = settings.get("GUARD_SYNC_COMMANDS", False)
+# Most guarded redirects running at once, including ones that already ran out of their budget.
+COMMAND_POOL_SIZE: int = settings.get("COMMAND_POOL_SIZE", 16)
+# Timeouts or errors in a row after which a command's breaker opens.
+BREAKER_FAILURES: int = settings.get("BREAKER_FAILURES", 5)
+# Seconds a command is skipped for once its breaker has opened.
+BREAKER_COOLDOWN: float = settings.get("BREAKER_COOLDOWN", 30)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CommandSkipped(Exception):
+    """
+    Raised instead of a command's url when its redirect was not run, or did not finish in time.
+
+    Attributes:
+    - name: Name of the skipped command.
+    - reason: "timeout", "open" for an open breaker, or "saturated" for a full pool.
+    - default: The command's default url, if it declares one.
+    """
+
+    def __init__(self, name: str, reason: str, default: Optional[str]):
+        super().__init__("{} skipped: {}".format(name, reason))
+        self.name: str = name
+        self.reason: str = reason
+        self.default: Optional[str] = default
+
+class CircuitBreaker:
+    """
+    Consecutive failure counter of one command, shared by every entry of that name.
+    """
+
+    __slots__ = ('name', 'state', 'failures', 'opened_at', '_lock')
+
+    def __init__(self, name: str):
+        self.name: str = name
+        self.state: str = CLOSED
+        self.failures: int = 0
+        self.opened_at: float = 0.0
+        self._lock: Lock = Lock()
+
+    def allow(self) -> bool:
+        """
+        Whether the command may run now. Once the cooldown has passed, the first caller
+        runs the command as a probe, and everyone else is skipped until it finishes.
+        """
+        if self.state == CLOSED:
+            return True
+        with self._lock:
+            if self.state == OPEN and monotonic() - self.opened_at >= BREAKER_COOLDOWN:
+                self.state = HALF_OPEN
+                return True
+            return self.state == CLOSED
+
+    def abandon(self):
+        """
+        Give back a probe that could not run, so the next caller probes instead.
+        """
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.state = OPEN
+
+    def success(self):
+        if self.state == CLOSED and not self.failures:
+            return
+        with self._lock:
+            if self.state != CLOSED:
+                log.info("Closing circuit breaker of {} after a successful call.", self.name)
+            self.state = CLOSED
+            self.failures = 0
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= BREAKER_FAILURES):
+                log.warning("Opening circuit breaker of {} for {}s after {} failure(s).", self.name, BREAKER_COOLDOWN, self.failures)
+                self.state = OPEN
+                self.opened_at = monotonic()
+
+# Breakers by qualified command name, so they outlive the entries rebuilt on every reload.
+BREAKERS: Dict[str, CircuitBreaker] = dict()
+_BREAKERS_LOCK = Lock()
+
+def breaker(name: str) -> CircuitBreaker:
+    """
+    Return the circuit breaker of the command with this qualified name, creating it if needed.
+    """
+    with _BREAKERS_LOCK:
+        found = BREAKERS.get(name)
+        if found is None:
+            found = BREAKERS[name] = CircuitBreaker(name)
+        return found
+
+def breaker_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Return the state of every breaker that is not closed, or has recent failures.
+    """
+    return {b.name: {'state': b.state, 'failures': b.failures}
+            for b in list(BREAKERS.values()) if b.state != CLOSED or b.failures}
+
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+BREAKER_STATE = Gauge(
+    "usagi12_command_breaker_state",
+    "Circuit breaker state of commands that have failed: 0 closed, 1 half open, 2 open.",
+    ("command",),
+    lambda: [((name,), _STATE_VALUES[stats['state']]) for name, stats in breaker_stats().items()])
+
+# The pool is created on first use in each process, as its threads do not survive a fork.
+_executor: Optional[ThreadPoolExecutor] = None
+_slots: BoundedSemaphore = BoundedSemaphore(COMMAND_POOL_SIZE)
+_executor_lock = Lock()
+
+def _reset_after_fork():
+    global _executor, _slots, _executor_lock
+    _executor, _slots, _executor_lock = None, BoundedSemaphore(COMMAND_POOL_SIZE), Lock()
+
+register_at_fork(after_in_child=_reset_after_fork)
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(COMMAND_POOL_SIZE, thread_name_prefix="usagi12-command")
+    return _executor
+
+class CommandGuard:
+    """
+    Runs one command's redirect on the pool within its time budget, behind its breaker.
+    Errors raised by the redirect are passed on to the caller, and count as failures.
+    """
+
+    __slots__ = ('name', 'budget', 'default', 'asynchronous', 'load', 'breaker')
+
+    def __init__(self, name: str, budget: float, default: Optional[str] = None, asynchronous: bool = False,
+                 load: Optional[Callable[[], Any]] = None):
+        self.name: str = name
+        self.budget: float = budget
+        self.default: Optional[str] = default
+        self.asynchronous: bool = asynchronous
+        self.load: Optional[Callable[[], Any]] = load
+        self.breaker: CircuitBreaker = breaker(name)
+
+    def _skip(self, reason: str) -> CommandSkipped:
+        COMMAND_SKIPPED.inc(self.name, reason)
+        return CommandSkipped(self.name, reason, self.default)
+
+    def _submit(self, redirect: Callable[..., str], args: tuple) -> Future:
+        slots = _slots
+        # A full pool means commands are hanging, so never wait for a slot.
+        if not slots.acquire(blocking=False):
+            self.breaker.abandon()
+            raise self._skip("saturated")
+
+        try:
+            future: Future = _pool().submit(redirect, *args)
+        except BaseException:
+            slots.release()
+            raise
+        # The slot is held until the redirect returns, even after the caller gave up on it.
+        future.add_done_callback(lambda _: slots.release())
+        return future
+
+    def call(self, redirect: Callable[..., str], *args) -> str:
+        """
+        Return redirect(*args), or raise CommandSkipped if it cannot run or does not finish in time.
+        """
+        if not self.breaker.allow():
+            raise self._skip("open")
+        if self.load is not None:
+            # Import a command restored from the manifest on this thread, so a slow import
+            # is not counted against its budget.
+            try:
+                self.load()
+            except Exception:
+                self.breaker.failure()
+                raise
+            self.load = None
+        if self.asynchronous:
+            # Waiting lookups hold no thread, so they are bounded by their backends rather than the pool.
+            try:
+                future = submit(redirect(*args))
+            except Exception:
+                self.breaker.failure()
+                raise
+        else:
+            future = self._submit(redirect, args)
+
+        try:
+            url = future.result(self.budget)
+        except FutureTimeoutError:
+            # Cancels an asynchronous redirect, freeing its backend. Redirects already running on the pool carry on.
+            future.cancel()
+            COMMAND_TIMEOUTS.inc(self.name)
+            self.breaker.failure()
+            log.warning("Command {} ran out of its {}s time budget.", self.name, self.budget)
+            raise CommandSkipped(self.name, "timeout", self.default)
+        except Exception:
+            self.breaker.failure()
+            raise
+        self.breaker.success()
+        return url
+
+def guard_for(command: Any, asynchronous: bool = False, load: Optional[Callable[[], Any]] = None) -> Optional[CommandGuard]:
+    """
+    Return the guard to run a command's redirect with, or None to run it inline.
+    A command's time_budget is used if it declares one, otherwise COMMAND_TIME_BUDGET,
+    which only applies to synchronous commands if GUARD_SYNC_COMMANDS is set.
+    Guards, their breakers and metrics are named after the command's qualified_name,
+    so two commands reporting the same name never share them.
+
+    Params:
+    - command: A Usagi12BaseCommand instance.
+    - asynchronous: Whether its redirect is a coroutine function, see lookup_item.is_asynchronous.
+    - load: Called once before the first redirect, outside the budget, e.g. LazyCommand.load.
+    """
+    budget = getattr(command, 'time_budget', None)
+    if budget is None:
+        if not asynchronous and not GUARD_SYNC_COMMANDS:
+            return None
+        budget = COMMAND_TIME_BUDGET
+    if not budget or budget <= 0:
+        return None
+    default = getattr(command, 'default', None)
+    return CommandGuard(command.qualified_name, budget, default if isinstance(default, str) else None, asynchronous, load)
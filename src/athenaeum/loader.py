@@ -1,26 +1,68 @@
 
 from cerberus import Validator
+from hashlib import sha1
 from importlib import import_module
+from importlib.util import module_from_spec, spec_from_file_location
 from inspect import getmembers, isclass
-from os import walk
-from os.path import join
-from re import compile
-from typing import Dict, List
+from os import stat, walk
+from os.path import basename, exists, join
+from re import Pattern
+from signal import SIGHUP, signal
+from threading import Lock, Thread
+from time import monotonic
+from types import ModuleType
+from typing import Callable, Dict, List, Optional, Tuple
+
+import json
+import sys
+import yaml
 
 from ayumi import Ayumi
 
 from commands.google import Google
-from src.commands.arguments_command import Usagi12WithArgumentsCommand, Usagi12WithoutArgumentsCommand
+from src.commands.arguments_command import Usagi12AsyncCommand, Usagi12WithArgumentsCommand, Usagi12WithoutArgumentsCommand
+from src.commands.base_command import Usagi12BaseCommand
+from src.commands.template_command import TemplateCommand, bang_definitions
+from src.config import settings
 
+from .compiled import COMPILED_REGISTRY_MIN_COMMANDS, COMPILED_REGISTRY_PATH, CompiledRegistry, RegistryCompiler, open_compiled
+from .dispatcher import RegexDispatcher
 from .lookup_item import LookupItem
+from .manifest import LazyCommand, describe_command, read_manifest, write_manifest
+from .regex_audit import BindingReport, audit_commands, restore_report, write_report
+from .registry import Registry
+from .trie import Trie
+
+# Use the C YAML loader when available, as definition files can be large.
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
 
 # Base classes and their programmatic names used for dynamic .py file imports
-BASE_CLASSES = [Usagi12WithArgumentsCommand, Usagi12WithoutArgumentsCommand]
+BASE_CLASSES = [Usagi12WithArgumentsCommand, Usagi12WithoutArgumentsCommand, Usagi12AsyncCommand]
 BASE_CLASS_NAMES = [x.__name__ for x in BASE_CLASSES]
 
-TRIGGER_LOOKUP: Dict[str, LookupItem] = dict()
-SLASH_LOOKUP: Dict[str, LookupItem] = dict()
-REGEX_LOOKUP: List[LookupError] = list()
+COMMANDS_DIR = "commands"
+
+# Extensions of declarative command definition files
+DEFINITION_EXTENSIONS = (".yaml", ".yml")
+
+# Optional DuckDuckGo-style bangs JSON file to import, loaded after every other command.
+BANGS_FILE: Optional[str] = settings.get("BANGS_FILE")
+
+# Minimum number of seconds between two checks for changed files, 0 to disable.
+RELOAD_INTERVAL: float = settings.get("RELOAD_INTERVAL", 0)
+
+# The registry currently in use. Readers should take a local reference to it once per
+# request, as it is replaced as a whole whenever commands are reloaded.
+REGISTRY: Registry = Registry()
+
+# Aliases of the current registry's tables, kept for code that reads them directly.
+TRIGGER_LOOKUP: Trie[LookupItem] = REGISTRY.triggers
+SLASH_LOOKUP: Trie[LookupItem] = REGISTRY.slashes
+REGEX_LOOKUP: List[Tuple[Pattern, LookupItem]] = REGISTRY.regexes
+REGEX_DISPATCHER: Optional[RegexDispatcher] = None
+
+# Callbacks to run whenever the lookup tables change, e.g. to drop cached results.
+REGISTRY_LISTENERS: List[Callable[[], None]] = list()
 
 MODULE_VALIDATOR = Validator({
     'args': {'type': 'boolean', 'required': True},
@@ -28,61 +70,339 @@ MODULE_VALIDATOR = Validator({
     'default': {'type': 'string', 'required': True},
     'slashes': {'type': ['string', 'list'], 'schema': {'type': 'string'}, 'required': False},
     'triggers': {'type': ['string', 'list'], 'schema': {'type': 'string'}, 'required': False},
-    'urls': {'type': 'dict', 'required': False},
+    'urls': {'type': 'dict', 'valuesrules': {'type': 'string'}, 'required': False},
 })
 
-def _maybe_import_from_class_file(root: str, file: str):
+class CommandFile:
     """
-    Helper to load a .py file into the lookup store.
-    Do not use except in initialisation.
+    A loaded command file, with the fingerprint used to detect changes to it.
+    The commands of a definition file are None while they are only kept in COMPILED.
     """
 
-    if (file == "__init__.py"):
-        Ayumi.debug("Found __init__.py file, skipping.")
-        return
+    def __init__(self, path: str, mod_path: str, fingerprint: Tuple[int, int], digest: str, commands: Optional[List[Usagi12BaseCommand]]):
+        self.path: str = path
+        self.mod_path: str = mod_path
+        self.fingerprint: Tuple[int, int] = fingerprint
+        self.digest: str = digest
+        self.commands: Optional[List[Usagi12BaseCommand]] = commands
+        # Cost reports of the regex bindings of the commands, see regex_audit.
+        self.audit: List[BindingReport] = list()
+
+# Loaded command files keyed by path.
+COMMAND_FILES: Dict[str, CommandFile] = dict()
+
+# The compiled registry holding the template commands of the current registry, if they are compiled.
+COMPILED: Optional[CompiledRegistry] = None
+
+# We should default to Google if nothing else is matched
+# It is also where skipped commands send users, so it runs inline rather than behind a guard.
+DEFAULT_LOOKUP = LookupItem.from_command(Google(), guarded=False)
+
+_RELOAD_LOCK = Lock()
+_last_reload_check: float = monotonic()
+
+def on_registry_change(listener: Callable[[], None]):
+    """
+    Register a callback to be run whenever the lookup tables change.
+    """
+    REGISTRY_LISTENERS.append(listener)
+
+def _notify_registry_change():
+    for listener in REGISTRY_LISTENERS:
+        listener()
+
+def _fingerprint(path: str) -> Tuple[int, int]:
+    st = stat(path)
+    return st.st_mtime_ns, st.st_size
+
+def _digest(path: str) -> str:
+    with open(path, 'rb') as f:
+        return sha1(f.read()).hexdigest()
+
+def _scan() -> List[Tuple[str, Optional[str]]]:
+    """
+    Walk the commands directory and return the (path, module path) of every command file.
+    Definition files have no module path. The bangs file, if any, comes last.
+    """
+    found = list()
+    for root, dirs, files in walk(COMMANDS_DIR):
+        for file in files:
+            if file == "__init__.py":
+                Ayumi.debug("Found __init__.py file, skipping.")
+            elif file.endswith(".py"):
+                path = join(root, file)
+                found.append((path, path.replace("/", ".")[:-3]))
+            elif file.endswith(DEFINITION_EXTENSIONS):
+                found.append((join(root, file), None))
+            elif file.endswith(".pyc"):
+                Ayumi.debug("Found bytecode file: {}, skipping...".format(file))
+            else:
+                Ayumi.debug("Unrecognised/unimplemented file type: {}, skipping...".format(file), color=Ayumi.LYELLOW)
+    if BANGS_FILE and exists(BANGS_FILE):
+        found.append((BANGS_FILE, None))
+    return found
+
+def _import_file(path: str, mod_path: str) -> ModuleType:
+    """
+    Import a command file. Files that were imported before are executed into a new
+    module object, so a failed import leaves the previous version untouched.
+    """
+    if mod_path not in sys.modules:
+        return import_module(mod_path)
+
+    spec = spec_from_file_location(mod_path, path)
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    sys.modules[mod_path] = module
+    return module
+
+def _commands_from_module(module: ModuleType) -> List[Usagi12BaseCommand]:
+    """
+    Instantiate every command class defined in a module.
+    """
 
     # Lambda to determine if a dynamic class should be imported
     should_import = lambda c : any([issubclass(c, x) for x in BASE_CLASSES]) and not any(c.__name__ == x for x in BASE_CLASS_NAMES)
 
-    mod_path = join(root, file).replace("/", ".")[:-3]
-    module = import_module(mod_path)
-    if module:
-        classes = [x for x in getmembers(module, isclass)]
-        for c in classes:
-            # Only import modules that are in a specific subclass that we want to work with
-            if should_import(c[1]):
-                temp_instance = c[1]() # Create an instance of the class
-                for binding in temp_instance.triggers or list():
-                    if binding not in TRIGGER_LOOKUP:
-                        Ayumi.debug("Adding trigger: {}".format(binding), color=Ayumi.LCYAN)
-                        TRIGGER_LOOKUP[binding] = LookupItem(temp_instance.redirect, temp_instance.languages)
-                for binding in temp_instance.slashes or list():
-                    if binding.endswith("/"): binding = binding[:-1]
-                    if binding not in SLASH_LOOKUP:
-                        Ayumi.debug("Adding slash: {}".format(binding), color=Ayumi.LCYAN)
-                        SLASH_LOOKUP[binding] = LookupItem(temp_instance.redirect, temp_instance.languages)
-                for binding in temp_instance.bindings or list():
-                    Ayumi.debug("Adding binding: {} with flag(s): {}".format(binding.pattern, binding.flags or "None"), color=Ayumi.LCYAN)
-                    REGEX_LOOKUP.append((binding, LookupItem(temp_instance.redirect, temp_instance.languages)))
-
-# Walk down the file and import modules.
-Ayumi.debug("Starting module import process...", color=Ayumi.BLUE)
-for root, dirs, files in walk(("commands")):
-    for file in files:
-        Ayumi.debug("Now loading: {}".format(file))
-        if file.endswith(".py"):
-            _maybe_import_from_class_file(root, file)
-        elif file.endswith(".pyc"):
-            Ayumi.debug("Found bytecode file: {}, skipping...".format(file))
-        else:
-            Ayumi.debug("Unrecognised/unimplemented file type: {}, skipping...".format(file), color=Ayumi.LYELLOW)
-        Ayumi.debug("Completed loading: {}".format(file))
+    # Only import modules that are in a specific subclass that we want to work with
+    return [c[1]() for c in getmembers(module, isclass) if should_import(c[1])]
 
-# We should default to Google if nothing else is matched
-Ayumi.debug("Adding default Google redirection.", color=Ayumi.LCYAN)
-REGEX_LOOKUP.append((compile(r'.*'), LookupItem(Google().redirect, Google().languages)))
+def _load_definitions(path: str) -> List[TemplateCommand]:
+    """
+    Compile the command definitions in a YAML file, or the bangs in the bangs file.
+    A YAML file holds either a single definition or a list of them, each validated
+    against MODULE_VALIDATOR. Any invalid definition fails the whole file.
+    """
+
+    if path == BANGS_FILE:
+        # Bangs are converted into definitions by us, so skip per-entry validation for speed.
+        with open(path, 'r', encoding='utf-8') as f:
+            definitions = bang_definitions(json.load(f))
+        Ayumi.debug("Loaded {} bangs from {}.".format(len(definitions), path))
+        return [TemplateCommand(name, definition) for name, definition in definitions]
+
+    with open(path, 'r', encoding='utf-8') as f:
+        data = yaml.load(f, Loader=YAML_LOADER)
+    stem = basename(path).rsplit(".", 1)[0]
+    commands = list()
+    for definition in data if isinstance(data, list) else [data]:
+        if not isinstance(definition, dict) or not MODULE_VALIDATOR.validate(definition):
+            raise ValueError("Invalid command definition: {}".format(MODULE_VALIDATOR.errors if isinstance(definition, dict) else definition))
+        document = MODULE_VALIDATOR.document
+        binding = (_as_list(document.get('triggers')) + _as_list(document.get('slashes')) + [str(len(commands))])[0]
+        commands.append(TemplateCommand("{}:{}".format(stem, binding), document))
+    return commands
+
+def _as_list(value) -> List[str]:
+    return [value] if isinstance(value, str) else list(value or list())
+
+def _maybe_load_definition_file(path: str, previous: Optional[CommandFile]) -> Optional[CommandFile]:
+    """
+    Helper to (re)load a YAML definition file or the bangs file, as with .py files.
+    """
+    return _maybe_load(path, None, previous, lambda: _load_definitions(path))
+
+def _maybe_import_from_class_file(path: str, mod_path: str, previous: Optional[CommandFile]) -> Optional[CommandFile]:
+    """
+    Helper to (re)load a .py file, returning None if it has not changed since it was
+    last loaded. If the file fails to import, the previous version is kept.
+    The regex bindings of newly loaded commands are audited with regex_audit.
+    """
+    loaded = _maybe_load(path, mod_path, previous, lambda: _commands_from_module(_import_file(path, mod_path)))
+    if loaded:
+        # Measure the regex bindings now, so the registry can sandbox or reject any over budget.
+        loaded.audit = audit_commands(loaded.commands, path)
+    return loaded
 
+def _maybe_load(path: str, mod_path: Optional[str], previous: Optional[CommandFile], load: Callable[[], list]) -> Optional[CommandFile]:
+    fingerprint = _fingerprint(path)
+    if previous and previous.fingerprint == fingerprint:
+        return None
+
+    digest = _digest(path)
+    if previous and previous.digest == digest:
+        previous.fingerprint = fingerprint
+        return None
+
+    Ayumi.debug("Now loading: {}".format(path))
+    try:
+        commands = load()
+    except Exception as e:
+        if previous:
+            Ayumi.error("Failed to reload {}, keeping previous version: {}".format(path, e), color=Ayumi.LRED)
+            previous.fingerprint = fingerprint
+            return None
+        Ayumi.error("Failed to load {}, skipping: {}".format(path, e), color=Ayumi.LRED)
+        return CommandFile(path, mod_path, fingerprint, digest, list())
+    Ayumi.debug("Completed loading: {}".format(path))
+    return CommandFile(path, mod_path, fingerprint, digest, commands)
+
+def _file_commands(file: CommandFile) -> List:
+    """
+    Return the commands of a file, decoding them from COMPILED if they are only kept there.
+    """
+    return COMPILED.commands(file.path) if file.commands is None else file.commands
+
+def _should_compile(files: List[CommandFile]) -> bool:
+    if not COMPILED_REGISTRY_PATH:
+        return False
+    return any(f.commands is None for f in files) or \
+        sum(len(f.commands) for f in files if not f.mod_path) >= COMPILED_REGISTRY_MIN_COMMANDS
+
+def _build_registry(files: List[CommandFile]) -> Registry:
+    """
+    Build the registry of the given files. Template commands are compiled (see compiled)
+    once there are enough of them, or taken from COMPILED as is if no file has changed
+    since it was written, and are then no longer kept in memory.
+    """
+    global COMPILED
+    if COMPILED is not None and COMPILED.matches([(f.path, f.digest) for f in files]):
+        registry = Registry(compiled=COMPILED)
+        for file in files:
+            if file.mod_path:
+                for command in file.commands:
+                    registry.add_command(command)
+    else:
+        compiler = RegistryCompiler() if _should_compile(files) else None
+        registry = Registry(compiler=compiler)
+        for file in files:
+            if compiler is not None:
+                compiler.begin(file.path, file.fingerprint, file.digest, not file.mod_path)
+            for command in _file_commands(file):
+                registry.add_command(command)
+    registry.finalise(DEFAULT_LOOKUP)
+
+    COMPILED = registry.compiled
+    if COMPILED is not None:
+        for file in files:
+            if not file.mod_path:
+                file.commands = None
+    return registry
+
+def _swap(registry: Registry):
+    """
+    Make a fully built registry the current one.
+    """
+    global REGISTRY, TRIGGER_LOOKUP, SLASH_LOOKUP, REGEX_LOOKUP, REGEX_DISPATCHER
+    REGISTRY = registry
+    TRIGGER_LOOKUP, SLASH_LOOKUP, REGEX_LOOKUP, REGEX_DISPATCHER = \
+        registry.triggers, registry.slashes, registry.regexes, registry.dispatcher
+    _notify_registry_change()
+
+def reload() -> bool:
+    """
+    Pick up added, changed and removed files under the commands directory.
+    Only changed files are re-imported, and the new registry is swapped in once
+    it is complete. Returns whether the registry changed.
+    """
+
+    with _RELOAD_LOCK:
+        changed = False
+        files = list()
+        for path, mod_path in _scan():
+            previous = COMMAND_FILES.get(path)
+            loaded = _maybe_import_from_class_file(path, mod_path, previous) if mod_path \
+                else _maybe_load_definition_file(path, previous)
+            if loaded:
+                COMMAND_FILES[path] = loaded
+                changed = True
+            files.append(COMMAND_FILES[path])
+
+        seen = set(f.path for f in files)
+        for path in [p for p in COMMAND_FILES if p not in seen]:
+            Ayumi.debug("Command file removed: {}".format(path), color=Ayumi.LYELLOW)
+            sys.modules.pop(COMMAND_FILES.pop(path).mod_path, None)
+            changed = True
+
+        if changed or REGISTRY.dispatcher is None:
+            _swap(_build_registry(files))
+            try:
+                write_report(audit_reports())
+            except OSError as e:
+                Ayumi.warning("Could not write regex cost report: {}".format(e), color=Ayumi.LYELLOW)
+        return changed
+
+def audit_reports() -> List[BindingReport]:
+    """
+    Return the regex cost reports of the currently loaded command files.
+    """
+    return [report for f in COMMAND_FILES.values() for report in f.audit]
+
+def maybe_reload():
+    """
+    Reload commands if RELOAD_INTERVAL is set and has elapsed since the last check.
+    Cheap enough to call on every request, and skipped if a reload is already running.
+    """
+    global _last_reload_check
+    if not RELOAD_INTERVAL or monotonic() - _last_reload_check < RELOAD_INTERVAL:
+        return
+    _last_reload_check = monotonic()
+    if _RELOAD_LOCK.locked():
+        return
+    if reload():
+        Ayumi.info("Reloaded commands after detecting changes.", color=Ayumi.LCYAN)
+
+def _seed_from_manifest():
+    """
+    Restore command files from the registry manifest, as lazily imported commands.
+    reload() then re-imports any file whose fingerprint and digest no longer match.
+    """
+    for entry in read_manifest():
+        command_file = COMMAND_FILES[entry['path']] = CommandFile(
+            entry['path'],
+            entry['module'],
+            tuple(entry['fingerprint']),
+            entry['digest'],
+            [LazyCommand(entry['module'], spec) for spec in entry['commands']])
+        command_file.audit = [restore_report(report) for report in entry['audit']]
+    Ayumi.debug("Restored {} command file(s) from the registry manifest.".format(len(COMMAND_FILES)))
+
+def _seed_from_compiled():
+    """
+    Restore definition files from the compiled registry, without reading them.
+    reload() then reloads any file whose fingerprint and digest no longer match.
+    """
+    global COMPILED
+    COMPILED = open_compiled()
+    if COMPILED is None:
+        return
+    for entry in COMPILED.files:
+        if entry['entries'] is not None:
+            COMMAND_FILES[entry['path']] = CommandFile(entry['path'], None, tuple(entry['fingerprint']), entry['digest'], None)
+    Ayumi.debug("Mapped compiled registry with {} template command(s).".format(len(COMPILED)))
+
+def save_manifest():
+    """
+    Write the registry manifest for the currently loaded command files.
+    """
+    with _RELOAD_LOCK:
+        write_manifest([{
+            'path': f.path,
+            'module': f.mod_path,
+            'fingerprint': list(f.fingerprint),
+            'digest': f.digest,
+            'commands': [describe_command(c) for c in f.commands],
+            'audit': [report.to_dict() for report in f.audit],
+        } for f in COMMAND_FILES.values() if f.mod_path])
+
+def install_reload_signal(signum: int = SIGHUP):
+    """
+    Reload commands when this process receives the given signal. The reload runs on
+    its own thread, so it never runs inside (and waits on) the interrupted frame.
+    """
+    try:
+        signal(signum, lambda *_: Thread(target=reload, daemon=True).start())
+        Ayumi.debug("Installed command reload handler for signal {}.".format(signum))
+    except ValueError:
+        Ayumi.warning("Could not install command reload signal handler outside of the main thread.", color=Ayumi.LYELLOW)
+
+# Walk down the file and import modules, starting from the manifest where it is still valid.
+Ayumi.debug("Starting module import process...", color=Ayumi.BLUE)
+_seed_from_manifest()
+_seed_from_compiled()
+if reload():
+    try:
+        save_manifest()
+    except OSError as e:
+        Ayumi.warning("Could not update the registry manifest: {}".format(e), color=Ayumi.LYELLOW)
 Ayumi.debug("Loading complete.", color=Ayumi.BLUE)
-Ayumi.debug("Stats: Loaded triggers: {}".format(len(TRIGGER_LOOKUP)), color=Ayumi.MAGENTA)
-Ayumi.debug("Stats: Loaded slashes: {}".format(len(SLASH_LOOKUP)), color=Ayumi.MAGENTA)
-Ayumi.debug("Stats: Loaded regexes: {}".format(len(REGEX_LOOKUP)), color=Ayumi.MAGENTA)
\ No newline at end of file
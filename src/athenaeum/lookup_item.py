@@ -1,18 +1,183 @@
+from inspect import Parameter, iscoroutinefunction, signature
 from langcodes import Language
-from typing import Callable, Optional, Tuple
+from typing import Any, Callable, Dict, FrozenSet, Optional, Sequence, Tuple, Union
+
+from .event_loop import blocking
+from .guard import CommandGuard, guard_for
+
+from src.commands.arguments_command import Usagi12AsyncCommand, Usagi12WithArgumentsCommand, Usagi12WithoutArgumentsCommand
+from src.commands.template_command import TemplateCommand
+
+# Parsed (languages, tags) by declared languages. Most commands declare one of a handful
+# of language sets, so entries share them rather than each holding their own copies.
+_PARSED_LANGUAGES: Dict[Tuple, Tuple[Tuple[Language], FrozenSet[str]]] = dict()
+
+def _parse_languages(languages: Optional[Tuple[Union[str, Language]]]) -> Tuple[Tuple[Language], FrozenSet[str]]:
+    key = tuple(str(i) for i in languages or tuple())
+    parsed = _PARSED_LANGUAGES.get(key)
+    if parsed is None:
+        parsed_languages = tuple(Language.get(i) for i in key)
+        parsed = _PARSED_LANGUAGES[key] = (parsed_languages, frozenset(str(i) for i in parsed_languages))
+    return parsed
+
+def accepts_arguments(command: Any) -> bool:
+    """
+    Decide once, at load time, how a command's redirect is called:
+    as redirect(args, language) if True, or as redirect(language) if False.
+
+    Params:
+    - command: A Usagi12BaseCommand or TemplateCommand instance.
+    """
+    if isinstance(command, (Usagi12WithArgumentsCommand, Usagi12AsyncCommand, TemplateCommand)):
+        return True
+    if isinstance(command, Usagi12WithoutArgumentsCommand):
+        return False
+    # Commands restored from the manifest carry the decision made when it was written.
+    recorded = getattr(command, 'accepts_arguments', None)
+    if isinstance(recorded, bool):
+        return recorded
+    # Commands deriving from Usagi12BaseCommand directly: go by the signature of redirect.
+    try:
+        params = signature(command.redirect).parameters.values()
+    except (TypeError, ValueError):
+        return True
+    positional = [p for p in params if p.kind in (Parameter.POSITIONAL_ONLY, Parameter.POSITIONAL_OR_KEYWORD)]
+    return len(positional) >= 2 or any(p.kind is Parameter.VAR_POSITIONAL for p in params)
+
+def is_asynchronous(command: Any) -> bool:
+    """
+    Decide once, at load time, whether a command's redirect is a coroutine function,
+    to be run on the shared event loop (see event_loop).
+
+    Params:
+    - command: A Usagi12BaseCommand or TemplateCommand instance.
+    """
+    if isinstance(command, Usagi12AsyncCommand):
+        return True
+    # Commands restored from the manifest carry the decision made when it was written.
+    recorded = getattr(command, 'asynchronous', None)
+    if isinstance(recorded, bool):
+        return recorded
+    return iscoroutinefunction(getattr(command, 'redirect', None))
+
+def is_deterministic(command: Any) -> bool:
+    """
+    Decide once, at load time, whether a command's redirect without arguments may be
+    cached by browsers. An explicit Usagi12BaseCommand.deterministic is used as declared,
+    otherwise only commands whose urls cannot depend on the query are deterministic.
+    Never True for commands that are not cacheable.
+
+    Params:
+    - command: A Usagi12BaseCommand or TemplateCommand instance.
+    """
+    if not command.cacheable:
+        return False
+    declared = getattr(command, 'deterministic', None)
+    if declared is not None:
+        return bool(declared)
+    # Template defaults are fixed urls, and commands without arguments never see the query.
+    return isinstance(command, (Usagi12WithoutArgumentsCommand, TemplateCommand))
 
 class LookupItem:
+    """
+    Registry entry for a command. A single LookupItem is shared by every trigger,
+    slash and binding of the same command.
+
+    How the command's redirect is called is fixed when the entry is built (see
+    accepts_arguments), so errors raised by a command are never retried.
+    Redirects of asynchronous commands, and of others that declare a time budget, run
+    behind a guard (see guard.guard_for), while commands that only format urls run inline.
+    Asynchronous redirects run on the shared event loop, and callers wait for their url
+    in either case.
+    """
+
+    __slots__ = ('_redirect', '_guard', '_takes_arguments', '_name', '_label', '_description', '_languages', '_language_tags', '_cacheable', '_deterministic')
 
-    def __init__(self, redirect: Callable, languages: Optional[Tuple[Language]]):
+    def __init__(self, redirect: Callable, languages: Optional[Tuple[Union[str, Language]]], cacheable: bool = True, name: str = "", description: str = "", takes_arguments: bool = True, deterministic: bool = False, guard: Optional[CommandGuard] = None, label: Optional[str] = None):
         self._redirect: Callable = redirect
-        self._languages: Tuple[Language] = languages or tuple()
+        self._guard: Optional[CommandGuard] = guard
+        self._takes_arguments: bool = takes_arguments
+        self._name: str = name
+        self._label: str = label or name
+        self._description: str = description
+        # Parse the declared languages once at registration, rather than on every request.
+        self._languages, self._language_tags = _parse_languages(languages)
+        self._cacheable: bool = cacheable
+        self._deterministic: bool = deterministic
+
+    @classmethod
+    def from_command(cls, command: Any, guarded: bool = True) -> "LookupItem":
+        """
+        Build the entry for a command instance (a Usagi12BaseCommand or TemplateCommand).
+
+        Params:
+        - command: The command instance.
+        - guarded: Whether to run the redirect behind a guard, if guard.guard_for gives it one.
+                   Only the fallback command itself should be unguarded.
+        """
+        # Imported here, as the manifest module builds on this one.
+        from .manifest import LazyCommand
+        asynchronous = is_asynchronous(command)
+        load = command.load if isinstance(command, LazyCommand) else None
+        guard = guard_for(command, asynchronous, load) if guarded and not isinstance(command, TemplateCommand) else None
+        redirect = blocking(command.redirect) if asynchronous and guard is None else command.redirect
+        label = command.label if isinstance(command, TemplateCommand) else command.name
+        return cls(redirect, command.languages, command.cacheable, command.name, command.description, accepts_arguments(command), is_deterministic(command), guard, label)
+
+    def redirect(self, language: Optional[Language], args: Sequence[str] = tuple()) -> str:
+        """
+        Call the command's redirect. Any error it raises is passed on to the caller, and
+        guard.CommandSkipped is raised if a guarded command was skipped or ran out of time.
 
-    def redirect(self, language: Optional[Language], *args: Tuple[str]) -> str:
-        try:
-            return self._redirect(args[0], language)
-        except:
-            return self._redirect(language)
+        Params:
+        - language: The negotiated language, or None.
+        - args: The command split into words. Ignored by commands that take no arguments.
+        """
+        if self._guard is not None:
+            if self._takes_arguments:
+                return self._guard.call(self._redirect, args, language)
+            return self._guard.call(self._redirect, language)
+        if self._takes_arguments:
+            return self._redirect(args, language)
+        return self._redirect(language)
+
+    @property
+    def takes_arguments(self) -> bool:
+        return self._takes_arguments
 
     @property
     def languages(self) -> Tuple[Language]:
-        return self._languages
\ No newline at end of file
+        return self._languages
+
+    @property
+    def language_tags(self) -> FrozenSet[str]:
+        """
+        Normalised tags of the declared languages, for constant time membership checks.
+        """
+        return self._language_tags
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def label(self) -> str:
+        """
+        Name of the command in metrics: its name, or TemplateCommand.label for template commands.
+        """
+        return self._label
+
+    @property
+    def description(self) -> str:
+        return self._description
+
+    @property
+    def cacheable(self) -> bool:
+        return self._cacheable
+
+    @property
+    def deterministic(self) -> bool:
+        """
+        Whether the redirect without arguments can be cached by browsers, see is_deterministic.
+        """
+        return self._deterministic
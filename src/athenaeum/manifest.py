@@ -0,0 +1,172 @@
+"""
+Registry manifest, so workers can start without importing every command.
+
+The manifest records, for each command file, its fingerprint and the triggers,
+slashes, bindings and languages of every command it defines. Commands restored
+from the manifest are only imported when one of their bindings is first used.
+
+Build it ahead of time with:
+    python -m src.athenaeum.manifest
+"""
+
+import json
+import re
+
+from ayumi import Ayumi
+
+from importlib import import_module
+from langcodes import Language
+from os import getpid, replace
+from os.path import exists
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.commands.base_command import Usagi12BaseCommand
+from src.config import settings
+
+from .lookup_item import accepts_arguments, is_asynchronous, is_deterministic
+
+MANIFEST_PATH: str = settings.get("MANIFEST_PATH", "registry.manifest.json")
+MANIFEST_VERSION = 7
+
+class LazyCommand(Usagi12BaseCommand):
+    """
+    Stand-in for a command restored from the manifest. Serves the command's
+    metadata from the manifest, and imports and instantiates the real command
+    the first time redirect() or load() is called.
+    """
+
+    def __init__(self, mod_path: str, spec: Dict[str, Any]):
+        self._mod_path: str = mod_path
+        self._spec: Dict[str, Any] = spec
+        self._bindings: Tuple[re.Pattern] = tuple(re.compile(p, f) for p, f in spec['bindings'])
+        self._command: Optional[Usagi12BaseCommand] = None
+        self._lock: Lock = Lock()
+
+    def load(self) -> Usagi12BaseCommand:
+        """
+        Import and instantiate the real command, if not done yet, and return it.
+        """
+        with self._lock:
+            if self._command is None:
+                Ayumi.debug("Importing {}.{} on first use.".format(self._mod_path, self._spec['class']))
+                self._command = getattr(import_module(self._mod_path), self._spec['class'])()
+        return self._command
+
+    def redirect(self, *args) -> str:
+        return (self._command or self.load()).redirect(*args)
+
+    @property
+    def name(self) -> str:
+        return self._spec['name']
+
+    @property
+    def qualified_name(self) -> str:
+        return "{}.{}".format(self._mod_path, self._spec['class'])
+
+    @property
+    def accepts_arguments(self) -> bool:
+        """
+        Whether the real command's redirect takes (args, language), as recorded in the manifest.
+        """
+        return self._spec['arguments']
+
+    @property
+    def asynchronous(self) -> bool:
+        """
+        Whether the real command's redirect is a coroutine function, as recorded in the manifest.
+        redirect() then returns the coroutine, to be run on the event loop.
+        """
+        return self._spec['asynchronous']
+
+    @property
+    def bindings(self) -> Optional[Tuple[re.Pattern]]:
+        return self._bindings
+
+    @property
+    def triggers(self) -> Optional[Tuple[str]]:
+        return tuple(self._spec['triggers'])
+
+    @property
+    def slashes(self) -> Optional[Tuple[str]]:
+        return tuple(self._spec['slashes'])
+
+    @property
+    def languages(self) -> Optional[Tuple[str]]:
+        return tuple(self._spec['languages'])
+
+    @property
+    def description(self) -> str:
+        return self._spec['description']
+
+    @property
+    def cacheable(self) -> bool:
+        return self._spec['cacheable']
+
+    @property
+    def deterministic(self) -> Optional[bool]:
+        return self._spec['deterministic']
+
+    @property
+    def time_budget(self) -> Optional[float]:
+        return self._spec['time_budget']
+
+    @property
+    def default(self) -> Optional[str]:
+        return self._spec['default']
+
+def describe_command(command: Usagi12BaseCommand) -> Dict[str, Any]:
+    """
+    Return the manifest entry of a command instance. 'class' is the name the command's
+    class is imported by, and 'name' what the command reports itself as.
+    """
+    if isinstance(command, LazyCommand):
+        # Not imported since it was restored, so its entry is still current.
+        return dict(command._spec)
+    return {
+        'class': type(command).__name__,
+        'name': command.name,
+        'triggers': list(command.triggers or list()),
+        'slashes': list(command.slashes or list()),
+        'bindings': [[b.pattern, b.flags] for b in command.bindings or list()],
+        'languages': [str(l) if isinstance(l, Language) else l for l in command.languages or list()],
+        'description': command.description,
+        'cacheable': command.cacheable,
+        'arguments': accepts_arguments(command),
+        'asynchronous': is_asynchronous(command),
+        'deterministic': is_deterministic(command),
+        'time_budget': getattr(command, 'time_budget', None),
+        'default': getattr(command, 'default', None),
+    }
+
+def read_manifest(path: str = MANIFEST_PATH) -> List[Dict[str, Any]]:
+    """
+    Return the file entries of the manifest, or an empty list if there is no usable manifest.
+    """
+    if not exists(path):
+        Ayumi.debug("No registry manifest found at {}.".format(path))
+        return list()
+    try:
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+        if manifest.get('version') != MANIFEST_VERSION:
+            Ayumi.warning("Ignoring registry manifest with unknown version.", color=Ayumi.LYELLOW)
+            return list()
+        return manifest['files']
+    except (OSError, ValueError, KeyError) as e:
+        Ayumi.warning("Ignoring unreadable registry manifest: {}".format(e), color=Ayumi.LYELLOW)
+        return list()
+
+def write_manifest(files: List[Dict[str, Any]], path: str = MANIFEST_PATH):
+    """
+    Write the manifest atomically, so concurrent readers never see a partial file.
+    """
+    temp = "{}.{}.tmp".format(path, getpid())
+    with open(temp, 'w') as f:
+        json.dump({'version': MANIFEST_VERSION, 'files': files}, f)
+    replace(temp, path)
+    Ayumi.debug("Wrote registry manifest with {} file(s) to {}.".format(len(files), path))
+
+if __name__ == "__main__":
+    from src.athenaeum import loader
+    loader.save_manifest()
@@ -0,0 +1,200 @@
+"""
+Low-overhead counters and latency histograms, served in the Prometheus text format.
+
+Labels are limited to fixed stage names and command names, never queries, so
+collection is safe to leave on with incognito use. Template commands, which include
+imported bangs, share a single label (see TemplateCommand.label), and so do user
+shortcuts, keeping the number of series bounded by the number of Python commands.
+"""
+
+from bisect import bisect_left
+from threading import Lock
+from time import perf_counter
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from .cache import cache_stats
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+)
+
+# All metrics created in this process, in registration order.
+METRICS: List["Metric"] = list()
+
+def _format_labels(names: Tuple[str], values: Tuple[str], extra: str = "") -> str:
+    pairs = ['{}="{}"'.format(n, str(v).replace('\\', '\\\\').replace('"', '\\"')) for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{{{}}}".format(",".join(pairs)) if pairs else ""
+
+class Metric:
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str] = tuple()):
+        self.name: str = name
+        self.documentation: str = documentation
+        self.labelnames: Tuple[str] = labelnames
+        self._lock: Lock = Lock()
+        METRICS.append(self)
+
+    def render(self) -> Iterable[str]:
+        raise NotImplementedError
+
+class Counter(Metric):
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str] = tuple()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str], int] = dict()
+
+    def inc(self, *labels: str, amount: int = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> int:
+        return self._values.get(labels, 0)
+
+    def render(self) -> Iterable[str]:
+        yield "# HELP {} {}".format(self.name, self.documentation)
+        yield "# TYPE {} counter".format(self.name)
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield "{}{} {}".format(self.name, _format_labels(self.labelnames, labels), value)
+
+class Histogram(Metric):
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str] = tuple(), buckets: Tuple[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets: Tuple[float] = buckets
+        # Per label set: [count per bucket (last is +Inf)..., sum]
+        self._series: Dict[Tuple[str], List[float]] = dict()
+
+    def observe(self, value: float, *labels: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def time(self, *labels: str) -> "Timer":
+        """
+        Return a context manager that observes the time spent inside it.
+        """
+        return Timer(self, labels)
+
+    def render(self) -> Iterable[str]:
+        yield "# HELP {} {}".format(self.name, self.documentation)
+        yield "# TYPE {} histogram".format(self.name)
+        with self._lock:
+            series = [(labels, list(values)) for labels, values in self._series.items()]
+        for labels, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), values[:-1]):
+                cumulative += count
+                le = 'le="{}"'.format("+Inf" if bound == float("inf") else repr(bound))
+                yield "{}_bucket{} {}".format(self.name, _format_labels(self.labelnames, labels, le), cumulative)
+            yield "{}_sum{} {}".format(self.name, _format_labels(self.labelnames, labels), values[-1])
+            yield "{}_count{} {}".format(self.name, _format_labels(self.labelnames, labels), cumulative)
+
+class Gauge(Metric):
+    """
+    A gauge whose values are read from a callback when rendered, for state kept elsewhere.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str], collect: Callable[[], Iterable[Tuple[Tuple[str], float]]]):
+        super().__init__(name, documentation, labelnames)
+        self._collect = collect
+
+    def render(self) -> Iterable[str]:
+        yield "# HELP {} {}".format(self.name, self.documentation)
+        yield "# TYPE {} gauge".format(self.name)
+        for labels, value in self._collect():
+            yield "{}{} {}".format(self.name, _format_labels(self.labelnames, labels), value)
+
+class Timer:
+
+    __slots__ = ('_histogram', '_labels', '_start')
+
+    def __init__(self, histogram: Histogram, labels: Tuple[str]):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(perf_counter() - self._start, *self._labels)
+        return False
+
+STAGE_LATENCY = Histogram(
+    "usagi12_stage_latency_seconds",
+    "Time spent in each stage of resolving a /bunny request.",
+    ("stage",))
+
+MATCHES = Counter(
+    "usagi12_matches_total",
+    "Commands resolved, by command name and how they were matched.",
+    ("command", "mode"))
+
+COMMAND_ERRORS = Counter(
+    "usagi12_command_errors_total",
+    "Errors raised by command redirects, by command name.",
+    ("command",))
+
+COMMAND_TIMEOUTS = Counter(
+    "usagi12_command_timeouts_total",
+    "Command redirects that ran out of their time budget, by command class.",
+    ("command",))
+
+COMMAND_SKIPPED = Counter(
+    "usagi12_command_skipped_total",
+    "Command redirects not run, by command class and reason (open breaker or full pool).",
+    ("command", "reason"))
+
+BACKEND_CALLS = Counter(
+    "usagi12_backend_calls_total",
+    "Lookups of asynchronous commands, by backend and outcome: called, coalesced into a call in flight, cancelled once every caller gave up, or timeout.",
+    ("backend", "outcome"))
+
+def _render_caches() -> Iterable[str]:
+    stats = cache_stats()
+    for field, kind in (('hits', 'counter'), ('misses', 'counter'), ('evictions', 'counter'), ('size', 'gauge')):
+        name = "usagi12_cache_{}{}".format(field, "_total" if kind == 'counter' else "")
+        yield "# HELP {} Cache {} by cache name.".format(name, field)
+        yield "# TYPE {} {}".format(name, kind)
+        for cache, values in stats.items():
+            yield '{}{{cache="{}"}} {}'.format(name, cache, values[field])
+
+def render() -> str:
+    """
+    Render every metric, and the counters of every cache, in the Prometheus text format.
+    """
+    lines = list()
+    for metric in METRICS:
+        lines.extend(metric.render())
+    lines.extend(_render_caches())
+    return "\n".join(lines) + "\n"
+
+class TimingMiddleware:
+    """
+    WSGI middleware recording the full time spent in the application for one path,
+    including Flask's own routing and response handling.
+    """
+
+    def __init__(self, app: Callable, path: str, stage: str):
+        self._app = app
+        self._path = path
+        self._stage = stage
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO') != self._path:
+            return self._app(environ, start_response)
+        start = perf_counter()
+        try:
+            return self._app(environ, start_response)
+        finally:
+            STAGE_LATENCY.observe(perf_counter() - start, self._stage)
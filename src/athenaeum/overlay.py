@@ -0,0 +1,257 @@
+"""
+Per-user shortcut overlays.
+
+Users can add their own triggers, slashes and regex bindings on top of the global
+registry, identified by a token passed with their requests. Shortcuts are stored in
+a SQLite file (OVERLAY_DB), and each user's shortcuts are compiled into a Registry
+of their own, which only holds their entries and is looked up before the global one.
+Compiled overlays are kept in an LRU cache, dropped whenever the user's shortcuts
+are written, and dropped altogether when another process writes to the file.
+
+Tokens are only stored hashed, and shortcuts are never reported in metrics.
+"""
+
+import re
+import sqlite3
+
+from contextlib import closing
+from hashlib import sha256
+from os import stat
+from threading import Lock
+from time import monotonic
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+from src import log
+from src.commands.template_command import QUERY_PLACEHOLDER, TemplateCommand
+from src.config import settings
+
+from .cache import LRUCache, MISSING
+from .regex_audit import audit_binding
+from .registry import Registry
+
+# SQLite file holding the shortcuts of every user. Overlays are disabled unless it is set.
+OVERLAY_DB: Optional[str] = settings.get("OVERLAY_DB")
+# Number of compiled overlays kept in memory.
+OVERLAY_CACHE_SIZE: int = settings.get("OVERLAY_CACHE_SIZE", 256)
+# Most shortcuts a single user can have.
+OVERLAY_MAX_SHORTCUTS: int = settings.get("OVERLAY_MAX_SHORTCUTS", 200)
+# Seconds between checks for shortcuts written by other processes.
+OVERLAY_REFRESH_INTERVAL: float = settings.get("OVERLAY_REFRESH_INTERVAL", 1.0)
+
+# Name of every overlay entry in metrics and logs, so user shortcuts are never exposed.
+OVERLAY_NAME = "overlay"
+
+KINDS = ("trigger", "slash", "regex")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shortcuts (
+    user TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    binding TEXT NOT NULL,
+    url TEXT NOT NULL,
+    description TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (user, kind, binding)
+)
+"""
+
+# Compiled overlays keyed by hashed token. Users without shortcuts are cached as None.
+OVERLAYS = LRUCache("overlays", OVERLAY_CACHE_SIZE)
+
+_schema_ready: bool = False
+_last_refresh_check: float = 0.0
+_file_signature: Optional[Tuple[int, int]] = None
+_refresh_lock = Lock()
+
+class RegexShortcut:
+    """
+    A user's regex binding. Its url template is filled with the whole query, as the
+    binding matches the whole query rather than a trigger word followed by arguments.
+    """
+
+    __slots__ = ('bindings', 'description', 'default', '_template')
+
+    name: str = OVERLAY_NAME
+    triggers = None
+    slashes = None
+    languages = None
+    cacheable: bool = True
+    deterministic: bool = False
+    # Templates only format urls, so they run inline rather than behind a guard.
+    time_budget: float = 0
+
+    def __init__(self, pattern: re.Pattern, url: str, description: str):
+        self.bindings: Tuple[re.Pattern] = (pattern,)
+        self.description: str = description
+        self.default: str = url.replace(QUERY_PLACEHOLDER, "")
+        self._template: Tuple[str] = tuple(url.split(QUERY_PLACEHOLDER))
+
+    def redirect(self, args: Tuple[str], language) -> str:
+        return quote(' '.join(args)).join(self._template)
+
+class TemplateShortcut(TemplateCommand):
+    """
+    A user's trigger or slash, reported in metrics under the same name as regex shortcuts.
+    """
+
+    __slots__ = ()
+
+    label: str = OVERLAY_NAME
+
+def enabled() -> bool:
+    return bool(OVERLAY_DB)
+
+def _user(token: str) -> str:
+    return sha256(token.encode('utf-8')).hexdigest()
+
+def _connect() -> sqlite3.Connection:
+    global _schema_ready
+    connection = sqlite3.connect(OVERLAY_DB, timeout=5)
+    if not _schema_ready:
+        with connection:
+            connection.execute(SCHEMA)
+        _schema_ready = True
+    return connection
+
+def _fetch(user: str) -> List[Tuple[str, str, str, str]]:
+    with closing(_connect()) as connection:
+        return connection.execute(
+            "SELECT kind, binding, url, description FROM shortcuts WHERE user = ? ORDER BY rowid", (user,)).fetchall()
+
+def _signature() -> Optional[Tuple[int, int]]:
+    try:
+        st = stat(OVERLAY_DB)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+def _check_for_writes():
+    """
+    Drop every compiled overlay if the file changed since the last check, which is
+    how writes made by other workers are picked up. Throttled to OVERLAY_REFRESH_INTERVAL.
+    """
+    global _last_refresh_check, _file_signature
+    if monotonic() - _last_refresh_check < OVERLAY_REFRESH_INTERVAL:
+        return
+    with _refresh_lock:
+        _last_refresh_check = monotonic()
+        signature = _signature()
+        if signature != _file_signature:
+            if _file_signature is not None:
+                log.debug("Shortcut overlays changed on disk, dropping compiled overlays.")
+                OVERLAYS.clear()
+            _file_signature = signature
+
+def _compile(rows: List[Tuple[str, str, str, str]]) -> Registry:
+    """
+    Compile a user's shortcuts into a Registry without a default, so unmatched
+    commands fall through to the global registry.
+    """
+    registry = Registry()
+    for kind, binding, url, description in rows:
+        if kind == "regex":
+            registry.add_command(RegexShortcut(re.compile(binding), url, description))
+            continue
+        registry.add_command(TemplateShortcut(OVERLAY_NAME, {
+            'args': True,
+            'description': description,
+            'default': url.replace(QUERY_PLACEHOLDER, ""),
+            'triggers': binding if kind == "trigger" else None,
+            'slashes': binding if kind == "slash" else None,
+            'urls': {'*': url},
+        }))
+    # Match counts are not kept per user, so overlays always keep their declared order.
+    registry.finalise(None, adaptive=False)
+    return registry
+
+def get_overlay(token: Optional[str]) -> Optional[Registry]:
+    """
+    Return the compiled overlay of the user with this token, or None if overlays
+    are disabled or the user has no shortcuts.
+    """
+    if not token or not OVERLAY_DB:
+        return None
+    _check_for_writes()
+    user = _user(token)
+    overlay = OVERLAYS.get(user)
+    if overlay is MISSING:
+        rows = _fetch(user)
+        overlay = _compile(rows) if rows else None
+        OVERLAYS.put(user, overlay)
+    return overlay
+
+def _validate(kind: str, binding: str, url: str) -> str:
+    """
+    Return the binding as stored, or raise ValueError if the shortcut cannot be added.
+    """
+    if kind not in KINDS:
+        raise ValueError("kind must be one of: {}".format(", ".join(KINDS)))
+    if not isinstance(binding, str) or not binding.strip():
+        raise ValueError("binding must not be empty")
+    if not isinstance(url, str) or not url.startswith(("https://", "http://")):
+        raise ValueError("url must be an http(s) url")
+
+    if kind == "slash":
+        binding = binding[:-1] if binding.endswith("/") else binding
+    if kind != "regex":
+        if len(binding.split()) != 1 or (kind == "slash" and "/" in binding):
+            raise ValueError("{} must be a single word".format(kind))
+        # Triggers and slashes match ignoring case, so store them folded to replace any other casing.
+        return binding.casefold()
+
+    try:
+        pattern = re.compile(binding)
+    except re.error as e:
+        raise ValueError("invalid regex: {}".format(e))
+    # Bindings of users are never trusted, so anything the audit flags is refused.
+    report = audit_binding(pattern, OVERLAY_NAME, OVERLAY_DB)
+    if report.findings or report.over_budget:
+        raise ValueError("regex is too expensive to match: {}".format(", ".join(report.findings) or "over budget"))
+    return binding
+
+def set_shortcut(token: str, kind: str, binding: str, url: str, description: str = ""):
+    """
+    Add or replace a shortcut of the user with this token.
+
+    Params:
+    - kind: "trigger", "slash" or "regex".
+    - binding: The trigger or slash word, or the regex matched against the whole query.
+    - url: The url to redirect to, where {query} is replaced by the quoted arguments
+           (the whole query for regex bindings).
+    - description: Shown in suggestions.
+
+    Raises ValueError if the shortcut is invalid, or the user has too many.
+    """
+    binding = _validate(kind, binding, url)
+    if not isinstance(description, str):
+        raise ValueError("description must be a string")
+    user = _user(token)
+    with closing(_connect()) as connection, connection:
+        count, = connection.execute(
+            "SELECT COUNT(*) FROM shortcuts WHERE user = ? AND NOT (kind = ? AND binding = ?)", (user, kind, binding)).fetchone()
+        if count >= OVERLAY_MAX_SHORTCUTS:
+            raise ValueError("at most {} shortcuts are allowed".format(OVERLAY_MAX_SHORTCUTS))
+        connection.execute(
+            "INSERT OR REPLACE INTO shortcuts (user, kind, binding, url, description) VALUES (?, ?, ?, ?, ?)",
+            (user, kind, binding, url, description or ""))
+    OVERLAYS.discard(user)
+
+def remove_shortcut(token: str, kind: str, binding: str) -> bool:
+    """
+    Remove a shortcut of the user with this token. Returns whether it existed.
+    """
+    if kind in ("trigger", "slash"):
+        binding = binding.rstrip("/").casefold()
+    user = _user(token)
+    with closing(_connect()) as connection, connection:
+        removed = connection.execute(
+            "DELETE FROM shortcuts WHERE user = ? AND kind = ? AND binding = ?", (user, kind, binding)).rowcount
+    OVERLAYS.discard(user)
+    return bool(removed)
+
+def list_shortcuts(token: str) -> List[Dict[str, Any]]:
+    """
+    Return the shortcuts of the user with this token, in the order they were written.
+    """
+    return [{'kind': kind, 'binding': binding, 'url': url, 'description': description}
+            for kind, binding, url, description in _fetch(_user(token))]
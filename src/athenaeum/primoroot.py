@@ -1,73 +1,284 @@
 
-from .loader import TRIGGER_LOOKUP, SLASH_LOOKUP, REGEX_LOOKUP
+from . import loader
+from .cache import LRUCache, MISSING
+from .guard import CommandSkipped
+from .loader import on_registry_change
 from .lookup_item import LookupItem
+from .metrics import COMMAND_ERRORS, MATCHES, STAGE_LATENCY
+from .query import ParsedQuery
+from .registry import Registry, SUGGESTION_LIMIT
 
-from ayumi import Ayumi
-from commands.google import Google
+from src import log
 from enum import Enum
 from langcodes import Language
-from typing import Tuple
+from src.config import settings
+from typing import Dict, Iterable, List, Optional, Tuple
 
 class CommandMode(Enum):
     TRIGGER = 1
     SLASH = 2
     REGEX = 3
 
-def search(command: str, command_og: str, language_accept: Tuple) -> str:
+# Resolved (url, command label, CommandMode, deterministic, localised) keyed by (command, accepted languages). The accepted languages fully
+# determine the negotiated language, so a hit is always the url search() would return.
+RESULT_CACHE = LRUCache("results", settings.get("RESULT_CACHE_SIZE", 1024))
+on_registry_change(RESULT_CACHE.clear)
+
+# Negotiated languages keyed by (module language tags, accepted languages).
+NEGOTIATION_CACHE = LRUCache("negotiation", settings.get("NEGOTIATION_CACHE_SIZE", 256))
+
+def negotiate(module: LookupItem, language_accept: Tuple) -> Optional[Language]:
     """
-    Perform a search over imported modules and return the best match. Defaults to Google.
+    Return the first accepted language that the module declares support for, if any.
 
     Params:
-    - command: Formatted command string after modifications to search.
-    - command_og: Original command, used for logging purposes.
-    - incognito: Whether or not to store logging data
-    - language_accept: A Tuple of Language objects to check for the best language.
+    - module: The LookupItem that the command resolved to.
+    - language_accept: A Tuple of Language objects, in order of preference.
     """
 
-    module: LookupItem = LookupItem(Google().redirect, Google().languages)
-    language: Language = None
+    if not module.language_tags:
+        return None
 
-    # If there is a trigger word, it would be the first word in the command
-    trigger = command.split()[0]
-    # If the command is a slah command, the trigger would have '/' in it.
-    slash = trigger.split('/')[0] if '/' in trigger else None
+    cache_key = (module.language_tags, language_accept)
+    language = NEGOTIATION_CACHE.get(cache_key)
+    if language is MISSING:
+        language = next((la for la in language_accept if str(la) in module.language_tags), None)
+        NEGOTIATION_CACHE.put(cache_key, language)
+    return language
+
+def _dispatch(registry: Registry, query: ParsedQuery) -> Tuple[LookupItem, CommandMode]:
+    """
+    Find the module a query resolves to, and how it was matched.
+    """
 
     # Fetch any module that this command matches. If not, Google is used by default.
-    command_type = None
-    try:
-        module = TRIGGER_LOOKUP[trigger]
-        command_type = CommandMode.TRIGGER
-        Ayumi.debug("Found in trigger lookup: {}".format(trigger))
-    except:
-        try:
-            module = SLASH_LOOKUP[slash]
-            command_type = CommandMode.SLASH
-            Ayumi.debug("Found in slash lookup: {}".format(slash))
-        except:
-            for binder in REGEX_LOOKUP:
-                if binder[0].match(command):
-                    module = binder[1]
-                    command_type = CommandMode.REGEX
-                    Ayumi.debug("Matched in regex lookup: {}".format(command))
-                    break
+    with STAGE_LATENCY.time("trigger"):
+        module = registry.triggers.get(query.trigger)
+    if module:
+        log.debug("Found in trigger lookup: {}", query.trigger)
+        return module, CommandMode.TRIGGER
+
+    with STAGE_LATENCY.time("slash"):
+        module = registry.slashes.get(query.slash)
+    if module:
+        log.debug("Found in slash lookup: {}", query.slash)
+        return module, CommandMode.SLASH
+
+    # The catch-all default binding always matches
+    with STAGE_LATENCY.time("regex"):
+        module = registry.dispatcher.match(query.command)
+    log.debug("Matched in regex lookup: {}", query.command)
+    return module, CommandMode.REGEX
+
+def _redirect(module: LookupItem, command_type: CommandMode, query: ParsedQuery, language_accept: Tuple) -> Tuple[str, bool]:
+    """
+    Negotiate the language for a dispatched command and return (url, skipped) from its module.
+    Errors raised by the command are counted in COMMAND_ERRORS and passed on.
+    If the guard skipped the command, the url is its fallback (see _fallback) and skipped is True,
+    so the url must not be cached.
+    """
 
     # Determine the language to be used, in accordance with support from the module.
-    Ayumi.debug("Loaded module declared languages: {}".format(module.languages))
-    for la in language_accept:
-        if la in [Language.get(i) for i in module.languages]:
-            Ayumi.debug("Overwrote request use language from en to {}".format(str(la)))
-            language = la
-            break
-
-    # Return with command or without.
-    try:
-        # For ease of development, just convert the slash command into a trigger command.
-        url = module.redirect(language, command.replace("/", " ").split()) \
-            if command_type is CommandMode.SLASH \
-            else module.redirect(language, command.split())
-        Ayumi.debug('Returning "{}" to "{}"'.format(command_og, url))
-        return url
-    except:
-        url = module.redirect(language)
-        Ayumi.debug('Returning "{}" to "{}"'.format(command_og, url))
-        return url
+    log.debug("Loaded module declared languages: {}", module.languages)
+    language = negotiate(module, language_accept)
+    if language:
+        log.debug("Overwrote request use language from en to {}", language)
+
+    # For ease of development, slash commands are passed the same arguments as a trigger command.
+    args = query.slash_args if command_type is CommandMode.SLASH and module.takes_arguments else query.args
+
+    with STAGE_LATENCY.time("redirect"):
+        try:
+            return module.redirect(language, args), False
+        except CommandSkipped as e:
+            return _fallback(e, query, language_accept), True
+        except Exception:
+            COMMAND_ERRORS.inc(module.label)
+            raise
+
+def _fallback(skipped: CommandSkipped, query: ParsedQuery, language_accept: Tuple) -> str:
+    """
+    Return the default url of a skipped command, or a Google search of the query if it has none.
+    """
+    log.debug("Skipped {} ({}), using its fallback.", skipped.name, skipped.reason)
+    if skipped.default:
+        return skipped.default
+    default = loader.DEFAULT_LOOKUP
+    return default.redirect(negotiate(default, language_accept), query.args)
+
+def _dispatch_overlay(overlay: Registry, query: ParsedQuery) -> Tuple[Optional[LookupItem], CommandMode]:
+    """
+    Find the shortcut in a user's overlay that a query resolves to, if any. Timed as a
+    single stage, as it runs ahead of the global lookup on every request with a token.
+    """
+    with STAGE_LATENCY.time("overlay"):
+        module = overlay.triggers.get(query.trigger)
+        if module:
+            return module, CommandMode.TRIGGER
+        module = overlay.slashes.get(query.slash)
+        if module:
+            return module, CommandMode.SLASH
+        return (overlay.dispatcher.match(query.command) if overlay.regexes else None), CommandMode.REGEX
+
+def _resolve_overlay(overlay: Registry, query: ParsedQuery, language_accept: Tuple) -> Optional[str]:
+    """
+    Return the url from the user's overlay if the query matches one of their shortcuts.
+    Overlay results are never cached, as RESULT_CACHE is shared by every user.
+    """
+    module, command_type = _dispatch_overlay(overlay, query)
+    if module is None:
+        return None
+    log.debug("Found in overlay {} lookup: {}", command_type.name.lower(), query.command)
+    MATCHES.inc(module.label, command_type.name)
+    return _redirect(module, command_type, query, language_accept)[0]
+
+def resolve(query: ParsedQuery, language_accept: Tuple, overlay: Optional[Registry] = None) -> Tuple[str, bool, bool]:
+    """
+    Perform a search over imported modules and return the best match. Defaults to Google.
+
+    Params:
+    - query: The user query, as parsed by query.parse_query.
+    - language_accept: A Tuple of Language objects to check for the best language.
+    - overlay: The user's shortcuts, see overlay.get_overlay. Looked up before the imported modules.
+
+    Returns (url, deterministic, localised):
+    - deterministic: Whether browsers may cache the redirect. Only ever True for a trigger
+                     or slash command given without arguments, whose module is deterministic.
+    - localised: Whether the url can depend on the accepted languages.
+
+    Results of commands that are cacheable are kept in RESULT_CACHE, which is cleared
+    whenever the lookup tables change. Fallback urls of skipped commands are never cached.
+    """
+
+    if overlay is not None:
+        url = _resolve_overlay(overlay, query, language_accept)
+        if url is not None:
+            log.debug('Returning "{}" to "{}" from overlay', query.text, url)
+            return url, False, False
+
+    cache_key = (query.command, language_accept)
+    cached = RESULT_CACHE.get(cache_key)
+    if cached is not MISSING:
+        url, label, command_type, deterministic, localised = cached
+        MATCHES.inc(label, command_type.name)
+        log.debug('Returning cached "{}" to "{}"', query.text, url)
+        return url, deterministic, localised
+
+    # Take a reference to the current registry, so a reload cannot swap it mid-request.
+    module, command_type = _dispatch(loader.REGISTRY, query)
+    MATCHES.inc(module.label, command_type.name)
+
+    url, skipped = _redirect(module, command_type, query, language_accept)
+    if skipped:
+        return url, False, True
+    deterministic = module.deterministic and _without_arguments(query, command_type)
+    localised = bool(module.language_tags)
+    if module.cacheable:
+        RESULT_CACHE.put(cache_key, (url, module.label, command_type, deterministic, localised))
+    log.debug('Returning "{}" to "{}"', query.text, url)
+    return url, deterministic, localised
+
+def search(query: ParsedQuery, language_accept: Tuple, overlay: Optional[Registry] = None) -> str:
+    """
+    Return the url a query redirects to, see resolve().
+    """
+    return resolve(query, language_accept, overlay)[0]
+
+def _without_arguments(query: ParsedQuery, command_type: CommandMode) -> bool:
+    """
+    Whether the query is only the trigger or slash of the command. Regex bindings see
+    the whole query, so their results always depend on its text.
+    """
+    if command_type is CommandMode.TRIGGER:
+        return len(query.args) == 1
+    if command_type is CommandMode.SLASH:
+        return len(query.slash_args) == 1
+    return False
+
+def _completions(registry: Registry, prefix: str) -> List[Tuple[str, LookupItem]]:
+    return registry.triggers.complete(prefix) + \
+        [(key + "/", item) for key, item in registry.slashes.complete(prefix)]
+
+def suggest(prefix: str, overlay: Optional[Registry] = None) -> List[Tuple[str, LookupItem]]:
+    """
+    Complete the first word of a partially typed command from the registered triggers
+    and slashes, ignoring case. Returns (completion, LookupItem) pairs, shortest first.
+    Slash completions end with "/". Shortcuts in the user's overlay replace global
+    completions with the same key.
+    """
+
+    # Only the trigger word is completed, once it is followed by anything there is nothing to suggest.
+    if not prefix or ' ' in prefix or '/' in prefix:
+        return list()
+
+    completions = _completions(loader.REGISTRY, prefix)
+    if overlay is not None:
+        own = _completions(overlay, prefix)
+        keys = set(key.casefold() for key, _ in own)
+        completions = own + [kv for kv in completions if kv[0].casefold() not in keys]
+    completions.sort(key=lambda kv: (len(kv[0]), kv[0].casefold()))
+    return completions[:SUGGESTION_LIMIT]
+
+def search_many(queries: Iterable[Tuple[ParsedQuery, Tuple]], overlay: Optional[Registry] = None) -> List[Optional[str]]:
+    """
+    Resolve many commands at once, for use in-process or by the batch endpoint.
+    Returns urls in the same order as the queries, with None for any query whose
+    command raised an error.
+
+    Params:
+    - queries: (query, language_accept) pairs, as would be passed to search().
+               See query.parse_query and language.resolve_languages for building them without a request.
+    - overlay: The user's shortcuts, looked up before the imported modules.
+
+    Every query is resolved against the same registry. Repeated queries are only
+    resolved once, and the rest are grouped by module before calling their redirects.
+    """
+
+    registry = loader.REGISTRY
+    urls: List[Optional[str]] = list()
+    pending: Dict[Tuple, Tuple[ParsedQuery, List[int]]] = dict()
+
+    for index, (query, language_accept) in enumerate(queries):
+        urls.append(None)
+        if overlay is not None:
+            try:
+                urls[index] = _resolve_overlay(overlay, query, language_accept)
+            except Exception as e:
+                log.warning("Caught error resolving batch query with overlay: {}", e)
+                continue
+            if urls[index] is not None:
+                continue
+        cache_key = (query.command, language_accept)
+        if cache_key in pending:
+            pending[cache_key][1].append(index)
+            continue
+        cached = RESULT_CACHE.get(cache_key)
+        if cached is not MISSING:
+            urls[index] = cached[0]
+            MATCHES.inc(cached[1], cached[2].name)
+        else:
+            pending[cache_key] = (query, [index])
+
+    # Group the remaining queries by the module they dispatch to.
+    groups: Dict[LookupItem, List[Tuple[Tuple, CommandMode]]] = dict()
+    for cache_key, (query, _) in pending.items():
+        module, command_type = _dispatch(registry, query)
+        groups.setdefault(module, list()).append((cache_key, command_type))
+
+    for module, items in groups.items():
+        for cache_key, command_type in items:
+            query, indices = pending[cache_key]
+            MATCHES.inc(module.label, command_type.name, amount=len(indices))
+            try:
+                url, skipped = _redirect(module, command_type, query, cache_key[1])
+            except Exception as e:
+                log.warning("Caught error resolving batch query with {}: {}", module.name, e)
+                continue
+            if module.cacheable and not skipped:
+                RESULT_CACHE.put(cache_key, (url, module.label, command_type,
+                    module.deterministic and _without_arguments(query, command_type), bool(module.language_tags)))
+            for index in indices:
+                urls[index] = url
+
+    log.debug("Resolved batch of {} queries ({} distinct).", len(urls), len(pending))
+    return urls
@@ -0,0 +1,84 @@
+"""
+Single-pass tokenizer for user queries.
+
+A query is split into words once, and everything the request path needs is taken
+from that split: the trigger word, the slash prefix, the " -xx" language override
+and the arguments passed to the command's redirect.
+"""
+
+import re
+
+from itertools import islice
+from langcodes import Language
+from typing import Optional, Tuple
+
+# Words, with their positions, to cut the language override out of the original text.
+WORD = re.compile(r'\S+')
+# A language override word, such as "-ja" or "-en-US". Matched against one word at a time,
+# so it cannot backtrack across the query.
+LANGUAGE_OVERRIDE = re.compile(r'-([A-Za-z]{2,3}(?:-[A-Za-z0-9]{1,8})*)')
+
+class ParsedQuery:
+    """
+    A stripped user query, split into words.
+
+    Attributes:
+    - text: The query as typed, stripped. Used for logging.
+    - command: The query with the language override removed.
+    - tokens: Every word of the query, including the language override.
+    - args: The words of the command, as passed to the redirect of a trigger or regex command.
+    - trigger: The first word of the command, if any.
+    - slash: The part of the trigger before its first "/", if it has one.
+    - language: The language given as " -xx", if any. Only the last one counts,
+                and the first word is never an override.
+    """
+
+    __slots__ = ('text', 'command', 'tokens', 'args', 'trigger', 'slash', 'language', '_slash_args')
+
+    def __init__(self, text: str, command: str, tokens: Tuple[str], args: Tuple[str], language: Optional[Language]):
+        self.text: str = text
+        self.command: str = command
+        self.tokens: Tuple[str] = tokens
+        self.args: Tuple[str] = args
+        self.trigger: Optional[str] = args[0] if args else None
+        self.slash: Optional[str] = self.trigger.split('/', 1)[0] if self.trigger and '/' in self.trigger else None
+        self.language: Optional[Language] = language
+        self._slash_args: Optional[Tuple[str]] = None
+
+    @property
+    def slash_args(self) -> Tuple[str]:
+        """
+        The words of the command with every "/" read as a space, as passed to the
+        redirect of a slash command, e.g. g/query -> ("g", "query").
+        """
+        if self._slash_args is None:
+            self._slash_args = tuple(self.command.replace("/", " ").split())
+        return self._slash_args
+
+    def __repr__(self) -> str:
+        return "ParsedQuery({!r})".format(self.text)
+
+def parse_query(text: str) -> ParsedQuery:
+    """
+    Split a query into a ParsedQuery, in time linear in the length of the query.
+    """
+    text = text.strip()
+    tokens = tuple(text.split())
+
+    # The last word after the first that reads as a language tag is the override.
+    for index in range(len(tokens) - 1, 0, -1):
+        if tokens[index][0] != '-':
+            continue
+        match = LANGUAGE_OVERRIDE.fullmatch(tokens[index])
+        if not match:
+            continue
+        try:
+            language = Language.get(match.group(1))
+        except Exception:
+            continue
+        # Cut the override out of the original text, keeping the spacing of the rest.
+        start, end = next(islice(WORD.finditer(text), index, None)).span()
+        command = "{} {}".format(text[:start].rstrip(), text[end:].lstrip()).strip()
+        return ParsedQuery(text, command, tokens, tokens[:index] + tokens[index + 1:], language)
+
+    return ParsedQuery(text, text, tokens, tokens, None)
@@ -0,0 +1,527 @@
+"""
+Load-time cost analysis of regex bindings.
+
+Every binding of a command file is checked when the file is imported:
+- Statically, for nested quantifiers and for alternations with overlapping
+  branches under a quantifier, the usual causes of catastrophic backtracking.
+- By timing it against an adversarial corpus generated from the pattern itself,
+  growing the input until it exceeds REGEX_MATCH_BUDGET or reaches REGEX_AUDIT_MAX_LENGTH.
+
+Bindings over budget are then handled according to REGEX_AUDIT_MODE:
+- warn: Log a warning and keep the binding (default).
+- sandbox: Keep the binding, but only match it against commands no longer than
+           the longest input it handled within budget.
+- reject: Drop the binding.
+- off: Skip the analysis.
+
+The per-binding report is written to REGEX_AUDIT_REPORT after every reload if set,
+and can be printed for the current commands with:
+    python -m src.athenaeum.regex_audit
+"""
+
+import json
+import string
+
+from ayumi import Ayumi
+
+from itertools import combinations
+from re import IGNORECASE, Match, Pattern, compile
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from src.config import settings
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+AUDIT_MODE: str = str(settings.get("REGEX_AUDIT_MODE", "warn")).lower()
+AUDIT_MODES = ("off", "warn", "sandbox", "reject")
+# Longest time, in seconds, a single match may take on the adversarial corpus.
+MATCH_BUDGET: float = float(settings.get("REGEX_MATCH_BUDGET", 0.001))
+# Longest adversarial input tried. Queries of several KB do reach the regex bindings.
+MAX_CORPUS_LENGTH: int = settings.get("REGEX_AUDIT_MAX_LENGTH", 4096)
+REPORT_PATH: Optional[str] = settings.get("REGEX_AUDIT_REPORT")
+
+# Input lengths are grown slowly while short, so an exponential pattern is caught
+# only a few times over budget, then doubled up to MAX_CORPUS_LENGTH.
+SHORT_LENGTHS = tuple(range(2, 33, 2))
+# Repeated units, besides those taken from the pattern, that commonly cause backtracking.
+GENERIC_PUMPS = ("a", " ", "a ", " -")
+# Endings that make the adversarial inputs fail late, forcing every alternative to be tried.
+FAILING_SUFFIXES = ("!", "\n")
+# Each input is matched this many times, keeping the fastest, to filter out scheduling noise.
+TIMING_REPEATS = 3
+# Quantifiers allowing more repetitions than this count as unbounded.
+UNBOUNDED = 16
+
+_REPEATS = tuple(getattr(sre_parse, name) for name in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT") if hasattr(sre_parse, name))
+_CATEGORIES = {
+    'DIGIT': compile(r'\d'), 'NOT_DIGIT': compile(r'\D'),
+    'SPACE': compile(r'\s'), 'NOT_SPACE': compile(r'\S'),
+    'WORD': compile(r'\w'), 'NOT_WORD': compile(r'\W'),
+}
+# Characters used to check whether two character classes can match the same character.
+_PROBE = string.printable + "éあ "
+
+class BindingReport:
+    """
+    The cost analysis of one regex binding.
+    """
+
+    __slots__ = ('command', 'path', 'pattern', 'flags', 'findings', 'worst_seconds', 'worst_length', 'safe_length', 'over_budget')
+
+    def __init__(self, command: str, path: str, pattern: str, flags: int, findings: List[str],
+                 worst_seconds: float, worst_length: int, safe_length: int, over_budget: bool):
+        self.command: str = command
+        self.path: str = path
+        self.pattern: str = pattern
+        self.flags: int = flags
+        self.findings: List[str] = findings
+        self.worst_seconds: float = worst_seconds
+        self.worst_length: int = worst_length
+        self.safe_length: int = safe_length
+        self.over_budget: bool = over_budget
+
+    @property
+    def action(self) -> str:
+        """
+        What is done with the binding under the current REGEX_AUDIT_MODE.
+        """
+        if not self.over_budget or AUDIT_MODE == "off":
+            return "keep"
+        return {"sandbox": "sandbox", "reject": "reject"}.get(AUDIT_MODE, "warn")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'command': self.command,
+            'path': self.path,
+            'pattern': self.pattern,
+            'flags': self.flags,
+            'findings': self.findings,
+            'worst_us': round(self.worst_seconds * 1e6, 1),
+            'worst_length': self.worst_length,
+            'safe_length': self.safe_length,
+            'over_budget': self.over_budget,
+            'action': self.action,
+        }
+
+    @classmethod
+    def from_dict(cls, entry: Dict[str, Any]) -> "BindingReport":
+        return cls(entry['command'], entry['path'], entry['pattern'], entry['flags'], entry['findings'],
+                   entry['worst_us'] / 1e6, entry['worst_length'], entry['safe_length'], entry['over_budget'])
+
+class SandboxedPattern:
+    """
+    A binding that only matches commands up to the length it was measured to handle within budget.
+    Longer commands skip it and fall through to the next binding.
+    """
+
+    __slots__ = ('_pattern', 'max_length')
+
+    def __init__(self, pattern: Pattern, max_length: int):
+        self._pattern: Pattern = pattern
+        self.max_length: int = max_length
+
+    def match(self, command: str) -> Optional[Match]:
+        if len(command) > self.max_length:
+            return None
+        return self._pattern.match(command)
+
+    @property
+    def pattern(self) -> str:
+        return self._pattern.pattern
+
+    @property
+    def flags(self) -> int:
+        return self._pattern.flags
+
+    @property
+    def groupindex(self) -> Dict[str, int]:
+        return self._pattern.groupindex
+
+# Reports keyed by (pattern, flags), kept across reloads so unchanged bindings are not measured again.
+REPORTS: Dict[Tuple[str, int], BindingReport] = dict()
+# First characters of every pattern seen by can_overlap, by (pattern, flags), as it is
+# called for every pair of bindings on each reload.
+FIRST_CHARS: Dict[Tuple[Any, int], Optional[Tuple[Optional[Set[str]], Optional[List[Pattern]]]]] = dict()
+
+def _is_repeat(op) -> bool:
+    return op in _REPEATS
+
+def _children(op, av) -> List[list]:
+    """
+    Return the sub-sequences of a parsed node.
+    """
+    if op is sre_parse.BRANCH:
+        return list(av[1])
+    if op is sre_parse.SUBPATTERN:
+        return [av[-1]]
+    if _is_repeat(op):
+        return [av[2]]
+    if op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+        return [av[1]]
+    if op is sre_parse.GROUPREF_EXISTS:
+        return [b for b in av[1:] if b is not None]
+    return list()
+
+def _can_consume(items) -> bool:
+    """
+    Whether a sequence can match at least one character.
+    """
+    for op, av in items:
+        if op in (sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.ANY, sre_parse.IN):
+            return True
+        if op not in (sre_parse.ASSERT, sre_parse.ASSERT_NOT) and any(_can_consume(c) for c in _children(op, av)):
+            return True
+    return False
+
+def _atom_predicate(op, av) -> Callable[[str], bool]:
+    if op is sre_parse.LITERAL:
+        return lambda c: c == chr(av)
+    if op is sre_parse.NOT_LITERAL:
+        return lambda c: c != chr(av)
+    if op is sre_parse.IN:
+        if av and av[0][0] is sre_parse.NEGATE:
+            inner = [_atom_predicate(o, a) for o, a in av[1:]]
+            return lambda c: not any(p(c) for p in inner)
+        inner = [_atom_predicate(o, a) for o, a in av]
+        return lambda c: any(p(c) for p in inner)
+    if op is sre_parse.RANGE:
+        return lambda c: av[0] <= ord(c) <= av[1]
+    if op is sre_parse.CATEGORY:
+        name = str(av).replace("CATEGORY_", "", 1).replace("UNI_", "", 1).replace("LOC_", "", 1)
+        category = _CATEGORIES.get(name)
+        return (lambda c: category.match(c) is not None) if category else (lambda c: True)
+    return lambda c: True
+
+def _first(items) -> Tuple[List[Callable[[str], bool]], bool]:
+    """
+    Return predicates for the characters a sequence can start with, and whether it can match empty.
+    """
+    predicates = list()
+    for op, av in items:
+        if op in (sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.IN):
+            return predicates + [_atom_predicate(op, av)], False
+        if op is sre_parse.ANY:
+            return predicates + [lambda c: True], False
+        if op is sre_parse.BRANCH:
+            nullable = False
+            for branch in av[1]:
+                found, empty = _first(branch)
+                predicates.extend(found)
+                nullable = nullable or empty
+            if not nullable:
+                return predicates, False
+        elif op is sre_parse.SUBPATTERN or _is_repeat(op):
+            found, empty = _first(_children(op, av)[0])
+            predicates.extend(found)
+            if not empty and not (_is_repeat(op) and av[0] == 0):
+                return predicates, False
+        elif op is sre_parse.GROUPREF:
+            return predicates + [lambda c: True], False
+    return predicates, True
+
+def _overlap(a: Tuple[List[Callable[[str], bool]], bool], b: Tuple[List[Callable[[str], bool]], bool]) -> bool:
+    if a[1] or b[1]:
+        return True
+    return any(any(p(c) for p in a[0]) and any(p(c) for p in b[0]) for c in _PROBE)
+
+def _first_atoms(items) -> Optional[Tuple[List[tuple], bool]]:
+    """
+    Return the (op, av) nodes a sequence can consume its first character with, and
+    whether it can match empty, or None if it can start with a back reference.
+    """
+    atoms = list()
+    for op, av in items:
+        if op in (sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.IN, sre_parse.ANY):
+            return atoms + [(op, av)], False
+        if op is sre_parse.BRANCH:
+            nullable = False
+            for branch in av[1]:
+                found = _first_atoms(branch)
+                if found is None:
+                    return None
+                atoms.extend(found[0])
+                nullable = nullable or found[1]
+            if not nullable:
+                return atoms, False
+        elif op is sre_parse.SUBPATTERN or _is_repeat(op):
+            found = _first_atoms(_children(op, av)[0])
+            if found is None:
+                return None
+            atoms.extend(found[0])
+            # Like a repeat that may not run, a group that can match empty lets the next node start the match.
+            if not found[1] and not (_is_repeat(op) and av[0] == 0):
+                return atoms, False
+        elif op in (sre_parse.GROUPREF, sre_parse.GROUPREF_EXISTS):
+            return None
+    return atoms, True
+
+def _ascii_set(atoms: List[tuple], ignorecase: bool) -> Optional[Set[str]]:
+    """
+    Return the first characters as a set, if they are all ASCII and explicitly listed.
+    """
+    chars = set()
+    for op, av in atoms:
+        if op is sre_parse.IN and not any(o in (sre_parse.NEGATE, sre_parse.CATEGORY) for o, _ in av):
+            found = _ascii_set(av, ignorecase)
+            if found is None:
+                return None
+            chars |= found
+        elif op is sre_parse.LITERAL and av < 128:
+            chars.add(chr(av))
+        elif op is sre_parse.RANGE and av[1] < 128:
+            chars.update(chr(c) for c in range(av[0], av[1] + 1))
+        else:
+            return None
+    return set(c.lower() for c in chars) | set(c.upper() for c in chars) if ignorecase else chars
+
+def _categories(atoms: List[tuple]) -> Optional[List[Pattern]]:
+    """
+    Return the first characters as a list of categories (\\d, \\w, ...), if that is all they are.
+    """
+    found = list()
+    for op, av in atoms:
+        if op is sre_parse.IN and all(o is sre_parse.CATEGORY for o, _ in av):
+            found.extend(_categories(av))
+        elif op is sre_parse.CATEGORY:
+            category = _CATEGORIES.get(str(av).replace("CATEGORY_", "", 1).replace("UNI_", "", 1).replace("LOC_", "", 1))
+            if category is None:
+                return None
+            found.append(category)
+        else:
+            return None
+    return found
+
+def _ignores_case(pattern: Pattern, items) -> bool:
+    if pattern.flags & IGNORECASE:
+        return True
+    def scoped(items) -> bool:
+        return any((op is sre_parse.SUBPATTERN and av[1] & IGNORECASE) or any(scoped(c) for c in _children(op, av)) for op, av in items)
+    return scoped(items)
+
+def _first_chars(pattern: Pattern) -> Optional[Tuple[Optional[Set[str]], Optional[List[Pattern]]]]:
+    """
+    Return the characters a pattern can start its match with, as an ASCII set and as
+    categories (see _ascii_set and _categories), or None if it could start with anything.
+    """
+    key = (pattern.pattern, pattern.flags)
+    if key in FIRST_CHARS:
+        return FIRST_CHARS[key]
+    first = None
+    if isinstance(pattern.pattern, str):
+        items = sre_parse.parse(pattern.pattern, pattern.flags)
+        found = _first_atoms(items)
+        if found is not None and found[0] and not found[1]:
+            ignorecase = _ignores_case(pattern, items)
+            chars, categories = _ascii_set(found[0], ignorecase), _categories(found[0])
+            if chars is not None or categories is not None:
+                first = (chars, categories)
+    FIRST_CHARS[key] = first
+    return first
+
+def can_overlap(a: Pattern, b: Pattern) -> bool:
+    """
+    Whether some input could be matched (with .match) by both patterns.
+    Only answers False when the characters the two can start with are provably
+    disjoint, so it is safe to reorder two patterns for which it returns False.
+    """
+    first_a, first_b = _first_chars(a), _first_chars(b)
+    if first_a is None or first_b is None:
+        return True
+
+    (chars_a, categories_a), (chars_b, categories_b) = first_a, first_b
+    if chars_a is not None and chars_b is not None:
+        return not chars_a.isdisjoint(chars_b)
+    # Categories match every case of an ASCII letter alike, so testing the listed characters is enough.
+    if chars_a is not None and categories_b is not None:
+        return any(c.match(x) for c in categories_b for x in chars_a)
+    if chars_b is not None and categories_a is not None:
+        return any(c.match(x) for c in categories_a for x in chars_b)
+    return True
+
+def analyse(pattern: Pattern) -> List[str]:
+    """
+    Return the constructs in a pattern that are prone to catastrophic backtracking.
+    """
+    findings: List[str] = list()
+
+    def walk(items, repeated: bool):
+        for op, av in items:
+            if _is_repeat(op):
+                unbounded = av[1] > UNBOUNDED
+                if unbounded and repeated and _can_consume(av[2]):
+                    findings.append("nested quantifier")
+                walk(av[2], repeated or unbounded)
+                continue
+            if op is sre_parse.BRANCH and repeated:
+                if any(_overlap(_first(x), _first(y)) for x, y in combinations(av[1], 2)):
+                    findings.append("ambiguous alternation under a quantifier")
+            for child in _children(op, av):
+                walk(child, repeated)
+
+    if isinstance(pattern.pattern, str):
+        walk(sre_parse.parse(pattern.pattern, pattern.flags), False)
+    return sorted(set(findings))
+
+def _sample(items) -> str:
+    """
+    Return a short string the sequence would match, or close to it.
+    """
+    return "".join(_sample_node(op, av) for op, av in items)
+
+def _sample_node(op, av) -> str:
+    if op is sre_parse.LITERAL:
+        return chr(av)
+    if op in (sre_parse.IN, sre_parse.NOT_LITERAL, sre_parse.ANY):
+        accepts = _atom_predicate(op, av) if op is not sre_parse.ANY else (lambda c: c != "\n")
+        return next((c for c in _PROBE if accepts(c)), "")
+    if op is sre_parse.BRANCH:
+        return _sample(av[1][0])
+    if op is sre_parse.SUBPATTERN:
+        return _sample(av[-1])
+    if _is_repeat(op):
+        return _sample(av[2]) * av[0]
+    return ""
+
+def adversarial_corpus(pattern: Pattern) -> Iterator[Tuple[int, List[str]]]:
+    """
+    Yield (length, inputs) in order of increasing length. Each input starts with text
+    leading up to the pattern's first quantifier, repeats a unit the pattern's
+    quantifiers accept, and ends with a character that makes the match fail late.
+    """
+    items = sre_parse.parse(pattern.pattern, pattern.flags)
+    prefix = list()
+    pumps = list()
+
+    def collect(items):
+        for op, av in items:
+            if _is_repeat(op) and av[1] > 1:
+                pumps.append(_sample(av[2]) or _sample_node(sre_parse.ANY, None))
+            for child in _children(op, av):
+                collect(child)
+
+    for op, av in items:
+        contains_repeat = _is_repeat(op) or any(_contains_repeat(c) for c in _children(op, av))
+        if contains_repeat:
+            break
+        prefix.append(_sample_node(op, av))
+    collect(items)
+    prefix = "".join(prefix)
+    pumps = list(dict.fromkeys([p for p in pumps if p] + list(GENERIC_PUMPS)))
+
+    lengths = list(SHORT_LENGTHS)
+    while lengths[-1] < MAX_CORPUS_LENGTH:
+        lengths.append(min(lengths[-1] * 2, MAX_CORPUS_LENGTH))
+    for length in lengths:
+        yield length, [prefix + (pump * (length // len(pump) + 1))[:length] + suffix
+                       for pump in pumps for suffix in FAILING_SUFFIXES]
+
+def _contains_repeat(items) -> bool:
+    return any(_is_repeat(op) or any(_contains_repeat(c) for c in _children(op, av)) for op, av in items)
+
+def benchmark(pattern: Pattern) -> Tuple[float, int, int]:
+    """
+    Time a pattern against its adversarial corpus, stopping at the first input over budget.
+    Returns the worst time per match, the length of the input it was seen on, and the
+    longest length at which every input stayed within budget.
+    """
+    worst, worst_length, safe_length = 0.0, 0, 0
+    for length, inputs in adversarial_corpus(pattern):
+        for text in inputs:
+            elapsed = float("inf")
+            for _ in range(TIMING_REPEATS):
+                start = perf_counter()
+                pattern.match(text)
+                elapsed = min(elapsed, perf_counter() - start)
+                if elapsed <= MATCH_BUDGET:
+                    break
+            if elapsed > worst:
+                worst, worst_length = elapsed, length
+            if elapsed > MATCH_BUDGET:
+                return worst, worst_length, safe_length
+        safe_length = length
+    return worst, worst_length, safe_length
+
+def audit_binding(pattern: Pattern, command: str, path: str) -> BindingReport:
+    """
+    Analyse and time one binding, reusing the report of an identical pattern if there is one.
+    """
+    key = (pattern.pattern, pattern.flags)
+    report = REPORTS.get(key)
+    if report is None:
+        findings = analyse(pattern)
+        worst, worst_length, safe_length = benchmark(pattern) if isinstance(pattern.pattern, str) else (0.0, 0, 0)
+        report = REPORTS[key] = BindingReport(command, path, pattern.pattern, pattern.flags, findings,
+                                              worst, worst_length, safe_length, worst > MATCH_BUDGET)
+    return report
+
+def audit_commands(commands: list, path: str) -> List[BindingReport]:
+    """
+    Audit the regex bindings of the commands loaded from a file, logging any that are
+    risky or over budget. Does nothing if REGEX_AUDIT_MODE is "off".
+    """
+    if AUDIT_MODE == "off":
+        return list()
+    reports = list()
+    for command in commands:
+        for pattern in command.bindings or list():
+            report = audit_binding(pattern, command.name, path)
+            reports.append(report)
+            if report.over_budget:
+                Ayumi.warning("Binding {} of {} took {:.1f}ms on a {} character input, over the {:.1f}ms budget ({}): {}".format(
+                    pattern.pattern, command.name, report.worst_seconds * 1e3, report.worst_length,
+                    MATCH_BUDGET * 1e3, ", ".join(report.findings) or "no risky constructs found", report.action), color=Ayumi.LRED)
+            elif report.findings:
+                Ayumi.debug("Binding {} of {} has {}, but stayed within budget.".format(
+                    pattern.pattern, command.name, ", ".join(report.findings)), color=Ayumi.LYELLOW)
+    return reports
+
+def screen(pattern: Pattern) -> Optional[Any]:
+    """
+    Return the pattern to register for a binding under REGEX_AUDIT_MODE: the pattern itself,
+    a SandboxedPattern, or None if the binding is rejected. Unaudited bindings are kept as is.
+    """
+    report = REPORTS.get((pattern.pattern, pattern.flags))
+    if report is None:
+        return pattern
+    action = report.action
+    if action == "reject":
+        return None
+    if action == "sandbox":
+        return SandboxedPattern(pattern, report.safe_length)
+    return pattern
+
+def restore_report(entry: Dict[str, Any]) -> BindingReport:
+    """
+    Restore a report saved in the registry manifest, for commands that are not re-imported.
+    """
+    report = BindingReport.from_dict(entry)
+    return REPORTS.setdefault((report.pattern, report.flags), report)
+
+def build_report(reports: Iterable[BindingReport]) -> List[Dict[str, Any]]:
+    """
+    Return the cost report of the given bindings, most expensive first.
+    """
+    return [r.to_dict() for r in sorted(reports, key=lambda r: r.worst_seconds, reverse=True)]
+
+def write_report(reports: Iterable[BindingReport], path: Optional[str] = REPORT_PATH):
+    """
+    Write the cost report as JSON, if a path is configured.
+    """
+    if not path:
+        return
+    entries = build_report(reports)
+    with open(path, 'w') as f:
+        json.dump(entries, f, indent=2)
+    Ayumi.debug("Wrote regex cost report for {} binding(s) to {}.".format(len(entries), path))
+
+if AUDIT_MODE not in AUDIT_MODES:
+    Ayumi.warning("Unknown REGEX_AUDIT_MODE {}, using warn.".format(AUDIT_MODE), color=Ayumi.LYELLOW)
+    AUDIT_MODE = "warn"
+
+if __name__ == "__main__":
+    from src.athenaeum import loader
+    print(json.dumps(build_report(loader.audit_reports()), indent=2))
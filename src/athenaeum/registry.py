@@ -0,0 +1,100 @@
+from ayumi import Ayumi
+from re import compile, Pattern
+from typing import List, Optional, Tuple, Union
+
+from src import log
+from src.commands.base_command import Usagi12BaseCommand
+from src.commands.template_command import TemplateCommand
+from src.config import settings
+
+from .compiled import CompiledRegistry, RegistryCompiler
+from .dispatcher import ADAPTIVE_ORDER, RegexDispatcher
+from .lookup_item import LookupItem
+from .regex_audit import screen
+from .trie import Trie
+
+# Number of completions returned for a prefix.
+SUGGESTION_LIMIT: int = settings.get("SUGGESTION_LIMIT", 8)
+
+class Registry:
+    """
+    A complete set of lookup tables.
+
+    A new Registry is built off to the side every time commands are (re)loaded and
+    then swapped in as a whole, so a request never sees a half-built table.
+    Do not modify a Registry once finalise() has been called.
+
+    Template commands can be kept in a compiled registry rather than in the tries
+    (see compiled), which then backs the tries for the keys they do not hold:
+    - compiled: A compiled registry holding the template commands, already added.
+    - compiler: A compiler that template commands are sent to as they are added,
+                and that compiles them when the registry is finalised.
+    """
+
+    def __init__(self, compiled: Optional[CompiledRegistry] = None, compiler: Optional[RegistryCompiler] = None):
+        self.triggers: Trie[LookupItem] = Trie(SUGGESTION_LIMIT)
+        self.slashes: Trie[LookupItem] = Trie(SUGGESTION_LIMIT)
+        self.regexes: List[Tuple[Pattern, LookupItem]] = list()
+        self.dispatcher: Optional[RegexDispatcher] = None
+        self.default: Optional[LookupItem] = None
+        self.compiled: Optional[CompiledRegistry] = compiled
+        self.compiler: Optional[RegistryCompiler] = compiler
+        tables = compiled or compiler
+        if tables is not None:
+            self.triggers.backing, self.slashes.backing = tables.triggers, tables.slashes
+
+    def add_command(self, command: Union[Usagi12BaseCommand, TemplateCommand]):
+        """
+        Register the triggers, slashes and bindings of a command instance.
+        The first command to claim a trigger or slash keeps it, ignoring case.
+        """
+        if self.compiler is not None and isinstance(command, TemplateCommand):
+            self.compiler.add(command, self.triggers, self.slashes)
+            return
+        item = LookupItem.from_command(command)
+        for binding in command.triggers or list():
+            if binding not in self.triggers:
+                log.debug("Adding trigger: {}", binding, color=Ayumi.LCYAN)
+                self.triggers[binding] = item
+        for binding in command.slashes or list():
+            if binding.endswith("/"): binding = binding[:-1]
+            if binding not in self.slashes:
+                log.debug("Adding slash: {}", binding, color=Ayumi.LCYAN)
+                self.slashes[binding] = item
+        for binding in command.bindings or list():
+            # Bindings over the regex cost budget may be sandboxed or rejected, see regex_audit.
+            binding = screen(binding)
+            if binding is None:
+                continue
+            log.debug("Adding binding: {} with flag(s): {}", binding.pattern, binding.flags or "None", color=Ayumi.LCYAN)
+            self.regexes.append((binding, item))
+
+    def finalise(self, default: Optional[LookupItem], adaptive: bool = ADAPTIVE_ORDER):
+        """
+        Add the catch-all default binding, compile the regex dispatcher, and write out
+        the template commands if they are being compiled.
+
+        Params:
+        - default: The entry every unmatched command resolves to. None for a registry
+                   that is looked up before another one, such as a user's overlay.
+        - adaptive: Whether the dispatcher reorders bindings by match counts, see RegexDispatcher.
+        """
+        self.default = default
+        if default is not None:
+            Ayumi.debug("Adding default Google redirection.", color=Ayumi.LCYAN)
+            self.regexes.append((compile(r'.*'), default))
+
+        if self.compiler is not None:
+            self.compiled, self.compiler = self.compiler.build(), None
+            self.triggers.backing, self.slashes.backing = self.compiled.triggers, self.compiled.slashes
+
+        # Completions for short prefixes are the most expensive, so build them now.
+        self.triggers.prepare()
+        self.slashes.prepare()
+
+        # Fold the regex bindings into a single-pass matcher now that the order is final.
+        self.dispatcher = RegexDispatcher(self.regexes, adaptive)
+
+        Ayumi.debug("Stats: Loaded triggers: {}".format(len(self.triggers)), color=Ayumi.MAGENTA)
+        Ayumi.debug("Stats: Loaded slashes: {}".format(len(self.slashes)), color=Ayumi.MAGENTA)
+        Ayumi.debug("Stats: Loaded regexes: {}".format(len(self.regexes)), color=Ayumi.MAGENTA)
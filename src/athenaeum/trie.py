@@ -0,0 +1,117 @@
+from itertools import chain
+from sys import intern
+from typing import Dict, Generic, Iterator, List, Optional, Tuple, TypeVar
+
+V = TypeVar('V')
+
+class _Node:
+
+    __slots__ = ('children', 'key', 'value', 'completions')
+
+    def __init__(self):
+        # Leaves are the majority of nodes, so children are only allocated when needed.
+        self.children: Optional[Dict[str, "_Node"]] = None
+        self.key: Optional[str] = None
+        self.value = None
+        # Memoized best completions below this node, as (key, value) pairs.
+        self.completions: Optional[List[Tuple[str, object]]] = None
+
+class Trie(Generic[V]):
+    """
+    A case-folded prefix trie of bindings, supporting exact lookups and prefix completion.
+
+    Keys are matched case-insensitively, while the key as first inserted is kept for display.
+    Exact lookups go through a flat index of folded keys, so dispatch stays a single hash lookup.
+    Completions are computed once per prefix node and memoized, as the trie does not change
+    after it is built.
+
+    A trie may be backed by a read-only table of other keys, such as compiled.MappedTable,
+    which is looked up for keys the trie does not hold. The two never hold the same key.
+    """
+
+    def __init__(self, limit: int = 10):
+        self._root: _Node = _Node()
+        self._index: Dict[str, _Node] = dict()
+        self.limit: int = limit
+        self.backing = None
+
+    def __setitem__(self, key: str, value: V):
+        folded = intern(key.casefold())
+        node = self._root
+        for char in folded:
+            if node.children is None:
+                node.children = dict()
+            child = node.children.get(char)
+            if child is None:
+                child = node.children[char] = _Node()
+            node = child
+        if node.key is None:
+            node.key = folded if key == folded else intern(key)
+        node.value = value
+        self._index[folded] = node
+
+    def __contains__(self, key: str) -> bool:
+        return key.casefold() in self._index or (self.backing is not None and key in self.backing)
+
+    def __len__(self) -> int:
+        return len(self._index) + (len(self.backing) if self.backing is not None else 0)
+
+    def get(self, key: Optional[str], default: Optional[V] = None) -> Optional[V]:
+        """
+        Return the value bound to the key, ignoring case.
+        """
+        if key is None:
+            return default
+        node = self._index.get(key.casefold())
+        if node is not None:
+            return node.value
+        if self.backing is not None:
+            return self.backing.get(key, default)
+        return default
+
+    def items(self) -> Iterator[Tuple[str, V]]:
+        own = ((node.key, node.value) for node in self._index.values())
+        return chain(own, self.backing.items()) if self.backing is not None else own
+
+    def complete(self, prefix: str) -> List[Tuple[str, V]]:
+        """
+        Return up to `limit` (key, value) pairs whose key starts with the prefix, ignoring case.
+        Shorter keys come first, then keys in alphabetical order.
+        """
+        completions = self._complete(prefix)
+        if self.backing is None:
+            return completions
+        completions = completions + self.backing.complete(prefix, self.limit)
+        completions.sort(key=lambda kv: (len(kv[0].casefold()), kv[0].casefold()))
+        return completions[:self.limit]
+
+    def _complete(self, prefix: str) -> List[Tuple[str, V]]:
+        node = self._root
+        for char in prefix.casefold():
+            node = node.children.get(char) if node.children else None
+            if node is None:
+                return list()
+        if node.completions is None:
+            node.completions = self._collect(node)
+        return node.completions
+
+    def prepare(self, depth: int = 2):
+        """
+        Memoize the completions of every prefix up to the given length, so that the
+        short prefixes, which have the largest subtrees, are answered from memory.
+        """
+        level = [self._root]
+        for _ in range(depth + 1):
+            for node in level:
+                if node.completions is None:
+                    node.completions = self._collect(node)
+            level = [child for n in level if n.children for child in n.children.values()]
+
+    def _collect(self, node: _Node) -> List[Tuple[str, V]]:
+        # Breadth first, so the shortest keys are found first and the walk can stop early.
+        found = list()
+        level = [node]
+        while level and len(found) < self.limit:
+            found.extend(sorted(((n.key, n.value) for n in level if n.key is not None), key=lambda kv: kv[0].casefold()))
+            level = [child for n in level if n.children for child in n.children.values()]
+        return found[:self.limit]
@@ -36,4 +36,25 @@ class Usagi12WithoutArgumentsCommand(Usagi12BaseCommand):
 
         Return: A url string that Usagi12 will redirect the user to.
         """
-        pass
\ No newline at end of file
+        pass
+
+class Usagi12AsyncCommand(Usagi12BaseCommand):
+
+    @abstractmethod
+    async def redirect(self, args: Tuple[str], language: Optional[Language]) -> str:
+        """
+        A Usagi12 command that gets arguments passed in with it, and awaits a lookup to
+        build its url, e.g. resolving a ticket ID or a short link through a backend.
+
+        Runs on the shared event loop rather than on the request thread, within the
+        command's time_budget. Look urls up with the pooled clients of src.athenaeum.backends,
+        never with blocking calls, which would hold up every other asynchronous command.
+        Override cacheable to return False if the backend's answers can change.
+
+        Params:
+        - args: As for Usagi12WithArgumentsCommand.redirect.
+        - language: As for Usagi12WithArgumentsCommand.redirect.
+
+        Return: A url string that Usagi12 will redirect the user to.
+        """
+        pass
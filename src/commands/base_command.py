@@ -55,3 +55,57 @@ class Usagi12BaseCommand(ABC):
         """
         pass
 
+    @property
+    def name(self) -> str:
+        """
+        Name of this command, as reported in metrics. Defaults to the class name.
+        """
+        return type(self).__name__
+
+    @property
+    def qualified_name(self) -> str:
+        """
+        Module and class name of this command, e.g. "commands.google.Google". Unlike name,
+        unique to the command, so its circuit breaker and guard metrics are keyed by it.
+        """
+        return "{}.{}".format(type(self).__module__, type(self).__qualname__)
+
+    @property
+    def cacheable(self) -> bool:
+        """
+        Indicate whether the redirect is a pure function of the command and language.
+        Override and return False if the returned url can change between calls with
+        the same input (e.g. it depends on the time or on an external service),
+        so Usagi12 does not serve it from its result cache.
+        """
+        return True
+
+    @property
+    def deterministic(self) -> Optional[bool]:
+        """
+        Indicate whether redirect returns the same url every time it is called without
+        arguments (only the trigger word), for a given language. Usagi12 lets browsers
+        cache those redirects, so users skip the round trip for e.g. "yt".
+        Defaults to None, leaving it to be inferred: commands that take no arguments
+        are deterministic if they are cacheable.
+        """
+        return None
+
+    @property
+    def time_budget(self) -> Optional[float]:
+        """
+        Seconds redirect may run before Usagi12 gives up on it and sends the user to the
+        default url instead. Defaults to None, which uses the COMMAND_TIME_BUDGET setting
+        for asynchronous commands, and runs synchronous ones inline unless the
+        GUARD_SYNC_COMMANDS setting is on. Return 0 to always run redirect inline on the
+        request thread, without a budget.
+        """
+        return None
+
+    @property
+    def default(self) -> Optional[str]:
+        """
+        Url to send users to while redirect is failing or running out of its time budget.
+        Defaults to None, which sends users to a Google search of their query.
+        """
+        return None
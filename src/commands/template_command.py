@@ -0,0 +1,109 @@
+import re
+
+from langcodes import Language
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+# Placeholder for the url-quoted arguments in a template url
+QUERY_PLACEHOLDER = "{query}"
+# Key in "urls" for the template used when no declared language matches
+ANY_LANGUAGE = "*"
+# Placeholder used by DuckDuckGo bang urls
+BANG_PLACEHOLDER = "{{{s}}}"
+
+class TemplateCommand:
+    """
+    A command declared as data rather than as a Python class.
+
+    Definitions are compiled once at load time: every url template is split around
+    its {query} placeholder, so a redirect is a dictionary lookup for the language
+    and a string join. Exposes the same attributes the registry reads from
+    Usagi12BaseCommand instances.
+
+    Definition fields (validated by loader.MODULE_VALIDATOR):
+    - args: Whether the command takes arguments. If False, `default` is always returned.
+    - description: Description of the command.
+    - default: Url returned when no arguments are given.
+    - triggers/slashes: A string or list of strings.
+    - urls: Language tag to url template, where {query} is replaced by the quoted arguments.
+            The "*" key is used for any language that is not listed.
+    """
+
+    __slots__ = ('name', 'description', 'triggers', 'slashes', 'languages', 'default', 'takes_args', '_templates', '_fallback')
+
+    bindings: Optional[Tuple[re.Pattern]] = None
+    cacheable: bool = True
+    # Reported in metrics instead of the command's name, as definition files and bang lists
+    # can hold thousands of commands, each of which would otherwise add its own series.
+    label: str = "TemplateCommand"
+
+    def __init__(self, name: str, definition: Dict[str, Any]):
+        self.name: str = name
+        self.description: str = definition['description']
+        self.triggers: Tuple[str] = _as_tuple(definition.get('triggers'))
+        self.slashes: Tuple[str] = _as_tuple(definition.get('slashes'))
+        self.default: str = definition['default']
+        self.takes_args: bool = definition['args']
+
+        urls: Dict[str, str] = definition.get('urls') or dict()
+        self._templates: Dict[str, Tuple[str]] = {str(Language.get(k)): _compile(v) for k, v in urls.items() if k != ANY_LANGUAGE}
+        self._fallback: Optional[Tuple[str]] = _compile(urls[ANY_LANGUAGE]) if ANY_LANGUAGE in urls else None
+        self.languages: Tuple[str] = tuple(self._templates)
+
+    def redirect(self, args: Tuple[str], language: Optional[Language]) -> str:
+        if not self.takes_args or len(args) < 2:
+            return self.default
+
+        template = self._templates.get(str(language), self._fallback) if language else self._fallback
+        if template is None:
+            return self.default
+        return quote(' '.join(args[1:])).join(template)
+
+    def definition(self) -> Dict[str, Any]:
+        """
+        Return a definition that compiles back into an equivalent command.
+        """
+        urls = {tag: QUERY_PLACEHOLDER.join(template) for tag, template in self._templates.items()}
+        if self._fallback is not None:
+            urls[ANY_LANGUAGE] = QUERY_PLACEHOLDER.join(self._fallback)
+        return {
+            'args': self.takes_args,
+            'description': self.description,
+            'default': self.default,
+            'triggers': list(self.triggers),
+            'slashes': list(self.slashes),
+            'urls': urls,
+        }
+
+def _as_tuple(value: Any) -> Tuple[str]:
+    if not value:
+        return tuple()
+    return (value,) if isinstance(value, str) else tuple(value)
+
+def _compile(template: str) -> Tuple[str]:
+    """
+    Split a template url around its placeholders, to be joined with the quoted query.
+    """
+    return tuple(template.split(QUERY_PLACEHOLDER))
+
+def bang_definitions(bangs: List[Dict[str, Any]]) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Convert DuckDuckGo-style bangs ({"t": trigger, "s": name, "d": domain, "u": url})
+    into (name, definition) pairs. Each bang is only bound to "!t": triggers are matched
+    before regex bindings, so bare words would take over existing commands and plain searches.
+    """
+    definitions = list()
+    for bang in bangs:
+        try:
+            trigger, url = bang['t'], bang['u']
+            domain = bang.get('d') or url.split('/')[2]
+        except (KeyError, TypeError, IndexError, AttributeError):
+            continue
+        definitions.append(("bang:{}".format(trigger), {
+            'args': True,
+            'description': bang.get('s') or domain,
+            'default': "https://{}/".format(domain),
+            'triggers': ["!" + trigger],
+            'urls': {ANY_LANGUAGE: url.replace(BANG_PLACEHOLDER, QUERY_PLACEHOLDER)},
+        }))
+    return definitions
@@ -0,0 +1,13 @@
+"""
+Runtime configuration for Usagi12.
+
+Values are read from settings.yaml in the working directory, and can be
+overridden with USAGI12_ prefixed environment variables, e.g. USAGI12_CACHE_SIZE=4096.
+"""
+
+from dynaconf import Dynaconf
+
+settings = Dynaconf(
+    envvar_prefix="USAGI12",
+    settings_files=["settings.yaml"],
+)
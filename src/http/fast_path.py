@@ -0,0 +1,27 @@
+"""
+Helper module for serving a hot path without Flask
+"""
+
+from typing import Callable
+
+from werkzeug.wrappers import Request, Response
+
+class FastPath:
+    """
+    WSGI middleware answering GET and HEAD requests for one path with a plain handler,
+    skipping Flask's routing, request context and response processing.
+    Every other request is passed on to the wrapped application.
+
+    The handler receives a Werkzeug Request, so it can be shared with a Flask view
+    that passes it flask.request.
+    """
+
+    def __init__(self, app: Callable, path: str, handler: Callable[[Request], Response]):
+        self._app = app
+        self._path = path
+        self._handler = handler
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO') != self._path or environ.get('REQUEST_METHOD') not in ('GET', 'HEAD'):
+            return self._app(environ, start_response)
+        return self._handler(Request(environ))(environ, start_response)
@@ -2,52 +2,93 @@
 Helper module for handling user locale
 """
 
-import re
-
-from ayumi import Ayumi
+from src import log
 
 from collections import deque
 from flask import request
 from langcodes import DEFAULT_LANGUAGE, Language
+from werkzeug.datastructures import LanguageAccept
+from werkzeug.http import parse_accept_header as parse_accept_header_values
+
+from src.athenaeum.cache import LRUCache, MISSING
+from src.athenaeum.query import ParsedQuery
+from src.config import settings
+from typing import Optional, Tuple
 
-from typing import Tuple
+# Parsed, quality-ordered Accept-Language headers keyed by the raw header string.
+ACCEPT_LANGUAGE_CACHE = LRUCache("accept_language", settings.get("ACCEPT_LANGUAGE_CACHE_SIZE", 128))
 
-LANGUAGE_FINDER = re.compile(r'.*(( -.+ )|( -.+$))', re.IGNORECASE)
+# Common tags parsed at startup so langcodes has its data loaded before the first request.
+WARM_UP_TAGS = ('en', 'en-US', 'en-GB', 'ja', 'ja-JP', 'jp', 'zh', 'zh-CN', 'zh-TW', 'ko', 'fr', 'de', 'es')
 
-def get_languages(req: request, command: str) -> Tuple[Tuple[Language], str]:
+def warm_up():
     """
-    Get the languages associated with this request, and return them as a Tuple.
-    Also returns the new command with language codes removed, if applicable.
+    Parse the common language tags once, so the first request of a worker
+    does not pay for langcodes loading its data.
     """
+    for tag in (DEFAULT_LANGUAGE,) + WARM_UP_TAGS:
+        Language.get(tag)
+    log.debug("Warmed up langcodes with {} tags.", len(WARM_UP_TAGS) + 1)
 
-    languages = deque()
+def parse_accept_languages(req: request) -> Tuple[Language]:
+    """
+    Return the languages from the browser's Accept-Language header as Language
+    objects, ordered by quality. Parsed headers are cached by their raw value.
+    """
+    return parse_accept_header(req.headers.get('Accept-Language', ''))
 
-    # If user has set a language override, set that as the primary language.
-    try:
-        override_lang = req.args['language']
-        languages.appendleft(Language.get(override_lang))
-        Ayumi.debug("Detected user language override in params: {}".format(override_lang))
-    except:
-        Ayumi.debug("Did not detect user language override from request parameters")
-
-    # Fetch the languages the user's browser provided as part of the accept and convert them to Language objects
-    languages.extend(Language.get(l) for l in sorted(
-                            req.accept_languages.values(),
-                            key=lambda v: req.accept_languages.quality(v),
+def parse_accept_header(header: str) -> Tuple[Language]:
+    """
+    Return the languages of a raw Accept-Language header as Language objects,
+    ordered by quality, for use without a request. Cached by the raw value.
+    """
+    languages = ACCEPT_LANGUAGE_CACHE.get(header)
+    if languages is MISSING:
+        accept = parse_accept_header_values(header, LanguageAccept)
+        languages = tuple(Language.get(l) for l in sorted(
+                            accept.values(),
+                            key=lambda v: accept.quality(v),
                             reverse=True))
-    Ayumi.debug("Detected browser language: {}".format(req.accept_languages.to_header()))
-
-    if match := LANGUAGE_FINDER.search(command):
-        override_lang = match.groups()[0].strip()[1:]
-        languages.appendleft(Language.get(override_lang))
-        Ayumi.debug("Detected user language override: {}".format(override_lang))
-        command = command.replace(match.groups()[0], " ").strip()
-        Ayumi.debug("Removed language codes, new command: \"{}\"".format(command))
-    else:
-        Ayumi.debug("No user command language overrides detected.")
+        ACCEPT_LANGUAGE_CACHE.put(header, languages)
+    return languages
 
-    Ayumi.debug("Returning language priority list: {}".format(languages))
-    return tuple(languages), command
+def get_languages(req: request, query: ParsedQuery) -> Tuple[Language]:
+    """
+    Get the languages associated with this request, and return them as a Tuple.
+    """
+
+    log.debug("Detected browser language: {}", req.headers.get('Accept-Language', ''))
+    return resolve_languages(query, parse_accept_languages(req), req.args.get('language'))
+
+def resolve_languages(query: ParsedQuery, accept: Tuple[Language] = tuple(), override: Optional[str] = None) -> Tuple[Language]:
+    """
+    Build the language priority list for a query without needing a Flask request.
+
+    Params:
+    - query: The parsed user query, which may contain a " -xx" language override.
+    - accept: Languages accepted by the user, in order of preference.
+    - override: An explicit language override, as given by the ?language= parameter.
+    """
 
+    languages = deque(accept)
 
+    # If user has set a language override, set that as the primary language.
+    if override:
+        try:
+            languages.appendleft(Language.get(override))
+            log.debug("Detected user language override in params: {}", override)
+        except:
+            log.debug("Ignoring invalid language override in params: {}", override)
+    else:
+        log.debug("Did not detect user language override from request parameters")
+
+    # The tokenizer has already taken the override out of the command.
+    if query.language:
+        languages.appendleft(query.language)
+        log.debug("Detected user language override: {}", query.language)
+        log.debug("Removed language codes, new command: \"{}\"", query.command)
+    else:
+        log.debug("No user command language overrides detected.")
 
+    log.debug("Returning language priority list: {}", languages)
+    return tuple(languages)
@@ -0,0 +1,54 @@
+"""
+Helper module for building /bunny redirects that browsers may cache
+"""
+
+from flask import Response, redirect, request
+from hashlib import sha1
+
+from src.athenaeum.cache import LRUCache, MISSING
+from src.config import settings
+
+# How long, in seconds, browsers may reuse a deterministic redirect before revalidating it.
+# Kept short, as a browser only sees a reload or a changed shortcut once it revalidates.
+REDIRECT_MAX_AGE: int = settings.get("REDIRECT_MAX_AGE", 300)
+# Request header identifying a user's shortcut overlay, see usagi12.user_token.
+TOKEN_HEADER = "X-Usagi12-Token"
+CACHE_CONTROL = "private, max-age={}".format(REDIRECT_MAX_AGE)
+
+# Prebuilt responses of the most used deterministic redirects, keyed by (url, localised).
+RESPONSE_CACHE = LRUCache("redirect_responses", settings.get("REDIRECT_RESPONSE_CACHE_SIZE", 256))
+
+def _etag(url: str) -> str:
+    return sha1(url.encode('utf-8')).hexdigest()[:20]
+
+def _caching_headers(response: Response, etag: str, localised: bool) -> Response:
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    response.set_etag(etag)
+    # A browser that starts sending a token may have shortcuts that override this redirect.
+    response.headers['Vary'] = "Accept-Language, {}".format(TOKEN_HEADER) if localised else TOKEN_HEADER
+    return response
+
+def cacheable_redirect(req: request, url: str, localised: bool) -> Response:
+    """
+    Return a redirect browsers may cache, for a url that does not depend on the query text.
+    Answers 304 when the browser revalidates a redirect that still points to the same url.
+    Only for requests no shortcut overlay could apply to, see usagi12.handle_bunny.
+
+    Params:
+    - req: The current request, for its If-None-Match header.
+    - url: The url to redirect to.
+    - localised: Whether the url depends on the Accept-Language header.
+
+    The responses are shared between requests, so they must not be modified after this.
+    """
+    key = (url, localised)
+    cached = RESPONSE_CACHE.get(key)
+    if cached is MISSING:
+        etag = _etag(url)
+        cached = (etag,
+                  _caching_headers(redirect(url), etag, localised),
+                  _caching_headers(Response(status=304), etag, localised))
+        RESPONSE_CACHE.put(key, cached)
+
+    etag, response, not_modified = cached
+    return not_modified if etag in req.if_none_match else response
@@ -0,0 +1,157 @@
+"""
+Level-gated logging for the request path.
+
+Messages are passed as a format string and arguments, and are only formatted
+(and handed to Ayumi) when their level is enabled. Arguments that are costly
+to build can be wrapped in Lazy so they are only computed when needed.
+
+Access log lines go through a queue to a background listener, so request
+threads never wait on log I/O, and can be sampled with ACCESS_LOG_SAMPLE_RATE.
+"""
+
+import logging
+import sys
+
+from ayumi import Ayumi
+
+from logging.handlers import QueueHandler, QueueListener
+from os import getpid
+from queue import Full, Queue
+from random import random
+from threading import Lock
+from typing import Any, Callable, Optional
+
+from src.config import settings
+
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+ERROR = logging.ERROR
+
+def _log_level(setting: Any) -> int:
+    """
+    Return the level of the LOG_LEVEL setting, given by name or number. Unknown
+    names fall back to INFO, as every level check compares against an int.
+    """
+    if isinstance(setting, int):
+        return setting
+    level = logging.getLevelName(str(setting).upper())
+    if isinstance(level, int):
+        return level
+    Ayumi.warning("Unknown LOG_LEVEL {!r}, logging at INFO.".format(setting), color=Ayumi.LYELLOW)
+    return INFO
+
+LOG_LEVEL: int = _log_level(settings.get("LOG_LEVEL", "INFO"))
+ACCESS_LOG_SAMPLE_RATE: float = float(settings.get("ACCESS_LOG_SAMPLE_RATE", 1.0))
+ACCESS_LOG_QUEUE_SIZE: int = settings.get("ACCESS_LOG_QUEUE_SIZE", 10000)
+
+class Lazy:
+    """
+    Defers building a log argument until the message is actually formatted.
+    """
+
+    __slots__ = ('_fn',)
+
+    def __init__(self, fn: Callable[[], Any]):
+        self._fn = fn
+
+    def __format__(self, spec: str) -> str:
+        return format(self._fn(), spec)
+
+    def __str__(self) -> str:
+        return str(self._fn())
+
+def enabled(level: int) -> bool:
+    return level >= LOG_LEVEL
+
+def debug(message: str, *args: Any, color: Optional[str] = None):
+    if DEBUG >= LOG_LEVEL:
+        _emit(Ayumi.debug, message, args, color)
+
+def info(message: str, *args: Any, color: Optional[str] = None):
+    if INFO >= LOG_LEVEL:
+        _emit(Ayumi.info, message, args, color)
+
+def warning(message: str, *args: Any, color: Optional[str] = None):
+    if WARNING >= LOG_LEVEL:
+        _emit(Ayumi.warning, message, args, color)
+
+def error(message: str, *args: Any, color: Optional[str] = None):
+    if ERROR >= LOG_LEVEL:
+        _emit(Ayumi.error, message, args, color)
+
+def _emit(log: Callable, message: str, args: tuple, color: Optional[str]):
+    message = message.format(*args) if args else message
+    if color is None:
+        log(message)
+    else:
+        log(message, color=color)
+
+class _DroppingQueueHandler(QueueHandler):
+    """
+    Queue handler that drops records instead of blocking when the queue is full.
+    """
+
+    dropped: int = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Leave formatting to the listener thread.
+        return record
+
+class _BraceMessage:
+    """
+    A str.format style message, formatted whenever the record is written out.
+    """
+
+    __slots__ = ('_message', '_args')
+
+    def __init__(self, message: str, args: tuple):
+        self._message = message
+        self._args = args
+
+    def __str__(self) -> str:
+        return self._message.format(*self._args)
+
+ACCESS_LOGGER = logging.getLogger("usagi12.access")
+ACCESS_LOGGER.propagate = False
+ACCESS_LOGGER.setLevel(logging.INFO)
+
+_access_lock = Lock()
+_access_pid: Optional[int] = None
+_access_listener: Optional[QueueListener] = None
+
+def _start_access_listener():
+    """
+    Start the background writer for the access log. Done once per process, as
+    listener threads do not survive a fork into gunicorn workers.
+    """
+    global _access_pid, _access_listener
+    with _access_lock:
+        if _access_pid == getpid():
+            return
+        queue = Queue(ACCESS_LOG_QUEUE_SIZE)
+        stream = logging.StreamHandler(sys.stdout)
+        stream.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        for handler in list(ACCESS_LOGGER.handlers):
+            ACCESS_LOGGER.removeHandler(handler)
+        ACCESS_LOGGER.addHandler(_DroppingQueueHandler(queue))
+        _access_listener = QueueListener(queue, stream)
+        _access_listener.start()
+        _access_pid = getpid()
+
+def access(message: str, *args: Any):
+    """
+    Log a per-request access line, subject to ACCESS_LOG_SAMPLE_RATE.
+    Formatting and writing happen off the request thread.
+    """
+    if INFO < LOG_LEVEL or (ACCESS_LOG_SAMPLE_RATE < 1.0 and random() >= ACCESS_LOG_SAMPLE_RATE):
+        return
+    if _access_pid != getpid():
+        _start_access_listener()
+    ACCESS_LOGGER.info(_BraceMessage(message, args))
@@ -0,0 +1,82 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture(scope="session")
+def registry_dir(tmp_path_factory):
+    """
+    A scratch working directory holding the bundled commands, with the examples under
+    commands/ex, so the manifest and other files the loader writes stay out of the tree.
+    """
+    work = tmp_path_factory.mktemp("registry")
+    skip = shutil.ignore_patterns("__pycache__")
+    shutil.copytree(os.path.join(ROOT, "commands"), str(work / "commands"), ignore=skip)
+    shutil.copytree(os.path.join(ROOT, "example"), str(work / "commands" / "ex"), ignore=skip)
+    for directory, _, files in os.walk(str(work / "commands" / "ex")):
+        if "__init__.py" not in files:
+            open(os.path.join(directory, "__init__.py"), 'w').close()
+    return work
+
+@pytest.fixture(scope="session")
+def loader(registry_dir):
+    """
+    The loader module, with the registry loaded from registry_dir.
+    Modules importing the loader must only be imported through this fixture.
+    """
+    previous = os.getcwd()
+    os.chdir(str(registry_dir))
+    sys.path.insert(0, str(registry_dir))
+    try:
+        from src.athenaeum import loader
+    finally:
+        os.chdir(previous)
+    return loader
+
+@pytest.fixture
+def app(loader, registry_dir, monkeypatch):
+    """
+    A test client of the Flask app, serving the registry loaded from registry_dir.
+    """
+    monkeypatch.chdir(registry_dir)
+    import usagi12
+    return usagi12.app.test_client()
+
+@pytest.fixture
+def overlays(tmp_path, monkeypatch):
+    """
+    The overlay module, storing shortcuts in a fresh database.
+    """
+    from src.athenaeum import overlay
+    monkeypatch.setattr(overlay, "OVERLAY_DB", str(tmp_path / "overlays.sqlite3"))
+    monkeypatch.setattr(overlay, "_schema_ready", False)
+    monkeypatch.setattr(overlay, "_file_signature", None)
+    overlay.OVERLAYS.clear()
+    yield overlay
+    overlay.OVERLAYS.clear()
+
+@pytest.fixture
+def scratch(loader, registry_dir, monkeypatch):
+    """
+    An empty command package under registry_dir/commands, for tests to add, change and
+    remove command files in. It is removed, and the registry reloaded without it, afterwards.
+    """
+    monkeypatch.chdir(registry_dir)
+    package = registry_dir / "commands" / "scratch"
+    package.mkdir()
+    (package / "__init__.py").touch()
+    yield package
+    shutil.rmtree(str(package))
+    loader.reload()
+
+@pytest.fixture
+def errors(loader, monkeypatch):
+    """
+    The messages of errors logged by the loader.
+    """
+    logged = list()
+    monkeypatch.setattr(loader.Ayumi, "error", staticmethod(lambda message, *args, **kwargs: logged.append(message)))
+    return logged
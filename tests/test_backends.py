@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from src.athenaeum.backends import BackendError, Coalescer, HttpBackend
+
+def test_identical_calls_are_coalesced():
+    calls = list()
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def main():
+        coalescer = Coalescer()
+        results = await asyncio.gather(*(coalescer.run("key", call) for _ in range(5)))
+        return results, len(coalescer)
+
+    assert asyncio.run(main()) == (["result"] * 5, 0)
+    assert len(calls) == 1
+
+def test_call_is_cancelled_once_every_caller_gives_up():
+    async def main():
+        coalescer, stopped = Coalescer(), asyncio.Event()
+
+        async def call():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                stopped.set()
+                raise
+
+        patient = asyncio.ensure_future(coalescer.run("key", call))
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(coalescer.run("key", call), 0.01)
+        await asyncio.sleep(0.01)
+        # One caller is still waiting, so the call keeps running.
+        assert not stopped.is_set() and len(coalescer) == 1
+
+        patient.cancel()
+        await asyncio.wait_for(stopped.wait(), 1)
+        return len(coalescer)
+
+    assert asyncio.run(main()) == 0
+
+@pytest.mark.parametrize("response", [
+    b"HTTP/1.1 200 OK\r\nContent-Length: 100\r\n\r\n" + b"x" * 100,
+    b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n40\r\n" + b"x" * 64 + b"\r\n0\r\n\r\n",
+    b"HTTP/1.0 200 OK\r\n\r\n" + b"x" * 100,
+])
+def test_large_bodies_are_refused(response):
+    async def main():
+        async def serve(reader, writer):
+            await reader.readuntil(b"\r\n\r\n")
+            writer.write(response)
+            await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_server(serve, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        backend = HttpBackend("http://127.0.0.1:{}".format(port), max_body_size=32, timeout=1)
+        small = HttpBackend("http://127.0.0.1:{}".format(port), max_body_size=1000, timeout=1)
+        try:
+            with pytest.raises(BackendError):
+                await backend.get("big")
+            return (await small.get("big")).body
+        finally:
+            server.close()
+
+    assert asyncio.run(main()).strip(b"x") == b""
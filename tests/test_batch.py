@@ -0,0 +1,93 @@
+import io
+import json
+
+import pytest
+
+QUERIES = [
+    "g first",
+    "",
+    '{"query": "yt cats", "language": "ja"}',
+    '{"query": "g x", "accept_language": 5}',
+    '{"query": "g y", "language": ["en"], "accept_language": "ja"}',
+    "{not json",
+    "j neko",
+    "g last",
+]
+
+@pytest.fixture
+def batch(loader, registry_dir, monkeypatch):
+    monkeypatch.chdir(registry_dir)
+    from src.athenaeum import batch
+    return batch
+
+def _run(batch, workers, chunk_size):
+    out = io.StringIO()
+    count = batch.run(io.StringIO("".join(q + "\n" for q in QUERIES)), out, workers, chunk_size, accept_language="en-US")
+    return count, [json.loads(line) for line in out.getvalue().splitlines()]
+
+@pytest.mark.parametrize("workers, chunk_size", [(1, 1000), (1, 3), (2, 2)])
+def test_output_is_in_input_order(batch, workers, chunk_size):
+    count, results = _run(batch, workers, chunk_size)
+
+    assert count == len(QUERIES)
+    assert [r['line'] for r in results] == list(range(1, len(QUERIES) + 1))
+    assert [r['query'] for r in results] == ["g first", "", "yt cats", "g x", "g y", "{not json", "j neko", "g last"]
+    urls = [r['url'] for r in results]
+    assert urls[0] == "https://www.google.com/search?q=first"
+    assert urls[1] is None
+    assert urls[2] == "https://youtube.com/results?search_query=cats"
+    # Hints that are not strings are ignored rather than failing the chunk.
+    assert urls[3] == "https://www.google.com/search?q=x"
+    assert urls[4] == "https://www.google.co.jp/search?q=y"
+    assert urls[7] == "https://www.google.com/search?q=last"
+
+def test_line_errors_only_lose_their_own_url(batch, monkeypatch):
+    from src.athenaeum import primoroot
+    search_many = primoroot.search_many
+
+    def failing(queries):
+        queries = list(queries)
+        if any(q.command == "g boom" for q, _ in queries):
+            raise RuntimeError("boom")
+        return search_many(queries)
+
+    monkeypatch.setattr(primoroot, "search_many", failing)
+    output = batch.resolve_chunk((10, ["g ok", "g boom", "g fine"]))
+    urls = [json.loads(line)['url'] for line in output.splitlines()]
+
+    assert urls == ["https://www.google.com/search?q=ok", None, "https://www.google.com/search?q=fine"]
+
+def test_endpoint_answers_in_request_order(app):
+    import usagi12
+    body = ["g first", "", {'query': "g zweite", 'language': "ja"}, {'query': "yt cats"}, "   ", "w neko", "g last"]
+
+    response = app.post("/bunny/batch", json=body, headers={'Accept-Language': "en-US"})
+    assert response.status_code == 200
+    assert response.get_json() == {'urls': [
+        "https://www.google.com/search?q=first",
+        usagi12.FALLBACK_URL,
+        "https://www.google.co.jp/search?q=zweite",
+        "https://youtube.com/results?search_query=cats",
+        usagi12.FALLBACK_URL,
+        "https://en.wikipedia.org/w/index.php?search=neko",
+        "https://www.google.com/search?q=last",
+    ]}
+
+@pytest.mark.parametrize("data", [
+    "{not json",
+    '{"query": "g cats"}',
+    '"g cats"',
+    '["g cats", 5]',
+    '[{"language": "en"}]',
+    '[{"query": "g cats", "language": ["en"]}]',
+])
+def test_endpoint_refuses_malformed_bodies(app, data):
+    response = app.post("/bunny/batch", data=data, content_type="application/json")
+    assert response.status_code == 400
+
+def test_endpoint_limits_the_batch_size(app, monkeypatch):
+    import usagi12
+    monkeypatch.setattr(usagi12, "BATCH_MAX_QUERIES", 3)
+
+    assert app.post("/bunny/batch", json=["g a", "g b", "g c"]).status_code == 200
+    assert app.post("/bunny/batch", json=["g a", "g b", "g c", "g d"]).status_code == 413
@@ -0,0 +1,16 @@
+from src.athenaeum.cache import MISSING, LRUCache
+
+def test_uncached_timings_start_from_an_empty_cache(loader):
+    from benchmarks.micro import _without_cache
+    cache = LRUCache("tests.benchmarks", 3)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+
+    with _without_cache(cache):
+        assert cache.get("a") is MISSING
+        cache.put("c", 3)
+        assert len(cache) == 0
+
+    assert cache.maxsize == 3
+    assert cache.entries() == [("b", 2), ("a", 1)]
@@ -0,0 +1,77 @@
+from langcodes import Language
+
+from src.athenaeum.compiled import CompiledRegistry, RegistryCompiler, open_compiled
+from src.athenaeum.registry import Registry
+from src.commands.template_command import TemplateCommand
+
+DEFINITIONS = {
+    'google': {'args': True, 'description': "Google", 'default': "https://google/", 'triggers': ["g", "Google"],
+               'slashes': "g/", 'urls': {'*': "https://google/?q={query}", 'ja': "https://google.jp/?q={query}"}},
+    'github': {'args': True, 'description': "GitHub", 'default': "https://github/", 'triggers': ["GitHub", "gh"],
+               'urls': {'*': "https://github/search?q={query}"}},
+    # Loses "g" to google, which was added first, but keeps its other trigger.
+    'gitlab': {'args': True, 'description': "GitLab", 'default': "https://gitlab/", 'triggers': ["G", "gl", "Straße"]},
+    'home': {'args': False, 'description': "Home", 'default': "https://home/", 'triggers': "home"},
+}
+
+def _registry(**tables) -> Registry:
+    registry = Registry(**tables)
+    if registry.compiler is not None:
+        registry.compiler.begin("commands/test.json", (1, 2), "digest", True)
+    for name, definition in DEFINITIONS.items():
+        registry.add_command(TemplateCommand(name, definition))
+    registry.finalise(None)
+    return registry
+
+def _lookups(registry: Registry):
+    triggers, slashes = registry.triggers, registry.slashes
+    return {
+        'len': (len(triggers), len(slashes)),
+        'items': sorted((key, item.name) for key, item in triggers.items()),
+        'get': [(key, getattr(triggers.get(key), 'name', None)) for key in ("g", "G", "GOOGLE", "gh", "gl", "STRASSE", "nope")],
+        'slashes': [(key, getattr(slashes.get(key), 'name', None)) for key in ("g", "G", "g/")],
+        'complete': [[(key, item.name) for key, item in triggers.complete(prefix)] for prefix in ("g", "GI", "s", "x")],
+        'redirects': [
+            triggers.get("g").redirect(None, ("g", "cats and dogs")),
+            triggers.get("g").redirect(Language.get("ja"), ("g", "cats")),
+            triggers.get("gh").redirect(None, ("gh",)),
+            triggers.get("gl").redirect(None, ("gl", "cats")),
+            triggers.get("home").redirect(None, ("home", "cats")),
+        ],
+    }
+
+def test_round_trip_through_a_file(tmp_path):
+    path = str(tmp_path / "registry.compiled")
+    expected = _lookups(_registry())
+
+    compiled = _registry(compiler=RegistryCompiler(path))
+    assert compiled.compiled.path == path
+    # Template commands are only held in the mapped tables.
+    assert compiled.triggers.backing is compiled.compiled.triggers
+    assert _lookups(compiled) == expected
+
+    reopened = open_compiled(path)
+    assert len(reopened) == len(DEFINITIONS)
+    assert reopened.matches([("commands/test.json", "digest")])
+    assert not reopened.matches([("commands/test.json", "changed")])
+    assert _lookups(Registry(compiled=reopened)) == expected
+
+def test_commands_compile_back_into_the_same_definitions(tmp_path):
+    _registry(compiler=RegistryCompiler(str(tmp_path / "registry.compiled")))
+    commands = open_compiled(str(tmp_path / "registry.compiled")).commands("commands/test.json")
+
+    assert [c.name for c in commands] == list(DEFINITIONS)
+    assert [c.definition() for c in commands] == [TemplateCommand(n, d).definition() for n, d in DEFINITIONS.items()]
+
+def test_kept_in_memory_when_it_cannot_be_written(tmp_path):
+    registry = _registry(compiler=RegistryCompiler(str(tmp_path / "missing" / "registry.compiled")))
+
+    assert isinstance(registry.compiled, CompiledRegistry)
+    assert registry.compiled.path is None
+    assert _lookups(registry) == _lookups(_registry())
+
+def test_unreadable_files_are_ignored(tmp_path):
+    path = tmp_path / "registry.compiled"
+    assert open_compiled(str(path)) is None
+    path.write_bytes(b"not a compiled registry")
+    assert open_compiled(str(path)) is None
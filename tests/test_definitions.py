@@ -0,0 +1,96 @@
+import json
+
+import pytest
+
+from langcodes import Language
+
+from src.athenaeum.query import parse_query
+from src.commands.template_command import bang_definitions
+
+BANGS = [
+    {'t': "jw", 's': "JW.org", 'd': "www.jw.org", 'u': "https://www.jw.org/search?q={{{s}}}"},
+    {'t': "r", 's': "Rotten Tomatoes", 'u': "https://www.rottentomatoes.com/search?search={{{s}}}"},
+    {'t': "a", 's': "Amazon", 'd': "www.amazon.com", 'u': "https://www.amazon.com/s?k={{{s}}}"},
+    {'t': "weather", 'd': "weather.com", 'u': "https://weather.com/search?q={{{s}}}"},
+    {'t': "w", 's': "Wiktionary", 'd': "en.wiktionary.org", 'u': "https://en.wiktionary.org/wiki/{{{s}}}"},
+    # Malformed entries are skipped.
+    {'s': "No trigger", 'u': "https://nowhere/"},
+    "not a bang",
+]
+
+def _search(text):
+    from src.athenaeum import primoroot
+    return primoroot.search(parse_query(text), (Language.get("en"),))
+
+def test_bangs_are_bound_with_their_prefix_only():
+    definitions = dict(bang_definitions(BANGS))
+
+    assert list(definitions) == ["bang:jw", "bang:r", "bang:a", "bang:weather", "bang:w"]
+    assert definitions["bang:jw"] == {
+        'args': True,
+        'description': "JW.org",
+        'default': "https://www.jw.org/",
+        'triggers': ["!jw"],
+        'urls': {'*': "https://www.jw.org/search?q={query}"},
+    }
+    # The domain and description fall back to the url.
+    assert definitions["bang:r"]['default'] == "https://www.rottentomatoes.com/"
+    assert definitions["bang:weather"]['description'] == "weather.com"
+
+def test_bangs_do_not_shadow_existing_commands(loader, scratch, monkeypatch):
+    queries = ["jw neko", "r python", "a tale of two cities", "weather tokyo", "w cats", "yt cats"]
+    before = [_search(q) for q in queries]
+
+    bangs = scratch / "bangs.json"
+    bangs.write_text(json.dumps(BANGS))
+    monkeypatch.setattr(loader, "BANGS_FILE", str(bangs))
+    assert loader.reload()
+
+    assert [_search(q) for q in queries] == before
+    assert _search("!jw neko") == "https://www.jw.org/search?q=neko"
+    assert _search("!A tale") == "https://www.amazon.com/s?k=tale"
+    assert _search("!w") == "https://en.wiktionary.org/"
+
+VALID = """
+- args: true
+  description: Searches
+  default: https://search/
+  triggers: [sx, search-x]
+  urls:
+    ja: https://search.jp/?q={query}
+    "*": https://search/?q={query}
+- args: false
+  description: Home
+  default: https://home/
+  slashes: hx/
+"""
+
+def test_definitions_are_compiled(loader, scratch, errors):
+    (scratch / "search.yaml").write_text(VALID)
+    (scratch / "single.yml").write_text("{args: false, description: One, default: 'https://one/', triggers: onex}")
+    assert loader.reload()
+
+    assert [c.name for c in loader.COMMAND_FILES["commands/scratch/search.yaml"].commands] == ["search:sx", "search:hx/"]
+    assert _search("SX cats") == "https://search/?q=cats"
+    assert _search("hx/ cats") == "https://home/"
+    assert _search("onex") == "https://one/"
+    assert errors == []
+
+@pytest.mark.parametrize("definition", [
+    # Missing the default url.
+    "{args: true, description: Broken, triggers: brokenx}",
+    "{args: yes please, description: Broken, default: 'https://broken/', triggers: brokenx}",
+    "{args: true, description: Broken, default: 'https://broken/', triggers: [brokenx, 5]}",
+    "{args: true, description: Broken, default: 'https://broken/', triggers: brokenx, colour: red}",
+    "[{args: true, description: Fine, default: 'https://fine/', triggers: finex}, just a string]",
+    "{args: true, description: Broken, default: 'https://broken/', triggers: brokenx",
+])
+def test_invalid_definitions_are_rejected(loader, scratch, errors, definition):
+    (scratch / "broken.yaml").write_text(definition)
+    assert loader.reload()
+
+    assert loader.COMMAND_FILES["commands/scratch/broken.yaml"].commands == []
+    assert len(errors) == 1 and "commands/scratch/broken.yaml" in errors[0]
+    # Any invalid definition fails the whole file.
+    assert _search("brokenx cats") == "https://www.google.com/search?q=brokenx%20cats"
+    assert _search("finex cats") == "https://www.google.com/search?q=finex%20cats"
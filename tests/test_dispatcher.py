@@ -0,0 +1,68 @@
+import re
+
+import pytest
+
+from src.athenaeum import dispatcher
+from src.athenaeum.dispatcher import RegexDispatcher
+
+def _bindings(*patterns):
+    return [(re.compile(p), "binding{}".format(i)) for i, p in enumerate(patterns)]
+
+def _first_claim(bindings, command):
+    return next((item for pattern, item in bindings if pattern.match(command)), None)
+
+@pytest.mark.parametrize("patterns", [
+    (r'a\w*', r'ab', r'abc', r'\d+', r'.*'),
+    # Named groups and back references split the combined runs.
+    (r'ab', r'a\w{2}', r'(?P<word>a\w+)', r'a(b)\1', r'abc', r'b', r'(?i)A', r'[a-z]+', r'\w'),
+    (r'(?s)a.c', r'(?i:AB)c', r'ab$', r'a'),
+])
+def test_first_declared_binding_wins(patterns):
+    bindings = _bindings(*patterns)
+    dispatch = RegexDispatcher(bindings, adaptive=False)
+
+    assert len(dispatch._matchers) < len(bindings)
+    for command in ("a", "ab", "abb", "abc", "ABC", "a\nc", "42", "zz", "", "Abc"):
+        assert dispatch.match(command) == _first_claim(bindings, command), command
+
+def test_global_inline_flags_stay_standalone():
+    dispatch = RegexDispatcher(_bindings(r'(?i)abc', r'XYZ', r'q'), adaptive=False)
+
+    assert dispatch.match("ABC") == "binding0"
+    assert dispatch.match("XYZ") == "binding1"
+    # The (?i) of the first binding must not leak into the others.
+    assert dispatch.match("xyz") is None
+    assert [index for _, index in dispatch._matchers] == [0, None]
+
+@pytest.fixture
+def adaptive(tmp_path, monkeypatch):
+    monkeypatch.setattr(dispatcher, "ORDER_PATH", str(tmp_path / "regex.order.json"))
+    monkeypatch.setattr(dispatcher, "REORDER_INTERVAL", 10)
+
+def test_reorder_keeps_first_claim(adaptive):
+    dispatch = RegexDispatcher(_bindings(r'(a?)b', r'a\w*', r'z'), adaptive=True)
+    for _ in range(10):
+        dispatch.match("aa")
+        dispatch.match("z")
+
+    # "z" moves to the front, but "a\w*" cannot pass "(a?)b", which claims "ab" first.
+    assert dispatch.order == (2, 0, 1)
+    assert dispatch.match("ab") == "binding0"
+    assert dispatch.match("aa") == "binding1"
+
+def test_reorder_moves_disjoint_bindings(adaptive):
+    dispatch = RegexDispatcher(_bindings(r'yt', r'gh', r'\d+'), adaptive=True)
+    for _ in range(10):
+        dispatch.match("42")
+
+    assert dispatch.order[0] == 2
+    assert dispatch.match("42") == "binding2"
+    assert dispatch.match("yt") == "binding0"
+
+def test_too_many_bindings_keep_declared_order(adaptive, monkeypatch):
+    monkeypatch.setattr(dispatcher, "REORDER_MAX_BINDINGS", 2)
+    dispatch = RegexDispatcher(_bindings(r'yt', r'gh', r'\d+'), adaptive=True)
+    for _ in range(10):
+        dispatch.match("42")
+
+    assert dispatch.order == (0, 1, 2)
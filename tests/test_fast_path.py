@@ -0,0 +1,60 @@
+import pytest
+
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+from src.http.fast_path import FastPath
+
+REQUESTS = [
+    ({'query': "g cats"}, {}),
+    ({'query': "yt"}, {}),
+    ({'query': "w neko"}, {'Accept-Language': "ja"}),
+    ({'query': "w"}, {'Accept-Language': "ja, en;q=0.5"}),
+    ({'query': "jisho"}, {}),
+    ({'query': "no such command"}, {}),
+    ({'query': ""}, {}),
+    ({}, {}),
+    ({'query': "yt", 'token': "alice"}, {}),
+]
+
+@pytest.fixture
+def fast(app):
+    """
+    A client of the app behind the fast path, and the requests the fast path answered.
+    """
+    import usagi12
+    handled = list()
+    def handler(request):
+        handled.append(request.path)
+        return usagi12.handle_bunny(request)
+    return Client(FastPath(usagi12.app.wsgi_app, "/bunny", handler), Response), handled
+
+def _summary(response):
+    return response.status_code, response.headers.get('Location'), response.headers.get('Cache-Control'), response.headers.get('Vary')
+
+@pytest.mark.parametrize("args, headers", REQUESTS)
+def test_fast_path_matches_the_flask_route(app, fast, args, headers):
+    client, handled = fast
+
+    assert _summary(client.get("/bunny", query_string=args, headers=headers)) == \
+        _summary(app.get("/bunny", query_string=args, headers=headers))
+    assert _summary(client.head("/bunny", query_string=args, headers=headers)) == \
+        _summary(app.head("/bunny", query_string=args, headers=headers))
+    assert handled == ["/bunny", "/bunny"]
+
+@pytest.mark.parametrize("method, path", [
+    ("POST", "/bunny"),
+    ("PUT", "/bunny"),
+    ("GET", "/bunny/"),
+    ("GET", "/suggest"),
+    ("POST", "/bunny/batch"),
+])
+def test_other_requests_are_passed_to_flask(app, fast, method, path):
+    client, handled = fast
+    options = {'query_string': {'q': "y", 'query': "g cats"}, 'json': ["g cats"]} if method == "POST" else \
+        {'query_string': {'q': "y", 'query': "g cats"}}
+
+    response = client.open(path, method=method, **options)
+    expected = app.open(path, method=method, **options)
+    assert (response.status_code, response.get_data()) == (expected.status_code, expected.get_data())
+    assert handled == []
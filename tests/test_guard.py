@@ -0,0 +1,121 @@
+import time
+
+import pytest
+
+from src.athenaeum import guard
+from src.athenaeum.guard import CLOSED, OPEN, CommandGuard, CommandSkipped, guard_for
+from src.athenaeum.lookup_item import LookupItem
+from src.athenaeum.manifest import LazyCommand
+
+def _slow(seconds):
+    def redirect():
+        time.sleep(seconds)
+        return "https://slow/"
+    return redirect
+
+@pytest.fixture
+def breakers(monkeypatch):
+    monkeypatch.setattr(guard, "BREAKER_FAILURES", 2)
+    monkeypatch.setattr(guard, "BREAKER_COOLDOWN", 0.1)
+
+def test_timeout_skips_to_default():
+    command = CommandGuard("tests.Timeout", 0.05, "https://default/")
+
+    with pytest.raises(CommandSkipped) as skipped:
+        command.call(_slow(0.5))
+    assert (skipped.value.reason, skipped.value.default) == ("timeout", "https://default/")
+    assert command.call(_slow(0)) == "https://slow/"
+
+def test_breaker_opens_and_closes(breakers):
+    command = CommandGuard("tests.Breaker", 0.05)
+    for _ in range(2):
+        with pytest.raises(CommandSkipped):
+            command.call(_slow(0.2))
+    assert command.breaker.state == OPEN
+
+    calls = list()
+    with pytest.raises(CommandSkipped) as skipped:
+        command.call(lambda: calls.append(1))
+    assert skipped.value.reason == "open" and not calls
+
+    time.sleep(0.1)
+    # The first call after the cooldown probes the command, and closes the breaker.
+    assert command.call(_slow(0)) == "https://slow/"
+    assert command.breaker.state == CLOSED
+
+def test_errors_count_as_failures(breakers):
+    command = CommandGuard("tests.Errors", 0.5)
+
+    def broken():
+        raise RuntimeError("broken")
+
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            command.call(broken)
+    assert command.breaker.state == OPEN
+
+SLOW_IMPORT = '''
+import time
+from src.commands.arguments_command import Usagi12WithoutArgumentsCommand
+
+time.sleep(0.3)
+
+class Slow(Usagi12WithoutArgumentsCommand):
+
+    def redirect(self, language):
+        return "https://imported/"
+
+    @property
+    def name(self):
+        return "Shared"
+
+    @property
+    def time_budget(self):
+        return 0.1
+
+    description = "Takes longer to import than its budget"
+    bindings = None
+    slashes = None
+    triggers = ("slow",)
+    languages = None
+'''
+
+def test_lazy_import_is_outside_the_budget(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    (tmp_path / "guard_slow_import.py").write_text(SLOW_IMPORT)
+    lazy = LazyCommand("guard_slow_import", {
+        'class': "Slow", 'name': "Shared", 'triggers': ["slow"], 'slashes': [], 'bindings': [], 'languages': [],
+        'description': "", 'cacheable': True, 'arguments': False, 'asynchronous': False, 'deterministic': True,
+        'time_budget': 0.1, 'default': None,
+    })
+
+    item = LookupItem.from_command(lazy)
+    assert item.redirect(None, ("slow",)) == "https://imported/"
+    assert item._guard.breaker.failures == 0
+    assert item._guard.name == "guard_slow_import.Slow"
+
+def test_breakers_are_keyed_by_qualified_name():
+    first = type("Shared", (), {'qualified_name': "one.Shared", 'name': "Shared", 'time_budget': 0.1, 'default': None})()
+    second = type("Shared", (), {'qualified_name': "two.Shared", 'name': "Shared", 'time_budget': 0.1, 'default': None})()
+
+    assert guard_for(first).breaker is not guard_for(second).breaker
+    assert guard_for(first).breaker is guard_for(first).breaker
+
+def _command(name, time_budget=None):
+    return type(name, (), {'qualified_name': "tests." + name, 'name': name, 'time_budget': time_budget, 'default': None})()
+
+def test_only_asynchronous_or_budgeted_commands_are_guarded(monkeypatch):
+    assert guard_for(_command("Formats")) is None
+    assert guard_for(_command("Inline", 0), asynchronous=True) is None
+    assert guard_for(_command("Budgeted", 0.1)).budget == 0.1
+    assert guard_for(_command("Fetches"), asynchronous=True).budget == guard.COMMAND_TIME_BUDGET
+
+    monkeypatch.setattr(guard, "GUARD_SYNC_COMMANDS", True)
+    assert guard_for(_command("Formats")).budget == guard.COMMAND_TIME_BUDGET
+
+def test_formatting_commands_run_inline():
+    from commands.google import Google
+    item = LookupItem.from_command(Google())
+
+    assert item._guard is None
+    assert item.redirect(None, ("g", "cats")) == "https://www.google.com/search?q=cats"
@@ -0,0 +1,139 @@
+import threading
+
+from langcodes import Language
+
+from src.athenaeum.query import parse_query
+
+COMMAND = '''
+from src.commands.arguments_command import Usagi12WithArgumentsCommand
+
+class {name}(Usagi12WithArgumentsCommand):
+
+    def redirect(self, args, language):
+        return "{url}" + "+".join(args[1:])
+
+    @property
+    def description(self):
+        return "Reloaded"
+
+    @property
+    def bindings(self):
+        return None
+
+    @property
+    def slashes(self):
+        return None
+
+    @property
+    def triggers(self):
+        return ("{trigger}",)
+
+    @property
+    def languages(self):
+        return None
+'''
+
+def _write(path, url, trigger="scx", name="Scratch"):
+    # Versions differ in length, so neither the fingerprint nor the bytecode cache can miss the change.
+    path.write_text(COMMAND.format(name=name, url=url, trigger=trigger))
+
+def _search(text):
+    from src.athenaeum import primoroot
+    return primoroot.search(parse_query(text), (Language.get("en"),))
+
+def test_added_files_are_loaded(loader, scratch):
+    assert not loader.reload()
+    _write(scratch / "added.py", "https://added/")
+
+    assert loader.reload()
+    assert _search("scx cats") == "https://added/cats"
+    assert [c.name for c in loader.COMMAND_FILES["commands/scratch/added.py"].commands] == ["Scratch"]
+
+def test_edited_files_are_reloaded(loader, scratch):
+    path = scratch / "edited.py"
+    _write(path, "https://v1/")
+    loader.reload()
+    assert _search("scx cats") == "https://v1/cats"
+
+    _write(path, "https://version2/")
+    assert loader.reload()
+    assert _search("scx cats") == "https://version2/cats"
+
+    # Unchanged files are neither re-imported nor rebuilt.
+    assert not loader.reload()
+
+def test_broken_files_keep_their_previous_version(loader, scratch, errors):
+    path = scratch / "broken.py"
+    _write(path, "https://v1/")
+    loader.reload()
+
+    path.write_text(COMMAND.format(name="Scratch", url="https://v2/", trigger="scx") + "\ndef broken(:\n")
+    assert not loader.reload()
+    assert len(errors) == 1 and "commands/scratch/broken.py" in errors[0] and "keeping previous version" in errors[0]
+    assert _search("scx cats") == "https://v1/cats"
+
+    # Once fixed, the file is loaded again.
+    _write(path, "https://version3/")
+    assert loader.reload()
+    assert _search("scx cats") == "https://version3/cats"
+
+def test_removed_files_are_unloaded(loader, scratch):
+    path = scratch / "removed.py"
+    _write(path, "https://removed/")
+    loader.reload()
+    assert _search("scx cats") == "https://removed/cats"
+
+    path.unlink()
+    assert loader.reload()
+    assert "commands/scratch/removed.py" not in loader.COMMAND_FILES
+    assert _search("scx cats") == "https://www.google.com/search?q=scx%20cats"
+
+def test_registry_is_swapped_once_complete(loader, scratch, monkeypatch):
+    first, second = scratch / "first.py", scratch / "second.py"
+    _write(first, "https://first/", "sca", "First")
+    _write(second, "https://second/", "scb", "Second")
+    loader.reload()
+    previous = loader.REGISTRY
+
+    # While the new registry is being built, readers still see the whole previous one.
+    seen = list()
+    add_command = loader.Registry.add_command
+    def add_and_look(registry, command):
+        add_command(registry, command)
+        seen.append((loader.REGISTRY is previous, _search("sca x"), _search("scb x")))
+    monkeypatch.setattr(loader.Registry, "add_command", add_and_look)
+
+    _write(first, "https://first-v2/", "sca", "First")
+    _write(second, "https://second-v2/", "scb", "Second")
+    assert loader.reload()
+
+    assert seen and all(s == (True, "https://first/x", "https://second/x") for s in seen)
+    assert loader.REGISTRY is not previous and loader.TRIGGER_LOOKUP is loader.REGISTRY.triggers
+    assert (_search("sca x"), _search("scb x")) == ("https://first-v2/x", "https://second-v2/x")
+
+def test_concurrent_readers_see_one_version(loader, scratch):
+    first, second = scratch / "first.py", scratch / "second.py"
+    _write(first, "https://a/", "sca", "First")
+    _write(second, "https://b/", "scb", "Second")
+    loader.reload()
+
+    results, done = set(), threading.Event()
+    def read():
+        while not done.is_set():
+            # Requests take a single reference to the registry, see primoroot.resolve.
+            registry = loader.REGISTRY
+            results.add((registry.triggers.get("sca").redirect(None, ("sca",)),
+                         registry.triggers.get("scb").redirect(None, ("scb",))))
+    reader = threading.Thread(target=read)
+    reader.start()
+    try:
+        for version in range(1, 6):
+            _write(first, "https://a{}/".format("v" * version), "sca", "First")
+            _write(second, "https://b{}/".format("v" * version), "scb", "Second")
+            assert loader.reload()
+    finally:
+        done.set()
+        reader.join()
+
+    assert results
+    assert all(a.replace("https://a", "") == b.replace("https://b", "") for a, b in results)
@@ -0,0 +1,22 @@
+import logging
+
+import pytest
+
+from src import log
+
+@pytest.mark.parametrize("setting, level", [
+    ("debug", logging.DEBUG),
+    ("WARNING", logging.WARNING),
+    (logging.ERROR, logging.ERROR),
+    ("FOO", logging.INFO),
+    ("", logging.INFO),
+])
+def test_log_level(setting, level):
+    assert log._log_level(setting) == level
+
+def test_unknown_level_still_gates(monkeypatch):
+    monkeypatch.setattr(log, "LOG_LEVEL", log._log_level("verbose"))
+
+    assert log.enabled(log.INFO)
+    assert not log.enabled(log.DEBUG)
+    log.debug("Not formatted: {}", log.Lazy(lambda: 1 / 0))
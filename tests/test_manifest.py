@@ -0,0 +1,71 @@
+import json
+
+from src.athenaeum.lookup_item import LookupItem
+from src.athenaeum.manifest import LazyCommand, describe_command, read_manifest, write_manifest
+
+NAMED_COMMAND = '''
+from src.commands.arguments_command import Usagi12WithArgumentsCommand
+
+class Named(Usagi12WithArgumentsCommand):
+
+    def redirect(self, args, language):
+        return "https://named/" + "+".join(args[1:])
+
+    @property
+    def name(self):
+        return "my-named"
+
+    @property
+    def description(self):
+        return "Reports a name that is not its class name"
+
+    @property
+    def bindings(self):
+        return None
+
+    @property
+    def slashes(self):
+        return None
+
+    @property
+    def triggers(self):
+        return ("nm",)
+
+    @property
+    def languages(self):
+        return None
+'''
+
+def _restore(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    (tmp_path / "manifest_named.py").write_text(NAMED_COMMAND)
+    from manifest_named import Named
+
+    path = str(tmp_path / "registry.manifest.json")
+    write_manifest([{'module': "manifest_named", 'commands': [describe_command(Named())]}], path)
+    entry = read_manifest(path)[0]
+    return LazyCommand(entry['module'], entry['commands'][0])
+
+def test_round_trip_keeps_custom_name(tmp_path, monkeypatch):
+    lazy = _restore(tmp_path, monkeypatch)
+
+    assert lazy.name == "my-named"
+    assert lazy.triggers == ("nm",)
+    assert lazy.redirect(("nm", "a", "b"), None) == "https://named/a+b"
+    assert LookupItem.from_command(lazy, guarded=False).redirect(None, ("nm", "c")) == "https://named/c"
+
+def test_lazy_command_is_described_by_its_entry(tmp_path, monkeypatch):
+    lazy = _restore(tmp_path, monkeypatch)
+
+    spec = describe_command(lazy)
+    assert spec['class'] == "Named"
+    assert spec['name'] == "my-named"
+    # Describing it again must not import the command.
+    assert lazy._command is None
+    assert json.loads(json.dumps(spec)) == spec
+
+def test_unknown_version_is_ignored(tmp_path):
+    path = tmp_path / "registry.manifest.json"
+    path.write_text(json.dumps({'version': 0, 'files': [{}]}))
+
+    assert read_manifest(str(path)) == list()
@@ -0,0 +1,93 @@
+import sqlite3
+
+import pytest
+
+ALICE = {'X-Usagi12-Token': "alice"}
+BOB = {'X-Usagi12-Token': "bob"}
+
+def _location(app, query, headers=None):
+    return app.get("/bunny", query_string={'query': query}, headers=headers or {}).headers['Location']
+
+def test_add_replace_and_remove(overlays):
+    overlays.set_shortcut("alice", "trigger", "YT", "https://tube/{query}", "Tube")
+    overlays.set_shortcut("alice", "slash", "d/", "https://docs/{query}")
+    overlays.set_shortcut("alice", "trigger", "yt", "https://tube2/{query}")
+
+    assert overlays.list_shortcuts("alice") == [
+        {'kind': "slash", 'binding': "d", 'url': "https://docs/{query}", 'description': ""},
+        {'kind': "trigger", 'binding': "yt", 'url': "https://tube2/{query}", 'description': ""},
+    ]
+    assert overlays.list_shortcuts("bob") == []
+
+    assert overlays.remove_shortcut("alice", "trigger", "YT")
+    assert not overlays.remove_shortcut("alice", "trigger", "yt")
+    assert [s['binding'] for s in overlays.list_shortcuts("alice")] == ["d"]
+
+@pytest.mark.parametrize("kind, binding, url", [
+    ("alias", "yt", "https://tube/"),
+    ("trigger", "", "https://tube/"),
+    ("trigger", "two words", "https://tube/"),
+    ("slash", "a/b", "https://tube/"),
+    ("trigger", "yt", "javascript:alert(1)"),
+    ("regex", "(", "https://tube/"),
+    ("regex", "(a+)+$", "https://tube/"),
+])
+def test_invalid_shortcuts_are_refused(overlays, kind, binding, url):
+    with pytest.raises(ValueError):
+        overlays.set_shortcut("alice", kind, binding, url)
+    assert overlays.list_shortcuts("alice") == []
+
+def test_shortcut_limit(overlays, monkeypatch):
+    monkeypatch.setattr(overlays, "OVERLAY_MAX_SHORTCUTS", 2)
+    overlays.set_shortcut("alice", "trigger", "a", "https://a/")
+    overlays.set_shortcut("alice", "trigger", "b", "https://b/")
+
+    with pytest.raises(ValueError):
+        overlays.set_shortcut("alice", "trigger", "c", "https://c/")
+    # Replacing an existing shortcut does not count against the limit.
+    overlays.set_shortcut("alice", "trigger", "b", "https://b2/")
+
+def test_overlay_comes_before_the_registry(app, overlays):
+    overlays.set_shortcut("alice", "trigger", "yt", "https://tube/{query}")
+    overlays.set_shortcut("alice", "slash", "yt", "https://slash/{query}")
+    overlays.set_shortcut("alice", "regex", r"^[A-Z]+-\d+$", "https://tickets/{query}")
+
+    assert _location(app, "yt cats", ALICE) == "https://tube/cats"
+    assert _location(app, "YT", ALICE) == "https://tube/"
+    assert _location(app, "yt/cats", ALICE) == "https://slash/cats"
+    assert _location(app, "ABC-12", ALICE) == "https://tickets/ABC-12"
+    # Everything else falls through to the registry.
+    assert _location(app, "g cats", ALICE) == "https://www.google.com/search?q=cats"
+    # Other users, and requests without a token, are not affected.
+    assert _location(app, "yt cats", BOB) == "https://youtube.com/results?search_query=cats"
+    assert _location(app, "yt cats") == "https://youtube.com/results?search_query=cats"
+
+def test_changes_apply_to_the_next_request(app, overlays):
+    assert _location(app, "yt cats", ALICE) == "https://youtube.com/results?search_query=cats"
+
+    response = app.post("/shortcuts", json={'kind': "trigger", 'binding': "yt", 'url': "https://tube/{query}"}, headers=ALICE)
+    assert response.status_code == 200
+    assert _location(app, "yt cats", ALICE) == "https://tube/cats"
+
+    response = app.delete("/shortcuts", query_string={'kind': "trigger", 'binding': "yt"}, headers=ALICE)
+    assert response.get_json() == {'shortcuts': []}
+    assert _location(app, "yt cats", ALICE) == "https://youtube.com/results?search_query=cats"
+
+def test_writes_by_other_processes_are_picked_up(overlays, monkeypatch):
+    overlays.set_shortcut("alice", "trigger", "yt", "https://tube/")
+    monkeypatch.setattr(overlays, "_last_refresh_check", 0.0)
+    assert overlays.get_overlay("alice") is not None
+
+    with sqlite3.connect(overlays.OVERLAY_DB) as connection:
+        connection.execute("DELETE FROM shortcuts")
+    connection.close()
+    monkeypatch.setattr(overlays, "_last_refresh_check", 0.0)
+
+    assert overlays.get_overlay("alice") is None
+
+def test_suggestions_prefer_the_overlay(app, overlays):
+    overlays.set_shortcut("alice", "trigger", "yt", "https://tube/", "My tube")
+
+    completions, descriptions = app.get("/suggest", query_string={'q': "y"}, headers=ALICE).get_json()[1:]
+    assert completions.count("yt") == 1
+    assert descriptions[completions.index("yt")] == "My tube"
@@ -0,0 +1,201 @@
+import re
+
+import pytest
+
+from langcodes import Language
+
+from src.athenaeum.guard import CommandSkipped
+from src.athenaeum.lookup_item import LookupItem
+from src.athenaeum.query import parse_query
+from src.athenaeum.registry import Registry
+from src.commands.arguments_command import Usagi12WithArgumentsCommand
+from src.commands.template_command import TemplateCommand, bang_definitions
+
+EN, JA = (Language.get("en"),), (Language.get("ja"), Language.get("en"))
+
+class Counting(Usagi12WithArgumentsCommand):
+    """
+    Returns a url naming the negotiated language, and counts its calls.
+    """
+
+    def __init__(self, trigger="cx", cacheable=True, binding=None):
+        self.calls = 0
+        self._trigger = trigger
+        self._cacheable = cacheable
+        self._binding = binding
+
+    def redirect(self, args, language):
+        self.calls += 1
+        return "https://{}/{}/{}".format(self._trigger, language or "any", "+".join(args[1:]))
+
+    @property
+    def cacheable(self):
+        return self._cacheable
+
+    @property
+    def description(self):
+        return "Counts its calls"
+
+    @property
+    def bindings(self):
+        return (re.compile(self._binding),) if self._binding else None
+
+    @property
+    def slashes(self):
+        return (self._trigger,)
+
+    @property
+    def triggers(self):
+        return (self._trigger,)
+
+    @property
+    def languages(self):
+        return ("en", "ja")
+
+class Failing(Counting):
+
+    def redirect(self, args, language):
+        self.calls += 1
+        raise RuntimeError("down")
+
+@pytest.fixture
+def primoroot(loader, monkeypatch):
+    from src.athenaeum import primoroot
+    primoroot.RESULT_CACHE.clear()
+    yield primoroot
+    primoroot.RESULT_CACHE.clear()
+
+@pytest.fixture
+def registry(loader, primoroot, monkeypatch):
+    """
+    An empty registry in place of the loaded one. Add commands, then call _finalise().
+    """
+    registry = Registry()
+    monkeypatch.setattr(loader, "REGISTRY", registry)
+    return registry
+
+def _finalise(registry):
+    from src.athenaeum import loader
+    registry.finalise(loader.DEFAULT_LOOKUP, adaptive=False)
+
+def _search(primoroot, text, language_accept=EN):
+    return primoroot.search(parse_query(text), language_accept)
+
+def test_results_are_cached(primoroot, registry):
+    command = Counting()
+    registry.add_command(command)
+    _finalise(registry)
+
+    assert _search(primoroot, "cx a") == _search(primoroot, "cx a") == "https://cx/en/a"
+    assert command.calls == 1
+    _search(primoroot, "cx b")
+    assert command.calls == 2
+
+def test_uncacheable_commands_are_never_cached(primoroot, registry):
+    command = Counting(cacheable=False)
+    registry.add_command(command)
+    _finalise(registry)
+
+    for _ in range(3):
+        assert _search(primoroot, "cx a") == "https://cx/en/a"
+    primoroot.search_many([(parse_query("cx a"), EN)] * 2)
+    assert command.calls == 4
+    assert len(primoroot.RESULT_CACHE) == 0
+
+def test_cache_key_includes_the_accepted_languages(primoroot, registry):
+    command = Counting()
+    registry.add_command(command)
+    _finalise(registry)
+
+    assert _search(primoroot, "cx a", EN) == "https://cx/en/a"
+    assert _search(primoroot, "cx a", JA) == "https://cx/ja/a"
+    assert _search(primoroot, "cx a", EN) == "https://cx/en/a"
+    assert _search(primoroot, "cx a", tuple()) == "https://cx/any/a"
+    assert command.calls == 3
+
+def test_fallbacks_of_skipped_commands_are_not_cached(primoroot, registry):
+    calls = list()
+    def skipped(args, language):
+        calls.append(args)
+        raise CommandSkipped("Skipped", "open", "https://skipped/" if len(calls) == 1 else None)
+    registry.triggers["sx"] = LookupItem(skipped, None, name="Skipped")
+    _finalise(registry)
+
+    assert _search(primoroot, "sx a") == "https://skipped/"
+    # Without a default, the query goes to the default command.
+    assert _search(primoroot, "sx a") == "https://www.google.com/search?q=sx%20a"
+    assert primoroot.search_many([(parse_query("sx a"), EN)]) == ["https://www.google.com/search?q=sx%20a"]
+    assert len(calls) == 3
+    assert len(primoroot.RESULT_CACHE) == 0
+
+def test_errors_are_not_cached(primoroot, registry):
+    def failing(args, language):
+        raise RuntimeError("down")
+    registry.triggers["fx"] = LookupItem(failing, None, name="Failing")
+    _finalise(registry)
+
+    with pytest.raises(RuntimeError):
+        _search(primoroot, "fx a")
+    assert primoroot.search_many([(parse_query("fx a"), EN)]) == [None]
+    assert len(primoroot.RESULT_CACHE) == 0
+
+def test_reload_clears_the_cache(loader, primoroot, scratch):
+    _search(primoroot, "g cats")
+    assert len(primoroot.RESULT_CACHE) == 1
+
+    (scratch / "empty.py").write_text("# No commands yet.\n")
+    assert loader.reload()
+    assert len(primoroot.RESULT_CACHE) == 0
+
+@pytest.mark.parametrize("text, url", [
+    ("cx a b", "https://cx/en/a+b"),
+    ("CX", "https://cx/en/"),
+    ("cx/a b", "https://cx/en/a+b"),
+    ("ticket-1", "https://cx/en/"),
+])
+def test_redirect_is_called_once_per_query(app, primoroot, registry, text, url):
+    command = Counting(cacheable=False, binding=r"^ticket-\d+$")
+    registry.add_command(command)
+    _finalise(registry)
+
+    assert app.get("/bunny", query_string={'query': text}, headers={'Accept-Language': "en"}).headers['Location'] == url
+    assert command.calls == 1
+
+def test_command_errors_are_counted_and_fall_back(app, primoroot, registry):
+    import usagi12
+    command = Failing("fx")
+    registry.add_command(command)
+    _finalise(registry)
+    errors = primoroot.COMMAND_ERRORS.value("Failing")
+
+    assert app.get("/bunny", query_string={'query': "fx a"}).headers['Location'] == usagi12.FALLBACK_URL
+    assert primoroot.COMMAND_ERRORS.value("Failing") == errors + 1
+    # Errors are not retried.
+    assert command.calls == 1
+
+    assert app.post("/bunny/batch", json=["fx b", "g c"]).get_json()['urls'] == [usagi12.FALLBACK_URL, "https://www.google.com/search?q=c"]
+    assert primoroot.COMMAND_ERRORS.value("Failing") == errors + 2
+    assert command.calls == 2
+
+def test_template_commands_share_one_label(primoroot, registry, overlays):
+    for name, definition in bang_definitions([{'t': "bx", 'u': "https://bx/?q={{{s}}}"}, {'t': "by", 'u': "https://by/?q={{{s}}}"}]):
+        registry.add_command(TemplateCommand(name, definition))
+    registry.add_command(Counting())
+    _finalise(registry)
+    overlays.set_shortcut("alice", "trigger", "ox", "https://ox/{query}")
+    overlays.set_shortcut("alice", "regex", "^oy$", "https://oy/")
+    matches = primoroot.MATCHES.value("TemplateCommand", "TRIGGER")
+
+    for text in ("!bx a", "!by a", "!by a"):
+        _search(primoroot, text)
+    assert primoroot.MATCHES.value("TemplateCommand", "TRIGGER") == matches + 3
+    assert primoroot.MATCHES.value("bang:bx", "TRIGGER") == 0
+    # Python commands are still reported by name.
+    _search(primoroot, "cx a")
+    assert primoroot.MATCHES.value("Counting", "TRIGGER") >= 1
+
+    shortcuts = primoroot.MATCHES.value("overlay", "TRIGGER"), primoroot.MATCHES.value("overlay", "REGEX")
+    overlay = overlays.get_overlay("alice")
+    assert primoroot.search(parse_query("ox a"), EN, overlay) == "https://ox/a"
+    assert primoroot.search(parse_query("oy"), EN, overlay) == "https://oy/"
+    assert (primoroot.MATCHES.value("overlay", "TRIGGER"), primoroot.MATCHES.value("overlay", "REGEX")) == (shortcuts[0] + 1, shortcuts[1] + 1)
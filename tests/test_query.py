@@ -0,0 +1,53 @@
+import pytest
+
+from src.athenaeum.query import parse_query
+
+def test_language_override():
+    query = parse_query("  foo bar -ja ")
+
+    assert query.text == "foo bar -ja"
+    assert query.command == "foo bar"
+    assert query.args == ("foo", "bar")
+    assert query.tokens == ("foo", "bar", "-ja")
+    assert str(query.language) == "ja"
+
+def test_only_the_last_override_counts():
+    query = parse_query("g  a -en -ja  b")
+
+    assert str(query.language) == "ja"
+    assert query.args == ("g", "a", "-en", "b")
+    # The rest of the query keeps its spacing.
+    assert query.command == "g  a -en b"
+
+def test_region_subtag():
+    query = parse_query("w berlin -de-AT")
+
+    assert str(query.language) == "de-AT"
+    assert query.command == "w berlin"
+
+@pytest.mark.parametrize("text", [
+    "python -java",
+    "cats -site:reddit.com",
+    "-ja foo",
+    "g -",
+    "g -zz-ZZZZZZZZZ",
+])
+def test_words_that_are_not_overrides(text):
+    query = parse_query(text)
+
+    assert query.language is None
+    assert query.command == text
+    assert query.args == tuple(text.split())
+
+def test_trigger_and_slash():
+    query = parse_query("g/some query -ja")
+
+    assert query.trigger == "g/some"
+    assert query.slash == "g"
+    assert query.slash_args == ("g", "some", "query")
+    assert parse_query("yt cats").slash is None
+
+def test_empty_query():
+    query = parse_query("   ")
+
+    assert (query.command, query.args, query.trigger, query.language) == ("", (), None, None)
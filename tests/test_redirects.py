@@ -0,0 +1,27 @@
+from src.http.redirects import REDIRECT_MAX_AGE
+
+def test_deterministic_redirects_are_cacheable(app):
+    response = app.get("/bunny", query_string={'query': "yt"})
+
+    assert response.status_code == 302
+    assert response.headers['Location'] == "https://youtube.com"
+    assert response.headers['Cache-Control'] == "private, max-age={}".format(REDIRECT_MAX_AGE)
+    assert "X-Usagi12-Token" in response.headers['Vary']
+
+    revalidated = app.get("/bunny", query_string={'query': "yt"}, headers={'If-None-Match': response.headers['ETag']})
+    assert revalidated.status_code == 304
+
+def test_redirects_with_arguments_are_not_cached(app):
+    response = app.get("/bunny", query_string={'query': "yt cats"})
+
+    assert response.status_code == 302
+    assert 'Cache-Control' not in response.headers
+
+def test_redirects_are_not_cached_for_overlay_users(app, overlays):
+    by_header = app.get("/bunny", query_string={'query': "yt"}, headers={'X-Usagi12-Token': "secret"})
+    by_parameter = app.get("/bunny", query_string={'query': "yt", 'token': "secret"})
+
+    for response in (by_header, by_parameter):
+        assert response.headers['Location'] == "https://youtube.com"
+        assert 'Cache-Control' not in response.headers
+        assert 'ETag' not in response.headers
@@ -0,0 +1,32 @@
+import re
+
+import pytest
+
+from src.athenaeum.regex_audit import analyse, can_overlap
+
+@pytest.mark.parametrize("a, b", [
+    (r'(a?)b', r'a'),
+    (r'(?:a|)b', r'a'),
+    (r'(a|b?)c', r'c'),
+    (r'x*y', r'x'),
+    (r'(?i)A', r'a'),
+    (r'\w+', r'q'),
+    (r'(a)|\1', r'z'),
+    (r'a?', r'z'),
+])
+def test_overlapping(a, b):
+    assert can_overlap(re.compile(a), re.compile(b))
+    assert can_overlap(re.compile(b), re.compile(a))
+
+@pytest.mark.parametrize("a, b", [
+    (r'(a?)b', r'c'),
+    (r'^[A-Z]{2,5}-\d+$', r'\d+'),
+    (r'yt', r'gh'),
+    (r'(ab)+', r'b'),
+])
+def test_disjoint(a, b):
+    assert not can_overlap(re.compile(a), re.compile(b))
+
+def test_nested_quantifiers_are_reported():
+    assert analyse(re.compile(r'(a+)+$'))
+    assert not analyse(re.compile(r'^yt \w+$'))
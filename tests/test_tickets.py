@@ -0,0 +1,24 @@
+import sqlite3
+from contextlib import closing
+
+from langcodes import Language
+
+from src.athenaeum.query import parse_query
+
+def _search(text):
+    from src.athenaeum import primoroot
+    return primoroot.search(parse_query(text), (Language.get("en"),))
+
+def test_results_follow_the_database(loader, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # The database is missing, so the ticket is searched for instead.
+    assert _search("USG-7") == "https://tracker.example.com/search?q=USG-7"
+
+    with closing(sqlite3.connect("tickets.sqlite3")) as connection:
+        connection.execute("CREATE TABLE tickets (key TEXT PRIMARY KEY, url TEXT)")
+        connection.execute("INSERT INTO tickets VALUES ('USG-7', 'https://tracker.example.com/browse/USG-7')")
+        connection.commit()
+
+    assert _search("USG-7") == "https://tracker.example.com/browse/USG-7"
+    # Searches that only look like keys are left to the default.
+    assert _search("covid-19") == "https://www.google.com/search?q=covid-19"
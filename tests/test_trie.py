@@ -0,0 +1,43 @@
+from src.athenaeum.trie import Trie
+
+def test_lookups_ignore_case():
+    trie = Trie()
+    trie["GitHub"] = "gh"
+    trie["straße"] = "street"
+
+    assert trie.get("github") == trie.get("GITHUB") == "gh"
+    assert "gItHuB" in trie
+    # Case folding, not just lowercasing.
+    assert trie.get("STRASSE") == "street"
+    assert trie.get("gitlab") is None
+    assert trie.get(None, "default") == "default"
+
+def test_first_inserted_key_is_displayed():
+    trie = Trie()
+    trie["GitHub"] = 1
+    trie["github"] = 2
+
+    assert len(trie) == 1
+    assert list(trie.items()) == [("GitHub", 2)]
+
+def test_completions_ignore_case_and_prefer_short_keys():
+    trie = Trie(limit=3)
+    for key in ("yt", "YouTube", "yahoo", "yandex", "Yelp", "g"):
+        trie[key] = key
+
+    assert trie.complete("Y") == [("yt", "yt"), ("Yelp", "Yelp"), ("yahoo", "yahoo")]
+    assert trie.complete("YOU") == [("YouTube", "YouTube")]
+    assert trie.complete("x") == []
+
+def test_prepared_completions_match():
+    trie = Trie()
+    for key in ("wiki", "wikipedia", "w", "wa", "Wolfram"):
+        trie[key] = key
+    expected = {prefix: trie.complete(prefix) for prefix in ("", "w", "W", "wi", "wo")}
+
+    prepared = Trie()
+    for key in ("wiki", "wikipedia", "w", "wa", "Wolfram"):
+        prepared[key] = key
+    prepared.prepare()
+
+    assert {prefix: prepared.complete(prefix) for prefix in expected} == expected
@@ -1,13 +1,28 @@
+import hmac
+import json
 import logging
 
+from typing import Optional
+from urllib.parse import quote
+
 from ayumi import Ayumi
 
-from flask import Flask, request, redirect
+from flask import Flask, Response, abort, jsonify, request, redirect
 from langcodes import DEFAULT_LANGUAGE, Language
+from markupsafe import escape
+from werkzeug.wrappers import Request
 
-from commands.google import Google # Default fallback
+from src import log
 from src.http import language as language_helper
-from src.athenaeum import primoroot
+from src.http import redirects
+from src.http.fast_path import FastPath
+from src.athenaeum import loader, metrics, overlay, primoroot
+from src.athenaeum.backends import backend_stats
+from src.athenaeum.cache import cache_stats
+from src.athenaeum.guard import breaker_stats
+from src.athenaeum.metrics import STAGE_LATENCY
+from src.athenaeum.query import parse_query
+from src.config import settings
 
 
 app = Flask(__name__)
@@ -15,29 +30,201 @@ app = Flask(__name__)
 werkzeug_logger = logging.getLogger('werkzeug')
 werkzeug_logger.setLevel(logging.ERROR)
 
+# Serve /bunny straight from WSGI, without Flask's routing and request handling.
+BUNNY_FAST_PATH: bool = settings.get("BUNNY_FAST_PATH", False)
+
+# Largest number of queries accepted by /bunny/batch in one request.
+BATCH_MAX_QUERIES: int = settings.get("BATCH_MAX_QUERIES", 1000)
+
+OPENSEARCH_DESCRIPTION = """<?xml version="1.0" encoding="UTF-8"?>
+<OpenSearchDescription xmlns="http://a9.com/-/spec/opensearch/1.1/">
+  <ShortName>Usagi12</ShortName>
+  <Description>Usagi12 smart bookmarks</Description>
+  <InputEncoding>UTF-8</InputEncoding>
+  <Url type="text/html" method="get" template="{root}bunny?query={{searchTerms}}{token}"/>
+  <Url type="application/x-suggestions+json" method="get" template="{root}suggest?q={{searchTerms}}{token}"/>
+</OpenSearchDescription>
+"""
+
+# Url redirected to when a query cannot be resolved, from the registry's shared default entry.
+FALLBACK_URL: str = loader.DEFAULT_LOOKUP.redirect(Language.get(DEFAULT_LANGUAGE), ())
+
+# Load langcodes data now rather than on the first request this worker serves.
+language_helper.warm_up()
+
+# Allow reloading commands in place with `kill -HUP <pid>`.
+loader.install_reload_signal()
+
+def user_token(req: Request) -> Optional[str]:
+    """
+    Return the token identifying the user's shortcut overlay, from the ?token= parameter
+    or the X-Usagi12-Token header, if any.
+    """
+    return req.args.get('token') or req.headers.get(redirects.TOKEN_HEADER) or None
+
 @app.route("/bunny", methods=['GET'])
 def bunny():
+    return handle_bunny(request)
+
+def handle_bunny(req: Request) -> Response:
+    """
+    Resolve the query of a /bunny request into a redirect. Shared by the Flask view and,
+    with BUNNY_FAST_PATH, the WSGI fast path, so it only uses the Werkzeug request.
+    """
+    loader.maybe_reload()
     try:
-        if 'query' not in request.args or not request.args['query']:
+        if 'query' not in req.args or not req.args['query']:
             raise Exception()
 
-        # Make a copy of the command for modification, and store original for logging
-        command = command_og = request.args['query'].strip()
-        Ayumi.debug("Received user command: {}".format(command))
+        # Split the query once, everything after this works from the parsed query
+        query = parse_query(req.args['query'])
+        log.debug("Received user command: {}", query.text)
 
         # Fetch the language used for the request
-        language_accept, command = language_helper.get_languages(request, command)
-        Ayumi.debug("Got languages: {}".format([x._str_tag for x in language_accept]))
+        with STAGE_LATENCY.time("languages"):
+            language_accept = language_helper.get_languages(req, query)
+        log.debug("Got languages: {}", log.Lazy(lambda: [x._str_tag for x in language_accept]))
 
-        url = primoroot.search(command, command_og, tuple(language_accept))
-        Ayumi.info('Redirecting "{}" to "{}'.format(command_og, url), color=Ayumi.LCYAN)
+        token = user_token(req)
+        with STAGE_LATENCY.time("search"):
+            url, deterministic, localised = primoroot.resolve(query, language_accept, overlay.get_overlay(token))
+        log.access('Redirecting "{}" to "{}"', query.text, url)
+        # Only redirects that cannot depend on the query text are cacheable by the browser,
+        # and not for users with a token, whose shortcuts may change at any time.
+        if deterministic and not (token and overlay.enabled()):
+            return redirects.cacheable_redirect(req, url, localised)
         return redirect(url)
         
     except Exception as e:
-        url = Google().redirect((), Language.get(DEFAULT_LANGUAGE))
-        Ayumi.warning("Caught error: {}, redirecting query to default: {}".format(e, url), Ayumi.LRED)
+        url = FALLBACK_URL
+        log.warning("Caught error: {}, redirecting query to default: {}", e, url, color=Ayumi.LRED)
         return redirect(url)
 
+@app.route("/bunny/batch", methods=['POST'])
+def bunny_batch():
+    """
+    Resolve a JSON list of queries in one request. Each item is either a query string,
+    or an object with a "query" and an optional "language" hint. The browser's
+    Accept-Language applies to every query. Returns {"urls": [...]} in input order.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, list):
+        abort(400)
+    if len(body) > BATCH_MAX_QUERIES:
+        abort(413)
+
+    accept = language_helper.parse_accept_languages(request)
+    resolvable = list()
+    for index, item in enumerate(body):
+        query, hint = (item, None) if isinstance(item, str) else \
+            (item.get('query'), item.get('language')) if isinstance(item, dict) else (None, None)
+        if not isinstance(query, str) or not isinstance(hint, (str, type(None))):
+            abort(400)
+
+        # Blank queries fall back to the default, as in /bunny.
+        if not query.strip():
+            continue
+        parsed = parse_query(query)
+        resolvable.append((index, (parsed, language_helper.resolve_languages(parsed, accept, hint))))
+
+    urls = [None] * len(body)
+    for (index, _), url in zip(resolvable, primoroot.search_many((q for _, q in resolvable), overlay.get_overlay(user_token(request)))):
+        urls[index] = url
+
+    return jsonify(urls=[url or FALLBACK_URL for url in urls])
+
+@app.route("/suggest", methods=['GET'])
+def suggestions():
+    """
+    OpenSearch suggestions for a partially typed command: [query, [completions], [descriptions]].
+    """
+    query = request.args.get('q', '').lstrip()
+    completions = primoroot.suggest(query, overlay.get_overlay(user_token(request)))
+    return Response(
+        json.dumps([query, [c for c, _ in completions], [i.description.strip() for _, i in completions]]),
+        mimetype="application/x-suggestions+json")
+
+@app.route("/opensearch.xml", methods=['GET'])
+def opensearch():
+    """
+    OpenSearch description, so browsers can add Usagi12 as a search engine with suggestions.
+    Given a ?token=, the search engine is added with the user's shortcut overlay.
+    """
+    root = escape(request.url_root)
+    token = request.args.get('token')
+    token = escape("&token=" + quote(token, safe="")) if token else ""
+    return Response(OPENSEARCH_DESCRIPTION.format(root=root, token=token), mimetype="application/opensearchdescription+xml")
+
+@app.route("/shortcuts", methods=['GET', 'POST', 'DELETE'])
+def shortcuts():
+    """
+    Manage the shortcuts of the user identified by the request's token.
+    - GET: List them, as {"shortcuts": [...]}.
+    - POST: Add or replace one, from a JSON object with "kind" (trigger, slash or regex),
+            "binding", "url" with an optional {query} placeholder, and an optional "description".
+    - DELETE: Remove the one given by the ?kind= and ?binding= parameters.
+    Disabled unless OVERLAY_DB is set.
+    """
+    if not overlay.enabled():
+        abort(404)
+    token = user_token(request)
+    if not token:
+        abort(401)
+
+    if request.method == 'POST':
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            abort(400)
+        try:
+            overlay.set_shortcut(token, body.get('kind'), body.get('binding'), body.get('url'), body.get('description') or "")
+        except ValueError as e:
+            return jsonify(error=str(e)), 400
+    elif request.method == 'DELETE':
+        if not overlay.remove_shortcut(token, request.args.get('kind', ''), request.args.get('binding', '')):
+            abort(404)
+
+    return jsonify(shortcuts=overlay.list_shortcuts(token))
+
+@app.route("/stats", methods=['GET'])
+def stats():
+    """
+    Report cache counters, the circuit breakers of failing commands, and the
+    calls in flight to the backends of asynchronous commands.
+    Only aggregate numbers are exposed, never queries.
+    """
+    return jsonify(caches=cache_stats(), breakers=breaker_stats(), backends=backend_stats())
+
+@app.route("/metrics", methods=['GET'])
+def prometheus_metrics():
+    """
+    Serve stage latencies, match counters and cache counters in the Prometheus text format.
+    """
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/admin/reload", methods=['POST'])
+def admin_reload():
+    """
+    Reload changed command files in this worker. Disabled unless ADMIN_TOKEN is set,
+    and requires it to be passed as a Bearer token.
+    """
+    token = settings.get("ADMIN_TOKEN")
+    provided = request.headers.get('Authorization', '')
+    if not token or not hmac.compare_digest(provided, "Bearer {}".format(token)):
+        abort(404)
+
+    changed = loader.reload()
+    registry = loader.REGISTRY
+    return jsonify(
+        reloaded=changed,
+        triggers=len(registry.triggers),
+        slashes=len(registry.slashes),
+        regexes=len(registry.regexes))
+
+if BUNNY_FAST_PATH:
+    app.wsgi_app = FastPath(app.wsgi_app, "/bunny", handle_bunny)
+# Record the full time spent on /bunny, so Flask's own overhead shows up in /metrics.
+app.wsgi_app = metrics.TimingMiddleware(app.wsgi_app, "/bunny", "request")
+
 if __name__ == "__main__":
     Ayumi.info("Now starting Usagi12 server in Flask debug mode", color=Ayumi.GREEN)
     app.run(host='0.0.0.0', port=6973, debug=True)
\ No newline at end of file